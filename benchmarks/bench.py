@@ -0,0 +1,143 @@
+"""
+Offline benchmarks of the Semantic Scholar and OpenAI code paths of literer.
+
+All traffic goes to local stand-ins (see mocks.py), so runs are free, repeatable
+and can be compared across changes. Tokens are counted one per word, unless
+--tiktoken is given, which needs network access the first time tiktoken loads an
+encoding. For each corpus size, the script reports the
+throughput, p50/p99 latency of the underlying calls, request counts and the peak
+Python memory of every benchmarked function.
+
+Usage:
+    python benchmarks/bench.py --sizes 10 100 1000 10000 --llm-latency 0.05
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import literer as lit  # noqa: E402
+from mocks import (FakeChatCompletion, MockScholarServer, make_corpus,  # noqa: E402
+                   offline_tokenizer)
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def measure(name, n_items, fn):
+    """
+    Run fn once and summarise its throughput, call latencies and peak memory.
+
+    A run failing even after the retries is reported in the "failed" column
+    instead of stopping the benchmark.
+    """
+    metrics = lit.get_metrics()
+    metrics.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    failed = ""
+    try:
+        fn()
+    except Exception as e:
+        failed = type(e).__name__
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = [e["latency"] for e in metrics.events if "latency" in e]
+    summary = metrics.summary()
+    return {
+        "benchmark": name,
+        "items": n_items,
+        "seconds": elapsed,
+        "items_per_second": n_items / elapsed if elapsed else float("inf"),
+        "p50_latency": percentile(latencies, 50),
+        "p99_latency": percentile(latencies, 99),
+        "llm_requests": sum(c["calls"] - c["cache_hits"] for c in summary["llm"].values()),
+        "llm_retries": sum(c["retries"] for c in summary["llm"].values()),
+        "http_requests": sum(c["calls"] for c in summary["http"].values()),
+        "http_retries": sum(c["retries"] for c in summary["http"].values()),
+        "repairs": sum(c.get("repaired", 0) + c.get("failed", 0)
+                       for c in summary["parsing"].values()),
+        "peak_memory_mb": peak / 2 ** 20,
+        "failed": failed or "-"
+    }
+
+
+def run(sizes, llm_latency, llm_error_rate, http_latency, http_error_rate,
+        max_in_flight, batch_size, malformed_rate=0.0, tiktoken=False):
+    # Short backoffs, the fake rate limits carry no Retry-After
+    lit.set_scheduler(lit.Scheduler(max_in_flight=max_in_flight, backoff=0.01))
+    # No client-side throttling against the local server, and short backoffs
+    lit.set_client(lit.ScholarClient(rate=1e6, burst=1e6, backoff=0.01))
+    topic = "heterogeneous treatment effects of active labor market policies"
+    results = []
+
+    for n in sizes:
+        corpus = make_corpus(n)
+        papers = [lit.scholar.extract_paper_info(p) for p in corpus]
+        excerpt = "\n\n".join(p["abstract"] for p in papers)
+        fake = FakeChatCompletion(latency=llm_latency, error_rate=llm_error_rate,
+                                  malformed_rate=malformed_rate)
+
+        tokenizer = contextlib.nullcontext() if tiktoken else offline_tokenizer()
+        with MockScholarServer(corpus, http_latency, http_error_rate), fake.patch(), tokenizer:
+            n_queries = math.ceil(n / 100)
+            results.append(measure("get_papers", n, lambda: [
+                lit.get_papers(f"q{k}", n_pubs=100) for k in range(n_queries)]))
+            results.append(measure("judge_paper", n, lambda: [
+                lit.judge_paper(p, topic, "Econometrica") for p in papers]))
+            results.append(measure("judge_papers", n, lambda: lit.judge_papers(
+                papers, topic, "Econometrica", batch_size=batch_size)))
+            results.append(measure("cascade_judge_papers", n, lambda: lit.cascade_judge_papers(
+                papers, topic, "Econometrica", batch_size=batch_size)))
+            results.append(measure("summarize_papers", n, lambda: lit.summarize_papers(
+                papers, topic)))
+            results.append(measure("give_feedback", n, lambda: lit.give_feedback(
+                excerpt, "Econometrica")))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--http-latency", type=float, default=0.02)
+    parser.add_argument("--http-error-rate", type=float, default=0.0)
+    parser.add_argument("--max-in-flight", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Share of judge and keyword replies which cannot be parsed")
+    parser.add_argument("--tiktoken", action="store_true",
+                        help="Count tokens with tiktoken instead of one per word, "
+                        "its encodings are downloaded on first use")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.llm_latency, args.llm_error_rate, args.http_latency,
+                  args.http_error_rate, args.max_in_flight, args.batch_size,
+                  args.malformed_rate, args.tiktoken)
+
+    columns = list(results[0])
+    print(" | ".join(f"{c:>16}" for c in columns))
+    for row in results:
+        print(" | ".join(f"{v:>16.4g}" if isinstance(v, float) else f"{v:>16}"
+                         for v in row.values()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
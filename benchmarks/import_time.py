@@ -0,0 +1,86 @@
+"""
+Import-time benchmark of literer.
+
+Each statement is timed in fresh interpreters, so that nothing is cached between
+runs, and the median is reported. The script fails if `import literer` loads one of
+the heavy dependencies or takes longer than --max-ms, so that it can guard the lazy
+imports of literer/__init__.py in CI.
+
+Usage:
+    python benchmarks/import_time.py --runs 10 --max-ms 50
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY_MODULES = ("openai", "tiktoken", "numpy", "requests")
+STATEMENTS = (
+    "import literer",
+    "from literer import get_papers",
+    "from literer import judge_papers",
+    "from literer import PaperSet",
+)
+
+# Run in the child interpreter: time the statement, list the heavy modules it loaded
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000,
+                  "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def probe(statement):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        p for p in (ROOT, os.environ.get("PYTHONPATH")) if p))
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement, heavy=HEAVY_MODULES)],
+        env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(runs):
+    results = []
+    for statement in STATEMENTS:
+        probes = [probe(statement) for _ in range(runs)]
+        results.append({
+            "statement": statement,
+            "median_ms": statistics.median(p["ms"] for p in probes),
+            "min_ms": min(p["ms"] for p in probes),
+            "loaded": probes[0]["loaded"]
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=50.0,
+                        help="Fail if the median of 'import literer' exceeds this")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(f"{'statement':>36} | {'median_ms':>10} | {'min_ms':>10} | loaded")
+    for row in results:
+        print(f"{row['statement']:>36} | {row['median_ms']:>10.2f} | "
+              f"{row['min_ms']:>10.2f} | {', '.join(row['loaded']) or '-'}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    bare = results[0]
+    if bare["loaded"]:
+        sys.exit(f"'import literer' loaded {', '.join(bare['loaded'])}")
+    if bare["median_ms"] > args.max_ms:
+        sys.exit(f"'import literer' took {bare['median_ms']:.1f} ms > {args.max_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
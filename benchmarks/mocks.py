@@ -0,0 +1,298 @@
+"""
+Local stand-ins for the Semantic Scholar and OpenAI APIs used by the benchmarks.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import openai.util
+
+from literer import scholar
+
+
+class WordEncoding:
+    """Offline stand-in for a tiktoken encoding, one token per space-separated word."""
+    def encode_ordinary(self, text):
+        return text.split(" ")
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(t) for t in texts]
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@contextmanager
+def offline_tokenizer():
+    """
+    Count tokens with a WordEncoding within the block.
+
+    tiktoken downloads its encodings on first use, which fails without network.
+    """
+    import literer.prompts
+    import literer.utils
+
+    encoding = WordEncoding()
+    originals = literer.utils.get_encoding, literer.prompts.get_encoding
+    literer.utils.get_encoding = literer.prompts.get_encoding = lambda model: encoding
+    try:
+        yield encoding
+    finally:
+        literer.utils.get_encoding, literer.prompts.get_encoding = originals
+
+
+def make_corpus(n_papers, seed=0):
+    """Generate n_papers synthetic Semantic Scholar paper objects."""
+    rng = random.Random(seed)
+    words = ["labor", "market", "policy", "treatment", "effect", "training",
+             "unemployment", "wage", "program", "evaluation", "heterogeneity",
+             "causal", "evidence", "worker", "job", "search", "benefit"]
+    corpus = []
+    for i in range(n_papers):
+        paper_id = f"{i:040x}"
+        title = " ".join(rng.choices(words, k=6)).capitalize()
+        corpus.append({
+            "paperId": paper_id,
+            "externalIds": {"DOI": f"10.0000/mock.{i}"},
+            "title": title,
+            "year": rng.randint(1990, 2023),
+            "authors": [{"name": f"Author {rng.randint(0, 999)}"} for _ in range(3)],
+            "venue": rng.choice(["Econometrica", "American Economic Review",
+                                 "Journal of Political Economy"]),
+            "abstract": " ".join(rng.choices(words, k=150)) + ".",
+            "citationStyles": {"bibtex": f"@article{{Mock{i},\n title={{{title}}}\n}}"},
+            "url": f"https://www.semanticscholar.org/paper/{paper_id}"
+        })
+    return corpus
+
+
+class MockScholarServer:
+    """
+    Local HTTP server imitating the search, bulk search and batch endpoints of Semantic Scholar.
+
+    The query 'q<k>' returns the k-th block of papers of the corpus, so that sweeps
+    over several queries cover the whole corpus.
+
+    Args:
+        corpus (list): The papers served, see make_corpus.
+        latency (float): Seconds waited before answering each request.
+        error_rate (float): Share of requests answered with 429 Too Many Requests.
+        retry_after (str, optional): The Retry-After header sent with each 429.
+        references (dict, optional): The paperIds each paper cites, keyed by paperId,
+            served with the citations they imply by the batch endpoint. Defaults to a
+            binary tree, the i-th paper citing the (2i+1)-th and (2i+2)-th.
+    """
+    def __init__(self, corpus, latency=0.0, error_rate=0.0, seed=0, retry_after=None,
+                 references=None):
+        self.corpus = corpus
+        self.by_id = {p["paperId"]: p for p in corpus}
+        if references is None:
+            ids = [p["paperId"] for p in corpus]
+            references = {pid: ids[2 * i + 1:2 * i + 3] for i, pid in enumerate(ids)}
+        self.references = references
+        self.citations = {}
+        for pid, cited in references.items():
+            for cited_id in cited:
+                self.citations.setdefault(cited_id, []).append(pid)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        # Requests per (method, path), e.g., ("GET", "/graph/v1/paper/search")
+        self.paths = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/graph/v1/"
+
+    def __enter__(self):
+        self._thread.start()
+        self._urls = (scholar.URL_KEYWORD, scholar.URL_BATCH, scholar.URL_BULK)
+        scholar.URL_KEYWORD = f"{self.base_url}paper/search?"
+        scholar.URL_BATCH = f"{self.base_url}paper/batch"
+        scholar.URL_BULK = f"{self.base_url}paper/search/bulk?"
+        return self
+
+    def __exit__(self, *exc):
+        scholar.URL_KEYWORD, scholar.URL_BATCH, scholar.URL_BULK = self._urls
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _answer(self, method, path, query, body):
+        with self._lock:
+            self.requests += 1
+            self.paths[method, path] += 1
+            rate_limited = self._rng.random() < self.error_rate
+        time.sleep(self.latency)
+        if rate_limited:
+            return 429, {"message": "Too Many Requests"}
+
+        if method == "GET" and path.endswith("/paper/search"):
+            limit = int(query.get("limit", ["10"])[0])
+            offset = int(query.get("offset", ["0"])[0])
+            match = re.fullmatch(r"q(\d+)", query.get("query", [""])[0])
+            block = int(match.group(1)) if match else 0
+            start = block * 100 + offset
+            data = self.corpus[start:start + limit]
+            page = {"total": len(self.corpus), "offset": offset, "data": data}
+            if start + limit < len(self.corpus):
+                page["next"] = offset + limit
+            return 200, page
+        if method == "GET" and path.endswith("/paper/search/bulk"):
+            start = int(query.get("token", ["0"])[0])
+            page = {"total": len(self.corpus), "data": self.corpus[start:start + 1000]}
+            if start + 1000 < len(self.corpus):
+                page["token"] = str(start + 1000)
+            return 200, page
+        if method == "POST" and path.endswith("/paper/batch"):
+            if "references.paperId" in query.get("fields", [""])[0].split(","):
+                return 200, [self._links(pid) if pid in self.by_id else None
+                             for pid in body["ids"]]
+            return 200, [self.by_id.get(pid) for pid in body["ids"]]
+        return 404, {"error": f"Unknown endpoint {path}"}
+
+    def _links(self, paper_id):
+        return {
+            "paperId": paper_id,
+            "references": [{"paperId": pid} for pid in self.references.get(paper_id, [])],
+            "citations": [{"paperId": pid} for pid in self.citations.get(paper_id, [])]
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                url = urllib.parse.urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, payload = server._answer(
+                    method, url.path, urllib.parse.parse_qs(url.query), body)
+                content = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if status == 429 and server.retry_after is not None:
+                    self.send_header("Retry-After", server.retry_after)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class FakeChatCompletion:
+    """
+    Drop-in replacement for openai.ChatCompletion with configurable behaviour.
+
+    Replies are shaped after the prompt, e.g., RELEVANCE_SCORE|JUSTIFICATION for
+    judge_paper, or are function calls if functions are passed, so that the parsing
+    code paths run as they would in production.
+
+    Args:
+        latency (float): Seconds waited before answering each request.
+        error_rate (float): Share of requests failing with openai.error.RateLimitError.
+        completion_tokens (int): The number of words in free-text replies.
+        malformed_rate (float): Share of judge and keyword replies which cannot be parsed.
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, completion_tokens=100,
+                 malformed_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.completion_tokens = completion_tokens
+        self.malformed_rate = malformed_rate
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _reply(self, messages):
+        prompt = messages[-1]["content"]
+        if prompt.startswith("Rewrite the following reply"):
+            return "q0|q1|q2" if "search queries" in prompt else "7|Relevant to the topic."
+        if "ID|RELEVANCE_SCORE|JUSTIFICATION" in prompt:
+            n_items = len(re.findall(r"^\[\d+\] Journal:", prompt, flags=re.M))
+            return "\n".join(f"{i}|7|Relevant to the topic." for i in range(1, n_items + 1))
+        if "RELEVANCE_SCORE|JUSTIFICATION" in prompt:
+            return "7|Relevant to the topic."
+        if "Separate the search queries by '|'" in prompt:
+            return "q0|q1|q2"
+        return " ".join(["lorem"] * self.completion_tokens)
+
+    def _function_call(self, function, malformed):
+        if function["name"] == "record_relevance":
+            arguments = {"score": "high" if malformed else 7, "reason": "Relevant to the topic."}
+        else:
+            arguments = {"queries": [] if malformed else ["q0", "q1", "q2"]}
+        return {"name": function["name"], "arguments": json.dumps(arguments)}
+
+    def _response(self, model, messages, functions=None):
+        with self._lock:
+            self.requests += 1
+            failed = self._rng.random() < self.error_rate
+            # Repairs, which quote the reply, are always well-formed
+            malformed = (self._rng.random() < self.malformed_rate and
+                         "Reply:" not in messages[-1]["content"])
+        if failed:
+            raise openai.error.RateLimitError("Mock rate limit")
+        if functions:
+            message = {"role": "assistant", "content": None,
+                       "function_call": self._function_call(functions[0], malformed)}
+            content = message["function_call"]["arguments"]
+        else:
+            content = self._reply(messages)
+            if malformed and "|" in content:
+                content = "This paper seems relevant."
+            message = {"role": "assistant", "content": content}
+        prompt_tokens = sum(len(m["content"].split()) for m in messages)
+        completion_tokens = len(content.split())
+        return openai.util.convert_to_openai_object({
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+            "usage": {"prompt_tokens": prompt_tokens,
+                      "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    def create(self, model, messages, functions=None, **kwargs):
+        time.sleep(self.latency)
+        return self._response(model, messages, functions)
+
+    async def acreate(self, model, messages, functions=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._response(model, messages, functions)
+
+    @contextmanager
+    def patch(self):
+        """Route openai.ChatCompletion.create/acreate to this fake within the block."""
+        # Keep the raw classmethods, so that they can be restored as they were
+        originals = {name: openai.ChatCompletion.__dict__[name]
+                     for name in ("create", "acreate")}
+        openai.ChatCompletion.create = self.create
+        openai.ChatCompletion.acreate = self.acreate
+        try:
+            yield self
+        finally:
+            for name, method in originals.items():
+                setattr(openai.ChatCompletion, name, method)
@@ -2,14 +2,50 @@
 literer
 
 A package that drops literature reviews in public places.
+
+Submodules, and the dependencies they need (openai, tiktoken, numpy, requests), are
+only imported when one of their names is first accessed, so that `import literer`
+stays cheap for short-lived processes.
 """
-from literer.assistant import summarize_papers, single_review, get_keywords, judge_paper
-from literer.scholar import get_papers, create_bibliography, get_top_journals
-from literer.utils import get_openai_model, set_openai_model
-from literer.reviewer import give_feedback
+import importlib
 
 __version__ = "0.1.3"
 __author__ = "Jonathan Chassot"
+
+# The public names of each submodule, imported on first access (PEP 562)
+_EXPORTS = {
+    "assistant": (
+        "summarize_papers", "single_review", "get_keywords", "judge_paper",
+        "judge_papers", "asummarize_papers", "asingle_review", "aget_keywords",
+        "ajudge_paper", "ajudge_papers", "combine_reviews", "acombine_reviews",
+        "iter_reviews", "aiter_reviews", "stream_summarize_papers",
+        "astream_summarize_papers", "stream_combine_reviews", "astream_combine_reviews",
+        "cascade_judge_papers", "acascade_judge_papers"),
+    "scholar": (
+        "get_papers", "get_papers_multi", "expand_citations", "iter_papers",
+        "create_bibliography", "get_top_journals", "get_paper_details", "ScholarClient",
+        "get_client", "set_client"),
+    "utils": ("get_openai_model", "set_openai_model"),
+    "reviewer": (
+        "give_feedback", "incorporate_feedback", "agive_feedback",
+        "aincorporate_feedback", "iter_feedback", "aiter_feedback",
+        "iter_incorporate_feedback", "aiter_incorporate_feedback", "FeedbackStore"),
+    "engine": ("Scheduler", "get_scheduler", "set_scheduler"),
+    "backends": ("Backend", "OpenAIBackend", "StubBackend", "get_backend", "set_backend"),
+    "cache": ("ResponseCache", "get_response_cache", "set_response_cache"),
+    "store": ("PaperStore", "get_paper_store", "set_paper_store"),
+    "papers": ("Paper", "PaperSet"),
+    "pipeline": ("ReviewPipeline",),
+    "metrics": ("Metrics", "get_metrics"),
+    "prompts": ("format_publication", "get_abstract_tokens", "set_abstract_tokens"),
+    "structured": ("Judgment", "get_structured_output", "set_structured_output"),
+    "bibliography": ("write_bibliography", "BibliographyWriter"),
+    "ranking": (
+        "rank_papers", "prefilter_papers", "embed_papers", "EmbeddingCache",
+        "get_embedding_cache", "set_embedding_cache"),
+}
+_LOCATIONS = {name: module for module, names in _EXPORTS.items() for name in names}
+
 __all__ = [
     "get_keywords", 
     "get_papers", 
@@ -17,10 +53,87 @@ __all__ = [
     "summarize_papers", 
     "judge_paper",
     "create_bibliography",
-    "test_model",
+    "write_bibliography",
+    "BibliographyWriter",
     "get_openai_model",
     "set_openai_model",
     "give_feedback",
     "incorporate_feedback",
-    "get_top_journals"  
+    "get_top_journals",
+    "ScholarClient",
+    "get_client",
+    "set_client",
+    "judge_papers",
+    "asummarize_papers",
+    "asingle_review",
+    "aget_keywords",
+    "ajudge_paper",
+    "ajudge_papers",
+    "agive_feedback",
+    "aincorporate_feedback",
+    "Scheduler",
+    "Backend",
+    "OpenAIBackend",
+    "StubBackend",
+    "get_backend",
+    "set_backend",
+    "get_scheduler",
+    "set_scheduler",
+    "ResponseCache",
+    "get_response_cache",
+    "set_response_cache",
+    "get_paper_details",
+    "PaperStore",
+    "get_paper_store",
+    "set_paper_store",
+    "get_papers_multi",
+    "rank_papers",
+    "prefilter_papers",
+    "embed_papers",
+    "EmbeddingCache",
+    "get_embedding_cache",
+    "set_embedding_cache",
+    "combine_reviews",
+    "acombine_reviews",
+    "iter_reviews",
+    "aiter_reviews",
+    "stream_summarize_papers",
+    "astream_summarize_papers",
+    "stream_combine_reviews",
+    "astream_combine_reviews",
+    "cascade_judge_papers",
+    "acascade_judge_papers",
+    "format_publication",
+    "get_abstract_tokens",
+    "set_abstract_tokens",
+    "iter_feedback",
+    "aiter_feedback",
+    "iter_incorporate_feedback",
+    "aiter_incorporate_feedback",
+    "FeedbackStore",
+    "Judgment",
+    "get_structured_output",
+    "set_structured_output",
+    "ReviewPipeline",
+    "Metrics",
+    "get_metrics",
+    "expand_citations",
+    "iter_papers",
+    "Paper",
+    "PaperSet"
 ]
+
+
+def __getattr__(name):
+    if name in _LOCATIONS:
+        value = getattr(importlib.import_module(f"{__name__}.{_LOCATIONS[name]}"), name)
+    elif name in _EXPORTS:
+        value = importlib.import_module(f"{__name__}.{name}")
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Cache the value, later accesses do not go through __getattr__ anymore
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_EXPORTS))
@@ -1,8 +1,19 @@
-import openai
+import asyncio
+import random
 import re
 from typing import List
 
-from .utils import get_content, get_openai_model, make_journal_string
+from .backends import get_backend
+from .engine import (achat_completion, as_completed_indexed, astream_chat_completion,
+                     chat_completion, stream_chat_completion, thread_imap_unordered,
+                     thread_map)
+from .metrics import get_metrics
+from .prompts import (REVIEW_FIELDS, format_publication, get_abstract_tokens, report_savings,
+                      truncate_tokens)
+from .structured import (JUDGE_FUNCTION, KEYWORDS_FUNCTION, Judgment, function_kwargs,
+                         get_structured_output, parse_judgment, parse_keywords,
+                         repair_messages)
+from .utils import count_tokens, get_content, get_openai_model, make_journal_string
 
 
 def single_review(publication, topic, tex_format=False):
@@ -17,11 +28,27 @@ def single_review(publication, topic, tex_format=False):
         A string containing the review for the single paper.
     """
 
-    # Drop bibtex key if not required to alleviate the number of tokens
-    if not tex_format:
-        del publication["bibtex"]
+    model = get_openai_model("single_review")
+    response = chat_completion(_review_messages(publication, topic, tex_format, model),
+                               model=model)
+    return get_content(response)
+
+async def asingle_review(publication, topic, tex_format=False):
+    """Asynchronous version of single_review."""
+    model = get_openai_model("single_review")
+    response = await achat_completion(_review_messages(publication, topic, tex_format, model),
+                                      model=model)
+    return get_content(response)
+
+def _review_messages(publication, topic, tex_format, model):
+    # Only send the fields a review needs, the caller's publication is left untouched.
+    # The bibtex entry is only required for TeX output and costs many tokens.
+    fields = REVIEW_FIELDS + ("bibtex",) if tex_format else REVIEW_FIELDS
+    paper = format_publication(publication, fields, model=model)
+    original = {k: v for k, v in publication.items() if tex_format or k != "bibtex"}
+    report_savings("single_review", str(original), paper, model)
 
-    messages = [
+    return [
         {
         "role": "system",
         "content": ("You are a research assistant creating literature reviews "
@@ -29,24 +56,18 @@ def single_review(publication, topic, tex_format=False):
         },
         {
         "role": "user",
-        "content": (f"Create a brief review for {publication}.\n" 
+        "content": (f"Create a brief review for the following paper.\n{paper}\n"
                     "You want to use this review to write a paper on the topic "
                     f"of '{topic}' later on.")# TODO: TeX Format again?
         }
     ]
-    response = openai.ChatCompletion.create(
-        model=get_openai_model(),
-        messages=messages
-    )
 
-    return get_content(response)
-
-def summarize_papers(publications, topic, tex_format=False):
+def summarize_papers(publications, topic, tex_format=False, max_prompt_tokens=3000):
     """
     Generate a full literature review for a set of publications, each with their own brief review.
 
     Args:
-        publications (list): A list of publications, where each publication is a dictionary with the following keys:
+        publications (list or PaperSet): A list of publications, where each publication is a dictionary with the following keys:
             - "title": the title of the publication
             - "authors": a list of authors for the publication
             - "year": the year the publication was published
@@ -56,15 +77,180 @@ def summarize_papers(publications, topic, tex_format=False):
             - "summary": a brief summary of the publication
 
         tex_format (bool): Whether or not to use TeX format for citations. Defaults to True.
+        max_prompt_tokens (int): The token budget of the reviews combined in a single
+            prompt, see combine_reviews. Defaults to 3000.
 
     Returns:
         A string containing the full literature review.
     """
     # Drop any paper that do not have an abstract first
     publications = [p for p in publications if p["abstract"] != ""]
-    single_reviews = [single_review(pub, topic, tex_format) for pub in publications]
+    # Single reviews are independent, request them concurrently
+    single_reviews = thread_map(
+        lambda pub: single_review(pub, topic, tex_format), publications,
+        get_openai_model("single_review"))
+    return combine_reviews(single_reviews, topic, max_prompt_tokens)
+
+async def asummarize_papers(
+        publications, topic, tex_format=False, max_prompt_tokens=3000):
+    """Asynchronous version of summarize_papers."""
+    publications = [p for p in publications if p["abstract"] != ""]
+    single_reviews = await asyncio.gather(
+        *(asingle_review(pub, topic, tex_format) for pub in publications))
+    return await acombine_reviews(single_reviews, topic, max_prompt_tokens)
+
+def combine_reviews(reviews, topic, max_prompt_tokens=3000):
+    """
+    Combine several reviews into a single literature review, in a tree reduction.
+
+    Reviews are grouped into batches of at most max_prompt_tokens tokens, each batch
+    is merged into one review concurrently, and this is repeated until all reviews
+    fit into a single final prompt. The number of sequential requests thus grows
+    with the logarithm of the number of reviews.
+
+    Args:
+        reviews (List[str]): The reviews to combine, e.g., from single_review.
+        topic (str): The topic the literature review focuses on.
+        max_prompt_tokens (int): The token budget of the reviews sent in a single
+            prompt. Defaults to 3000.
+
+    Returns:
+        A string containing the full literature review.
+    """
+    model = get_openai_model("summarize_papers")
+    batches = _group_reviews(reviews, max_prompt_tokens, model)
+    while len(batches) > 1:
+        reviews = thread_map(
+            lambda batch: _merge_batch(batch, topic, model), batches, model)
+        batches = _group_reviews(reviews, max_prompt_tokens, model)
+    response = chat_completion(_summary_messages(batches[0], topic), model)
+    return get_content(response)
+
+async def acombine_reviews(reviews, topic, max_prompt_tokens=3000):
+    """Asynchronous version of combine_reviews."""
+    model = get_openai_model("summarize_papers")
+    batches = _group_reviews(reviews, max_prompt_tokens, model)
+    while len(batches) > 1:
+        reviews = await asyncio.gather(
+            *(_amerge_batch(batch, topic, model) for batch in batches))
+        batches = _group_reviews(reviews, max_prompt_tokens, model)
+    response = await achat_completion(_summary_messages(batches[0], topic), model)
+    return get_content(response)
+
+def iter_reviews(publications, topic, tex_format=False):
+    """
+    Generate brief reviews concurrently, yielding each one as soon as it is ready.
+
+    Args:
+        publications (list): The publications to review, as returned by get_papers.
+        topic (str): The topic the reviews focus on.
+        tex_format (bool): Whether or not to use TeX format for citations.
+
+    Yields:
+        tuple: (publication, review) pairs, in order of completion.
+    """
+    publications = [p for p in publications if p["abstract"] != ""]
+    for i, review in thread_imap_unordered(
+            lambda pub: single_review(pub, topic, tex_format), publications,
+            get_openai_model("single_review")):
+        yield publications[i], review
+
+async def aiter_reviews(publications, topic, tex_format=False):
+    """Asynchronous version of iter_reviews."""
+    publications = [p for p in publications if p["abstract"] != ""]
+    async for i, review in as_completed_indexed(
+            [asingle_review(pub, topic, tex_format) for pub in publications]):
+        yield publications[i], review
+
+def stream_summarize_papers(publications, topic, tex_format=False, max_prompt_tokens=3000):
+    """
+    Streaming version of summarize_papers, yielding the final review as it is generated.
+
+    Use iter_reviews to get hold of the single reviews as they complete.
+
+    Yields:
+        str: The successive pieces of the full literature review.
+    """
+    single_reviews = [review for _, review in iter_reviews(publications, topic, tex_format)]
+    yield from stream_combine_reviews(single_reviews, topic, max_prompt_tokens)
+
+async def astream_summarize_papers(
+        publications, topic, tex_format=False, max_prompt_tokens=3000):
+    """Asynchronous version of stream_summarize_papers."""
+    single_reviews = [review async for _, review in aiter_reviews(publications, topic, tex_format)]
+    async for piece in astream_combine_reviews(single_reviews, topic, max_prompt_tokens):
+        yield piece
+
+def stream_combine_reviews(reviews, topic, max_prompt_tokens=3000):
+    """
+    Streaming version of combine_reviews, the final level of the reduction is streamed.
+
+    Yields:
+        str: The successive pieces of the full literature review.
+    """
+    model = get_openai_model("summarize_papers")
+    batches = _group_reviews(reviews, max_prompt_tokens, model)
+    while len(batches) > 1:
+        reviews = thread_map(
+            lambda batch: _merge_batch(batch, topic, model), batches, model)
+        batches = _group_reviews(reviews, max_prompt_tokens, model)
+    yield from stream_chat_completion(_summary_messages(batches[0], topic), model)
+
+async def astream_combine_reviews(reviews, topic, max_prompt_tokens=3000):
+    """Asynchronous version of stream_combine_reviews."""
+    model = get_openai_model("summarize_papers")
+    batches = _group_reviews(reviews, max_prompt_tokens, model)
+    while len(batches) > 1:
+        reviews = await asyncio.gather(
+            *(_amerge_batch(batch, topic, model) for batch in batches))
+        batches = _group_reviews(reviews, max_prompt_tokens, model)
+    async for piece in astream_chat_completion(_summary_messages(batches[0], topic), model):
+        yield piece
+
+def _group_reviews(reviews, max_prompt_tokens, model):
+    # Fill batches up to the token budget, but always put at least two reviews in
+    # a batch so that every level of the reduction makes progress. Only the last
+    # batch may hold a single review
+    batches, batch, batch_tokens = [], [], 0
+    for review in reviews:
+        n_tokens = count_tokens(review, model)
+        if len(batch) >= 2 and batch_tokens + n_tokens > max_prompt_tokens:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(review)
+        batch_tokens += n_tokens
+    batches.append(batch)
+    return batches
+
+def _merge_batch(batch, topic, model):
+    # A single leftover review is carried up to the next level unchanged
+    if len(batch) == 1:
+        return batch[0]
+    return get_content(chat_completion(_merge_messages(batch, topic), model))
 
-    messages = [
+async def _amerge_batch(batch, topic, model):
+    if len(batch) == 1:
+        return batch[0]
+    return get_content(await achat_completion(_merge_messages(batch, topic), model))
+
+def _merge_messages(reviews, topic):
+    return [
+        {
+        "role": "system",
+        "content": ("You are a research assistant creating literature reviews "
+                    "for your supervisor.")
+        },
+        {
+        "role": "user",
+        "content": ("Merge the following reviews into a single, shorter review "
+                    f"that focuses on the topic of '{topic}'. Keep every paper's "
+                    "authors and year so that it can still be cited.\n" +
+                    '\n'.join(reviews))
+        }
+    ]
+
+def _summary_messages(single_reviews, topic):
+    return [
         {
         "role": "system",
         "content": ("You are a research assistant creating literature reviews "
@@ -75,16 +261,10 @@ def summarize_papers(publications, topic, tex_format=False):
         "content": ("Combine the following reviews into a single literature "
                     f"review that focuses on the topic of '{topic}'. "
                     "Ensure that the reader understands why these papers are "
-                    "relevant to the paper you are writing.\n"
+                    "relevant to the paper you are writing.\n" +
                     '\n'.join(single_reviews))
         }
     ]
-    response = openai.ChatCompletion.create(
-        model=get_openai_model(),
-        messages=messages
-    )
-
-    return get_content(response)
 
 def get_keywords(topic: str, n_keywords: int) -> List[str]:
     """
@@ -98,10 +278,67 @@ def get_keywords(topic: str, n_keywords: int) -> List[str]:
             Defaults to "gpt-4-0314".
 
     Returns:
-        List[str]: A list of n_keywords keywords, as provided by the user and separated by '|'.
+        List[str]: A list of at most n_keywords keywords.
+
+    Raises:
+        ValueError: If no keyword could be read from the reply, even after a repair.
     """
+    model = get_openai_model("get_keywords")
+    keywords = _structured_completion(
+        "get_keywords", _keyword_messages(topic, n_keywords, _uses_functions(model)),
+        model, KEYWORDS_FUNCTION, parse_keywords)
+    return _check_keywords(keywords, n_keywords)
 
-    messages = [
+async def aget_keywords(topic: str, n_keywords: int) -> List[str]:
+    """Asynchronous version of get_keywords."""
+    model = get_openai_model("get_keywords")
+    keywords = await _astructured_completion(
+        "get_keywords", _keyword_messages(topic, n_keywords, _uses_functions(model)),
+        model, KEYWORDS_FUNCTION, parse_keywords)
+    return _check_keywords(keywords, n_keywords)
+
+def _check_keywords(keywords, n_keywords):
+    if keywords is None:
+        raise ValueError("Could not read any search query from the reply.")
+    return keywords[:n_keywords]
+
+def _uses_functions(model):
+    # Function calls are only requested from backends supporting them
+    return get_structured_output() and get_backend(model).supports_functions
+
+def _structured_completion(name, messages, model, function, parse):
+    # Request a reply and parse it, repairing a malformed reply once
+    kwargs = function_kwargs(function) if _uses_functions(model) else {}
+    message = chat_completion(messages, model, **kwargs).choices[0].message
+    result = parse(message)
+    outcome = "ok"
+    if result is None:
+        repair = repair_messages(message, function, bool(kwargs))
+        result = parse(chat_completion(repair, model, **kwargs).choices[0].message)
+        outcome = "failed" if result is None else "repaired"
+    get_metrics().record_parse(name, outcome)
+    return result
+
+async def _astructured_completion(name, messages, model, function, parse):
+    kwargs = function_kwargs(function) if _uses_functions(model) else {}
+    message = (await achat_completion(messages, model, **kwargs)).choices[0].message
+    result = parse(message)
+    outcome = "ok"
+    if result is None:
+        repair = repair_messages(message, function, bool(kwargs))
+        result = parse((await achat_completion(repair, model, **kwargs)).choices[0].message)
+        outcome = "failed" if result is None else "repaired"
+    get_metrics().record_parse(name, outcome)
+    return result
+
+def _keyword_messages(topic, n_keywords, structured):
+    if structured:
+        instruction = "Record the search queries with the record_queries function."
+    else:
+        instruction = ("Separate the search queries by '|', such that they are "
+                       "easily parsable.")
+
+    return [
         {
         "role": "system", 
         "content": ("You are a helpful research assistant that helps find "
@@ -112,25 +349,210 @@ def get_keywords(topic: str, n_keywords: int) -> List[str]:
         "content": (f"Provide {n_keywords} queries to search for literature "
                     f"relevant to the topic of '{topic}' on Semantic Scholar. "
                     "Be aware that longer keywords will make it more difficult to find results. "
-                    "Separate the search queries by '|', such that they are "
-                    "easily parsable.")
+                    f"{instruction}")
         }
     ]
 
-    response = openai.ChatCompletion.create(
-        model=get_openai_model(),
-        messages=messages
-    )
+def judge_paper(publication, topic, target_journal, model=None) -> Judgment:
+    """
+    Judge the relevance of a publication to a research topic.
+
+    The reply is requested as a record_relevance function call (see
+    set_structured_output) and validated. A malformed reply is repaired once, by
+    only sending the reply back to be reformatted.
+
+    Args:
+        publication (dict): The publication, as returned by get_papers.
+        topic (str): The research topic the publication is judged against.
+        target_journal (str or list): The journal(s) the paper is aimed at.
+        model (str, optional): The model to use. Defaults to get_openai_model("judge_paper").
+
+    Returns:
+        Judgment: The (score, reason) pair, score is None if the reply could not be read.
+    """
+    if publication["abstract"] == "" or publication["abstract"] is None:
+        return Judgment(0, "No abstract.")
 
-    return [k.strip() for k in get_content(response).split("|")]
+    model = model or get_openai_model("judge_paper")
+    judgment = _structured_completion(
+        "judge_paper",
+        _judge_messages(publication, topic, target_journal, _uses_functions(model), model),
+        model, JUDGE_FUNCTION, parse_judgment)
+    return judgment or Judgment(None, "Unreadable reply.")
 
-def judge_paper(publication, topic, target_journal):    
+async def ajudge_paper(publication, topic, target_journal, model=None) -> Judgment:
+    """Asynchronous version of judge_paper."""
     if publication["abstract"] == "" or publication["abstract"] is None:
-        return 0, "No abstract."
-    
+        return Judgment(0, "No abstract.")
+
+    model = model or get_openai_model("judge_paper")
+    judgment = await _astructured_completion(
+        "judge_paper",
+        _judge_messages(publication, topic, target_journal, _uses_functions(model), model),
+        model, JUDGE_FUNCTION, parse_judgment)
+    return judgment or Judgment(None, "Unreadable reply.")
+
+def judge_papers(
+        publications, topic, target_journal, batch_size=None, max_prompt_tokens=3000,
+        model=None):
+    """
+    Judge the relevance of several publications concurrently.
+
+    With batch_size > 1, several abstracts are packed into a single prompt so that
+    the instructions, topic and journal are only sent once per batch. Scores which
+    cannot be parsed from a batched reply are asked for again, and papers which
+    still fail are judged one by one.
+
+    Args:
+        publications (list or PaperSet): The publications to judge, as returned by get_papers.
+        topic (str): The research topic the publications are judged against.
+        target_journal (str or list): The journal(s) the paper is aimed at.
+        batch_size (int, optional): The maximum number of publications judged per
+            request. Defaults to the batch_size of the model's backend, 1 unless set
+            otherwise, i.e., one request per publication.
+        max_prompt_tokens (int): The token budget of the publications packed in a
+            single batched prompt. Defaults to 3000.
+        model (str, optional): The model to use. Defaults to get_openai_model("judge_paper").
+
+    Returns:
+        List[tuple]: One (score, reason) pair per publication, in input order.
+    """
+    publications = list(publications)
+    model = model or get_openai_model("judge_paper")
+    if batch_size is None:
+        batch_size = get_backend(model).batch_size
+    if batch_size <= 1:
+        return thread_map(
+            lambda pub: judge_paper(pub, topic, target_journal, model), publications, model)
+
+    judgments = [None] * len(publications)
+    pending = []
+    for i, pub in enumerate(publications):
+        if pub["abstract"] == "" or pub["abstract"] is None:
+            judgments[i] = Judgment(0, "No abstract.")
+        else:
+            pending.append(i)
+
+    # Ask once, then re-ask only for the items whose score could not be parsed
+    for _ in range(2):
+        batches = _pack_batches(publications, pending, batch_size, max_prompt_tokens, model)
+        replies = thread_map(
+            lambda batch: get_content(chat_completion(
+                _batch_judge_messages(publications, batch, topic, target_journal, model),
+                model)),
+            batches, model)
+        for batch, reply in zip(batches, replies):
+            for i, judgment in _parse_batch_judgment(reply, batch).items():
+                judgments[i] = judgment
+        pending = [i for i in pending if judgments[i] is None]
+        if not pending:
+            return judgments
+
+    # Whatever still fails is judged on its own
+    for i, judgment in zip(pending, thread_map(
+            lambda i: judge_paper(publications[i], topic, target_journal, model),
+            pending, model)):
+        judgments[i] = judgment
+    return judgments
+
+async def ajudge_papers(publications, topic, target_journal, model=None):
+    """Asynchronous version of judge_papers."""
+    return await asyncio.gather(
+        *(ajudge_paper(pub, topic, target_journal, model) for pub in publications))
+
+def cascade_judge_papers(
+        publications, topic, target_journal, cheap_model="gpt-3.5-turbo",
+        strong_model="gpt-4", band=(4, 7), audit_rate=0.0, batch_size=None,
+        max_prompt_tokens=3000):
+    """
+    Judge publications with a cheap model, escalating uncertain scores to a strong model.
+
+    Most papers are clearly in or out, so only those scored within band by the cheap
+    model, or whose score could not be parsed, are judged again by the strong model,
+    whose judgment is kept. A random share audit_rate of the confidently judged papers
+    is escalated too, so that the agreement of both models is also measured outside
+    the band. Agreement stats are reported under get_metrics().summary()["cascade"]
+    to help tune the band.
+
+    Args:
+        publications (list or PaperSet): The publications to judge, as returned by get_papers.
+        topic (str): The research topic the publications are judged against.
+        target_journal (str or list): The journal(s) the paper is aimed at.
+        cheap_model (str): The model scoring every publication. Defaults to "gpt-3.5-turbo".
+        strong_model (str): The model escalated to. Defaults to "gpt-4".
+        band (tuple): The (lowest, highest) cheap scores escalated, inclusive.
+            Defaults to (4, 7).
+        audit_rate (float): The share of papers outside the band escalated anyway.
+            Defaults to 0.
+        batch_size (int): The batch_size of the cheap model, see judge_papers.
+        max_prompt_tokens (int): See judge_papers.
+
+    Returns:
+        List[tuple]: One (score, reason) pair per publication, in input order.
+
+    Example:
+        >>> judgments = cascade_judge_papers(papers, topic, target_journal, band=(5, 8))
+        >>> get_metrics().summary()["cascade"]["gpt-3.5-turbo->gpt-4"]
+    """
+    publications = list(publications)
+    judgments = judge_papers(publications, topic, target_journal, batch_size,
+                             max_prompt_tokens, cheap_model)
+    escalated, audited = _cascade_split(publications, judgments, band, audit_rate)
+    strong = judge_papers([publications[i] for i in escalated + audited], topic,
+                          target_journal, model=strong_model)
+    return _cascade_merge(judgments, escalated, audited, strong, cheap_model, strong_model)
+
+async def acascade_judge_papers(
+        publications, topic, target_journal, cheap_model="gpt-3.5-turbo",
+        strong_model="gpt-4", band=(4, 7), audit_rate=0.0):
+    """Asynchronous version of cascade_judge_papers."""
+    publications = list(publications)
+    judgments = await ajudge_papers(publications, topic, target_journal, cheap_model)
+    escalated, audited = _cascade_split(publications, judgments, band, audit_rate)
+    strong = await ajudge_papers([publications[i] for i in escalated + audited], topic,
+                                 target_journal, strong_model)
+    return _cascade_merge(judgments, escalated, audited, strong, cheap_model, strong_model)
+
+def _cascade_split(publications, judgments, band, audit_rate):
+    # Papers without an abstract are not worth a second opinion
+    escalated, audited = [], []
+    for i, (pub, (score, _)) in enumerate(zip(publications, judgments)):
+        if pub["abstract"] == "" or pub["abstract"] is None:
+            continue
+        if not isinstance(score, int) or band[0] <= score <= band[1]:
+            escalated.append(i)
+        elif random.random() < audit_rate:
+            audited.append(i)
+    return escalated, audited
+
+def _cascade_merge(judgments, escalated, audited, strong, cheap_model, strong_model):
+    judgments = list(judgments)
+    pairs = []
+    for i, judgment in zip(escalated + audited, strong):
+        pairs.append((judgments[i][0], judgment[0]))
+        # Keep the cheap judgment if the strong one could not be parsed
+        if isinstance(judgment[0], int) or not isinstance(judgments[i][0], int):
+            judgments[i] = judgment
+    get_metrics().record_cascade(
+        cheap_model, strong_model, len(judgments), pairs[:len(escalated)],
+        pairs[len(escalated):])
+    return judgments
+
+def _judge_messages(publication, topic, target_journal, structured, model):
     journal_str = make_journal_string(target_journal)
-    
-    messages = [
+    if structured:
+        instruction = ("Record your answer with the record_relevance function, "
+                       "where score is an integer between 0 and 10 and reason is a "
+                       "brief reasoning of your score in a maximum of 10 words.")
+    else:
+        instruction = ("Give your answer in format RELEVANCE_SCORE|JUSTIFICATION "
+                       "where RELEVANCE_SCORE is an integer between 0 and 10 "
+                       "and JUSTIFICATION is a brief reasoning of your score in "
+                       "a maximum of 10 words.")
+    abstract = _compact_abstract(publication, model)
+    report_savings("judge_paper", str(publication["abstract"]), abstract, model)
+
+    return [
         {
         "role": "system", 
         "content": ("You are a research assistant, you assess whether "
@@ -142,22 +564,70 @@ def judge_paper(publication, topic, target_journal):
                     f"aiming to publish to {journal_str}.\n"
                     "Is the following paper, published in the journal "
                     f"'{publication['venue']}' relevant to you?\n"
-                    f"Abstract: {publication['abstract']}.\n"
-                    "Give your answer in format RELEVANCE_SCORE|JUSTIFICATION " 
-                    "where RELEVANCE_SCORE is an integer between 0 and 10 "
-                    "and JUSTIFICATION is a brief reasoning of your score in "
-                    "a maximum of 10 words.")
+                    f"Abstract: {abstract}.\n"
+                    f"{instruction}")
         }
     ]
 
-    response = openai.ChatCompletion.create(
-        model=get_openai_model(),
-        messages=messages
-    )
+def _pack_batches(publications, indices, batch_size, max_prompt_tokens, model):
+    # Greedily fill batches up to batch_size items or max_prompt_tokens tokens
+    batches, batch, batch_tokens = [], [], 0
+    for i in indices:
+        n_tokens = count_tokens(_batch_item(publications[i], 0, model), model)
+        if batch and (len(batch) == batch_size or
+                      batch_tokens + n_tokens > max_prompt_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _compact_abstract(publication, model):
+    # Long abstracts are cut to the per-paper budget, missing ones stay 'None' as before
+    abstract = publication["abstract"]
+    if not abstract:
+        return str(abstract)
+    return truncate_tokens(abstract, get_abstract_tokens(), model)
 
-    score, reason = get_content(response).split("|")
-    match = re.search(r'\d+', score)
-    if match:
-        score = int(match.group())
+def _batch_item(publication, item_id, model):
+    return (f"[{item_id}] Journal: '{publication['venue']}'\n"
+            f"Abstract: {_compact_abstract(publication, model)}")
+
+def _batch_judge_messages(publications, batch, topic, target_journal, model):
+    journal_str = make_journal_string(target_journal)
+    items = "\n\n".join(
+        _batch_item(publications[i], item_id, model) for item_id, i in enumerate(batch, start=1))
+
+    return [
+        {
+        "role": "system", 
+        "content": ("You are a research assistant, you assess whether "
+                    "publications are relevant to a given research topic.")
+        },
+        {
+        "role": "user",
+        "content": (f"You are writing a paper on the topic of {topic} and are "
+                    f"aiming to publish to {journal_str}.\n"
+                    "Are the following papers relevant to you?\n\n"
+                    f"{items}\n\n"
+                    "Give one answer per paper, one per line, in format "
+                    "ID|RELEVANCE_SCORE|JUSTIFICATION where ID is the number of "
+                    "the paper in brackets, RELEVANCE_SCORE is an integer between "
+                    "0 and 10 and JUSTIFICATION is a brief reasoning of your score "
+                    "in a maximum of 10 words.")
+        }
+    ]
 
-    return score, reason
\ No newline at end of file
+def _parse_batch_judgment(content, batch):
+    # Map each well-formed answer line back to the index of its publication
+    judgments = {}
+    for line in content.splitlines():
+        match = re.match(r"\s*\[?(\d+)\]?\s*\|\s*(\d+)[^|]*\|(.*)", line)
+        if match is None:
+            continue
+        item_id, score = int(match.group(1)), int(match.group(2))
+        if 1 <= item_id <= len(batch) and 0 <= score <= 10:
+            judgments[batch[item_id - 1]] = Judgment(score, match.group(3).strip())
+    return judgments
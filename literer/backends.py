@@ -0,0 +1,206 @@
+import asyncio
+import functools
+import time
+from typing import Callable, Dict, Optional, Union
+
+from .utils import count_tokens
+
+
+class Backend:
+    """
+    Where chat completions are sent, with its own concurrency and batching settings.
+
+    Backends are registered per model with set_backend, every request for the model
+    then goes to the backend, e.g., judge_paper to a local server once its model is
+    routed there with set_openai_model. Subclasses implement create, and acreate if
+    they have a native asynchronous client.
+
+    Args:
+        max_in_flight (int, optional): The maximum number of concurrent requests to
+            the backend. If neither this nor a rate limit is given, requests go
+            through the global scheduler, see set_scheduler.
+        requests_per_minute (float, optional): Requests-per-minute limit of the backend.
+        tokens_per_minute (float, optional): Prompt tokens-per-minute limit of the backend.
+        batch_size (int): The number of publications judge_papers packs per request
+            for models of this backend, unless it is given a batch_size. Defaults to 1.
+        supports_functions (bool): Whether the backend supports function calling,
+            replies are parsed from free text otherwise. Defaults to True.
+    """
+    # Whether calls are priced with MODEL_PRICES, see estimate_cost
+    priced = False
+    # Whether set_openai_model checks the models against list_openai_models
+    validates_models = False
+    # Separates the cached responses of the backend from those of other backends
+    # serving models of the same name, None for OpenAI itself
+    namespace: Optional[str] = None
+
+    def __init__(
+            self, max_in_flight: Optional[int] = None,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None, batch_size: int = 1,
+            supports_functions: bool = True):
+        self.scheduler = None
+        if max_in_flight or requests_per_minute or tokens_per_minute:
+            from .engine import Scheduler
+            self.scheduler = Scheduler(
+                max_in_flight or 8, requests_per_minute, tokens_per_minute)
+        self.batch_size = batch_size
+        self.supports_functions = supports_functions
+
+    def create(self, model: str, messages: list, **kwargs):
+        """Create a chat completion, returning an OpenAI response object (or a stream of chunks)."""
+        raise NotImplementedError
+
+    async def acreate(self, model: str, messages: list, **kwargs):
+        """Asynchronous version of create, runs create in a thread by default."""
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+            None, functools.partial(self.create, model, messages, **kwargs))
+        if kwargs.get("stream"):
+            return _aiter_in_thread(response)
+        return response
+
+
+class OpenAIBackend(Backend):
+    """
+    The OpenAI API, or any OpenAI-compatible server, e.g., llama.cpp or vLLM.
+
+    Args:
+        api_base (str, optional): The URL of an OpenAI-compatible server, e.g.,
+            "http://localhost:8000/v1". Defaults to the OpenAI API.
+        api_key (str, optional): The API key. Defaults to openai.api_key, or to a
+            placeholder for servers given by api_base, which usually ignore it.
+        **kwargs: The concurrency and batching settings, see Backend.
+
+    Example:
+        >>> set_backend(OpenAIBackend("http://localhost:8000/v1", max_in_flight=4,
+        ...                           supports_functions=False), model="llama-3-8b")
+        >>> set_openai_model("llama-3-8b", function="judge_paper")
+    """
+    def __init__(self, api_base: Optional[str] = None, api_key: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.api_base = api_base
+        self.api_key = api_key
+        # Requests to another server are free, and its models are not OpenAI's
+        self.priced = self.validates_models = api_base is None
+        self.namespace = api_base
+
+    def _credentials(self):
+        import openai
+
+        credentials = {}
+        if self.api_base is not None:
+            credentials["api_base"] = self.api_base
+            credentials["api_key"] = self.api_key or openai.api_key or "none"
+        elif self.api_key is not None:
+            credentials["api_key"] = self.api_key
+        return credentials
+
+    def create(self, model, messages, **kwargs):
+        import openai
+
+        return openai.ChatCompletion.create(
+            model=model, messages=messages, **self._credentials(), **kwargs)
+
+    async def acreate(self, model, messages, **kwargs):
+        import openai
+
+        return await openai.ChatCompletion.acreate(
+            model=model, messages=messages, **self._credentials(), **kwargs)
+
+
+class StubBackend(Backend):
+    """
+    In-process backend for tests and dry runs, no request leaves the process.
+
+    Args:
+        reply (str or callable): The content of every reply, or a function of the
+            model, the messages and the request arguments returning the content (str)
+            or the reply message (dict), e.g., {"role": "assistant", "content": None,
+            "function_call": {"name": ..., "arguments": ...}}.
+        latency (float): The time in seconds each reply takes. Defaults to 0.
+        **kwargs: The concurrency and batching settings, see Backend.
+
+    Example:
+        >>> set_backend(StubBackend("7|Relevant."), model="stub")
+        >>> judge_papers(papers, topic, target_journal, model="stub")
+    """
+    namespace = "stub"
+
+    def __init__(self, reply: Union[str, Callable], latency: float = 0.0, **kwargs):
+        kwargs.setdefault("supports_functions", callable(reply))
+        super().__init__(**kwargs)
+        self.reply = reply
+        self.latency = latency
+
+    def create(self, model, messages, **kwargs):
+        time.sleep(self.latency)
+        return self._response(model, messages, kwargs)
+
+    async def acreate(self, model, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        response = self._response(model, messages, kwargs)
+        if kwargs.get("stream"):
+            return _aiter(response)
+        return response
+
+    def _response(self, model, messages, kwargs):
+        import openai.util
+
+        reply = self.reply(model, messages, **kwargs) if callable(self.reply) else self.reply
+        message = reply if isinstance(reply, dict) else {"role": "assistant", "content": reply}
+        content = message.get("content") or ""
+        if kwargs.get("stream"):
+            return iter([openai.util.convert_to_openai_object({
+                "object": "chat.completion.chunk", "model": model,
+                "choices": [{"index": 0, "delta": {"content": content}}]})])
+        return openai.util.convert_to_openai_object({
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+            "usage": {
+                "prompt_tokens": sum(count_tokens(m["content"], model) for m in messages),
+                "completion_tokens": count_tokens(content, model)
+            }
+        })
+
+async def _aiter(chunks):
+    for chunk in chunks:
+        yield chunk
+
+async def _aiter_in_thread(chunks):
+    # Read a blocking stream chunk by chunk in a thread, so the event loop keeps running
+    loop = asyncio.get_running_loop()
+    chunks, done = iter(chunks), object()
+    while (chunk := await loop.run_in_executor(None, next, chunks, done)) is not done:
+        yield chunk
+
+
+# Backends by model, None is the backend of every other model
+BACKENDS: Dict[Optional[str], Backend] = {None: OpenAIBackend()}
+
+def get_backend(model: Optional[str] = None) -> Backend:
+    """Return the backend requests for the given model are sent to."""
+    global BACKENDS
+    return BACKENDS.get(model) or BACKENDS[None]
+
+def set_backend(backend: Optional[Backend], model: Optional[str] = None):
+    """
+    Send the requests for a model to the given backend.
+
+    Args:
+        backend (Backend or None): The backend, None removes the backend of model.
+        model (str, optional): The model served by the backend. Defaults to every
+            model without a backend of its own.
+
+    Example:
+        >>> set_backend(OpenAIBackend("http://gpu-box:8000/v1", batch_size=8),
+        ...             model="mistral-7b-instruct")
+    """
+    global BACKENDS
+    if backend is None:
+        if model is None:
+            raise ValueError("The default backend cannot be removed.")
+        BACKENDS.pop(model, None)
+    else:
+        BACKENDS[model] = backend
@@ -0,0 +1,277 @@
+import hashlib
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, TextIO
+
+# Standard BibTeX entry types, kept as they are
+BIBTEX_TYPES = {
+    "article", "book", "booklet", "conference", "inbook", "incollection",
+    "inproceedings", "manual", "mastersthesis", "misc", "phdthesis", "proceedings",
+    "techreport", "unpublished"
+}
+# Semantic Scholar publication types, e.g., @['JournalArticle', 'Review']{...}, and
+# the BibTeX entry type they are written as
+ENTRY_TYPES = {
+    "JournalArticle": "article",
+    "Conference": "inproceedings",
+    "Book": "book",
+    "BookSection": "incollection",
+    "Review": "article",
+    "MetaAnalysis": "article",
+    "Editorial": "article",
+    "LettersAndComments": "article",
+    "CaseReport": "article",
+    "ClinicalTrial": "article",
+    "Study": "article",
+    "Dataset": "misc",
+    "News": "misc"
+}
+# Title words skipped when building citation keys
+STOP_WORDS = {"a", "an", "and", "at", "by", "for", "from", "in", "of", "on", "the", "to",
+              "with"}
+# Bibliographies with at least this many entries are normalised in a process pool
+PARALLEL_THRESHOLD = 5000
+# The number of publications sent to a worker process at once
+CHUNK_SIZE = 500
+
+
+def parse_bibtex(text: str) -> Optional[dict]:
+    """
+    Parse a single BibTeX entry.
+
+    Values may be delimited by (nested) braces or quotes, or be bare words or numbers.
+
+    Args:
+        text (str): The BibTeX entry.
+
+    Returns:
+        dict or None: The raw entry type ("type"), the citation key ("key") and the
+            fields ("fields", lower-cased names in order), None if text holds no entry.
+
+    Example:
+        >>> parse_bibtex("@article{Card2017,\\n title = {What {Works}?},\\n year = 2017\\n}")
+        {'type': 'article', 'key': 'Card2017', 'fields': {'title': 'What {Works}?', 'year': '2017'}}
+    """
+    header = re.search(r"@\s*([^{(]*?)\s*[{(]\s*([^,\s]*)\s*,", text or "")
+    if header is None:
+        return None
+    fields = {}
+    pos = header.end()
+    field = re.compile(r"\s*([\w-]+)\s*=\s*")
+    while (match := field.match(text, pos)) is not None:
+        value, pos = _read_value(text, match.end())
+        fields[match.group(1).lower()] = " ".join(value.split())
+        pos = text.find(",", pos)
+        if pos < 0:
+            break
+        pos += 1
+    return {"type": header.group(1), "key": header.group(2), "fields": fields}
+
+_DELIMITERS = {"{": re.compile(r"[{}]"), "\"": re.compile(r"(?<!\\)\"|[{}]")}
+_BARE_VALUE = re.compile(r"[^,}\s]*")
+
+def _read_value(text, pos):
+    # Return a field value without its delimiters, and the position after it. Only
+    # the braces and quotes are visited, long abstracts are skipped over in C
+    opening = text[pos:pos + 1]
+    if opening not in _DELIMITERS:
+        match = _BARE_VALUE.match(text, pos)
+        return match.group(), match.end()
+    depth = 0
+    for match in _DELIMITERS[opening].finditer(text, pos + 1):
+        char = match.group()
+        if depth == 0 and char == ("}" if opening == "{" else "\""):
+            return text[pos + 1:match.start()], match.end()
+        depth += 1 if char == "{" else -1 if char == "}" else 0
+    return text[pos + 1:], len(text)
+
+def entry_type(raw_type: str, fields: Dict[str, str]) -> str:
+    """Return the BibTeX entry type of a raw type, e.g., "['JournalArticle']" -> "article"."""
+    names = re.findall(r"\w+", raw_type or "")
+    for name in names:
+        if name in ENTRY_TYPES:
+            return ENTRY_TYPES[name]
+    for name in names:
+        if name.lower() in BIBTEX_TYPES:
+            return name.lower()
+    if "journal" in fields:
+        return "article"
+    return "inproceedings" if "booktitle" in fields else "misc"
+
+def normalise_entry(publication: dict) -> Optional[dict]:
+    """
+    Turn a publication into a normalised entry, ready for BibliographyWriter.add.
+
+    The fields of its bibtex entry are completed with the publication's metadata,
+    e.g., its DOI. This only uses plain data, so that it can run in worker processes.
+
+    Args:
+        publication (dict): The publication, as returned by get_papers.
+
+    Returns:
+        dict or None: The entry type, fields, base of the citation key and the
+            identities used for deduplication, None if there is nothing to cite.
+    """
+    parsed = parse_bibtex(publication.get("bibtex") or "")
+    fields = dict(parsed["fields"]) if parsed else {}
+    if not fields.get("title") and publication.get("title"):
+        fields["title"] = _escape(publication["title"])
+    if not fields.get("author") and publication.get("authors"):
+        fields["author"] = _escape(" and ".join(publication["authors"]))
+    if not fields.get("year") and publication.get("year"):
+        fields["year"] = str(publication["year"])
+    if not fields.get("journal") and not fields.get("booktitle") and publication.get("venue"):
+        fields["journal"] = _escape(publication["venue"])
+    if not fields.get("doi") and publication.get("doi"):
+        fields["doi"] = publication["doi"]
+    if not fields.get("title"):
+        return None
+
+    identities = []
+    if fields.get("doi"):
+        identities.append("doi:" + fields["doi"].lower())
+    title = re.sub(r"\W+", "", _plain_text(fields["title"]).casefold())
+    if title:
+        identities.append("title:" + title)
+    return {
+        "type": entry_type(parsed["type"] if parsed else "", fields),
+        "fields": fields,
+        "key": _key_base(publication, fields),
+        "identities": identities
+    }
+
+def _escape(text):
+    return re.sub(r"([&%$#_])", r"\\\1", text)
+
+def _plain_text(text):
+    # Drop TeX braces and commands, and accents, e.g., "{\"U}ber" -> "Uber"
+    text = re.sub(r"\\[a-zA-Z]+\s*|\\.|[{}]", "", text)
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def _key_base(publication, fields):
+    # lastname + year + first significant title word, e.g., "card2017works"
+    authors = publication.get("authors") or fields.get("author", "").split(" and ")
+    first = _plain_text(authors[0]).strip() if authors and authors[0] else ""
+    last_name = first.split(",")[0] if "," in first else (first.split() or [""])[-1]
+    words = re.findall(r"\w+", _plain_text(fields["title"]).lower())
+    word = next((w for w in words if w not in STOP_WORDS), "")
+    year = re.sub(r"\D", "", fields.get("year", ""))[:4] or "nd"
+    base = re.sub(r"[^a-z0-9]", "", f"{last_name.lower()}{year}{word}")
+    return base or "anon"
+
+def format_entry(entry_type: str, key: str, fields: Dict[str, str]) -> str:
+    """Format a BibTeX entry, one field per line, values in braces."""
+    lines = [f"@{entry_type}{{{key},"]
+    lines += [f"  {name} = {{{value}}}," for name, value in fields.items()]
+    lines[-1] = lines[-1].rstrip(",")
+    return "\n".join(lines) + "\n}\n"
+
+
+class BibliographyWriter:
+    """
+    Write BibTeX entries to a file handle as they come, skipping duplicates.
+
+    Entries are deduplicated by DOI and by normalised title, the first one is kept.
+    Citation keys are built from the first author's last name, the year, the first
+    significant title word and a short hash of the publication's DOI (or title), e.g.,
+    "card2017works3f2a". A key only depends on its own publication, never on the
+    other entries or their order, so that it can be cited before the bibliography
+    is complete.
+
+    Args:
+        f (TextIO): The file handle the entries are written to.
+
+    Example:
+        >>> with open("references.bib", "w") as f:
+        ...     keys = BibliographyWriter(f).write(papers)
+    """
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.n_written = 0
+        self.n_duplicates = 0
+        self._keys_by_identity = {}
+        self._used_keys = set()
+
+    def add(self, entry: Optional[dict]) -> Optional[str]:
+        """
+        Write a normalised entry, see normalise_entry, unless it is a duplicate.
+
+        Returns:
+            str or None: The citation key of the entry, or of the entry it duplicates.
+        """
+        if entry is None:
+            return None
+        for identity in entry["identities"]:
+            if identity in self._keys_by_identity:
+                self.n_duplicates += 1
+                return self._keys_by_identity[identity]
+
+        # Entries are written as they come, so a key cannot wait to see whether its
+        # base is shared, it is always made unique with the hash
+        digest = hashlib.sha1(
+            (entry["identities"] or [repr(entry["fields"])])[0].encode("utf-8")).hexdigest()
+        # Only two publications with the same base and hash prefix need more of it
+        key = next(f"{entry['key']}{digest[:n]}" for n in range(4, len(digest) + 1)
+                   if f"{entry['key']}{digest[:n]}" not in self._used_keys)
+        self._used_keys.add(key)
+        for identity in entry["identities"]:
+            self._keys_by_identity[identity] = key
+
+        self.f.write(format_entry(entry["type"], key, entry["fields"]))
+        self.f.write("\n")
+        self.n_written += 1
+        return key
+
+    def write(
+            self, publications: Iterable, processes: Optional[int] = None
+            ) -> List[Optional[str]]:
+        """
+        Write the entries of publications, e.g., as returned by get_papers.
+
+        Args:
+            publications (list or PaperSet): The publications.
+            processes (int, optional): The number of worker processes normalising the
+                entries. Defaults to os.cpu_count() on multi-core machines for at least
+                PARALLEL_THRESHOLD publications, and to none otherwise. Pass 0 to stay
+                in this process.
+
+        Returns:
+            List[Optional[str]]: The citation key of each publication, in input order.
+        """
+        # Plain dicts can be sent to worker processes, unlike PaperSet rows
+        records = (_record(p) for p in publications)
+        if processes is None:
+            size = len(publications) if hasattr(publications, "__len__") else 0
+            parallel = size >= PARALLEL_THRESHOLD and (os.cpu_count() or 1) > 1
+            processes = None if parallel else 0
+        if processes == 0:
+            return [self.add(normalise_entry(r)) for r in records]
+        with ProcessPoolExecutor(processes) as pool:
+            return [self.add(entry) for entry in
+                    pool.map(normalise_entry, records, chunksize=CHUNK_SIZE)]
+
+def _record(publication):
+    return {k: publication.get(k) for k in ("bibtex", "doi", "title", "authors", "year", "venue")}
+
+def write_bibliography(
+        publications: Iterable, f: TextIO, processes: Optional[int] = None
+        ) -> List[Optional[str]]:
+    """
+    Write a deduplicated BibTeX bibliography of publications to the file handle f.
+
+    See BibliographyWriter for the citation keys and the deduplication.
+
+    Args:
+        publications (list or PaperSet): The publications, as returned by get_papers.
+        f (TextIO): The file handle the bibliography is written to.
+        processes (int, optional): See BibliographyWriter.write.
+
+    Returns:
+        List[Optional[str]]: The citation key of each publication, in input order.
+    """
+    return BibliographyWriter(f).write(publications, processes)
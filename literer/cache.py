@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "literer")
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a SQLite database shared by the threads and processes using literer."""
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    # Write-ahead logging lets readers in other processes, e.g., the workers of
+    # the literer command, proceed while one of them writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache for OpenAI chat completions.
+
+    Responses are stored in a local SQLite database keyed by a hash of the model,
+    the canonicalised messages and any further request arguments, so that
+    identical requests are answered locally at no token cost.
+
+    Args:
+        path (str, optional): The path of the SQLite database. Defaults to
+            ~/.cache/literer/responses.sqlite.
+        ttl (float, optional): Time-to-live of an entry in seconds. Entries never
+            expire if None.
+        max_entries (int, optional): The maximum number of entries kept, the least
+            recently used entries are evicted first. Unbounded if None.
+
+    Example:
+        >>> set_response_cache(ResponseCache(ttl=7 * 24 * 3600, max_entries=50000))
+    """
+    def __init__(
+            self, path: Optional[str] = None, ttl: Optional[float] = None,
+            max_entries: Optional[int] = 10000):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "responses.sqlite")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    @staticmethod
+    def make_key(model: str, messages, **kwargs) -> str:
+        """Hash a request into a cache key."""
+        payload = {
+            "model": model,
+            "messages": [{"role": m["role"], "content": m["content"].strip()}
+                         for m in messages],
+            **kwargs
+        }
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached response for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, response: dict):
+        """Store a response under key, evicting the least recently used entries if full."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response), now, now))
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                    "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+
+RESPONSE_CACHE = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global RESPONSE_CACHE
+    return RESPONSE_CACHE
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    """
+    Enable the given response cache for all OpenAI calls, or disable caching with None.
+
+    Args:
+        cache (ResponseCache or None): The cache to use.
+    """
+    global RESPONSE_CACHE
+    RESPONSE_CACHE = cache
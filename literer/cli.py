@@ -0,0 +1,349 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+from .cache import DEFAULT_CACHE_DIR
+from .utils import atomic_write_text, check_openai_model
+
+# Job keys passed on to ReviewPipeline
+PIPELINE_ARGS = (
+    "n_keywords", "keywords", "n_pubs", "min_relevance", "judge_batch_size",
+    "judge_cascade", "checkpoint_every"
+)
+# Job keys passed on to get_papers as search filters
+SEARCH_FILTERS = ("year_start", "year_end", "venue", "fields_of_study", "publication_types")
+JOB_KEYS = ("name", "topic", "target_journal") + PIPELINE_ARGS + SEARCH_FILTERS
+
+
+def load_jobs(path: str) -> List[dict]:
+    """
+    Read and validate a job file, in YAML (requires PyYAML) or JSON.
+
+    The file holds either a list of jobs, or a mapping with the list under "jobs" and
+    "defaults" applied to every job. A job needs a "topic" and a "target_journal",
+    which is a journal, a list of journals, or {"field": ..., "top5": ...} resolved
+    with get_top_journals. Its optional "name" (the run subdirectory, defaults to a
+    slug of the topic), PIPELINE_ARGS and SEARCH_FILTERS are passed on to
+    ReviewPipeline.
+
+    Args:
+        path (str): The path of the .yaml, .yml or .json job file.
+
+    Returns:
+        List[dict]: The jobs, with defaults applied and target journals resolved.
+
+    Example:
+        defaults:
+          n_pubs: 30
+          target_journal: {field: Economics, top5: true}
+        jobs:
+          - topic: Active labor market policies
+            keywords: [job search assistance]
+          - topic: Minimum wages and employment
+            year_start: 2000
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Reading YAML job files requires PyYAML, "
+                                  "run 'pip install literer[yaml]' or use JSON.")
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    defaults = {}
+    if isinstance(spec, dict):
+        defaults = spec.get("defaults") or {}
+        spec = spec.get("jobs")
+    if not isinstance(spec, list) or not spec:
+        raise ValueError(f"'{path}' holds no list of jobs.")
+
+    jobs, names = [], set()
+    for i, job in enumerate(spec):
+        job = {**defaults, **job}
+        unknown = set(job) - set(JOB_KEYS)
+        if unknown:
+            raise ValueError(f"Job {i} has unknown keys: {', '.join(sorted(unknown))}")
+        for key in ("topic", "target_journal"):
+            if not job.get(key):
+                raise ValueError(f"Job {i} has no '{key}'.")
+        job["target_journal"] = _resolve_journals(job["target_journal"])
+        job.setdefault("name", _slug(job["topic"]))
+        if job["name"] in names:
+            raise ValueError(f"Two jobs are named '{job['name']}', give them distinct names.")
+        names.add(job["name"])
+        jobs.append(job)
+    return jobs
+
+def _resolve_journals(target_journal):
+    if isinstance(target_journal, dict):
+        from .scholar import get_top_journals
+        return get_top_journals(target_journal["field"], target_journal.get("top5", True))
+    return target_journal
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:60] or "job"
+
+
+def _init_worker(settings: dict):
+    # Runs once in every worker process. Each worker gets its share of the rate
+    # limits, so that all workers together stay within them, and all workers use
+    # the same on-disk caches
+    from .cache import ResponseCache, set_response_cache
+    from .engine import Scheduler, set_scheduler
+    from .scholar import RATE_LIMITS, ScholarClient, set_client
+    from .store import PaperStore, set_paper_store
+    from .utils import set_openai_model
+
+    n_workers = settings["workers"]
+    rpm, tpm = settings["requests_per_minute"], settings["tokens_per_minute"]
+    set_scheduler(Scheduler(
+        max_in_flight=max(1, settings["max_in_flight"] // n_workers),
+        requests_per_minute=rpm / n_workers if rpm else None,
+        tokens_per_minute=tpm / n_workers if tpm else None))
+
+    api_key = settings["s2_api_key"]
+    rate, burst = RATE_LIMITS["keyed" if api_key else "free"]
+    set_client(ScholarClient(api_key=api_key, rate=rate / n_workers,
+                             burst=max(1.0, burst / n_workers)))
+
+    cache_dir = settings["cache_dir"]
+    set_paper_store(PaperStore(os.path.join(cache_dir, "papers.sqlite")))
+    if settings["cache"]:
+        set_response_cache(ResponseCache(os.path.join(cache_dir, "responses.sqlite")))
+    for function, model in settings["models"]:
+        set_openai_model(model, function)
+
+def run_job(job: dict, job_dir: str, s2_api_key: Optional[str] = None) -> dict:
+    """
+    Run (or resume) the ReviewPipeline of a job, and write its results to job_dir.
+
+    The directory receives the pipeline's journal.jsonl, the literature review
+    (review.md), the judgments (judgments.json), the BibTeX entries of the relevant
+    papers (bibliography.bib) and the call metrics (metrics.json).
+
+    Returns:
+        dict: The number of relevant papers and the cost of the job.
+    """
+    from .bibliography import write_bibliography
+    from .metrics import get_metrics
+    from .pipeline import ReviewPipeline
+
+    get_metrics().reset()
+    search_kwargs = {k: job[k] for k in SEARCH_FILTERS if k in job}
+    if s2_api_key:
+        search_kwargs["api_key"] = s2_api_key
+    pipeline = ReviewPipeline(
+        job["topic"], job["target_journal"], os.path.join(job_dir, "journal.jsonl"),
+        search_kwargs=search_kwargs, **{k: job[k] for k in PIPELINE_ARGS if k in job})
+    review = pipeline.run()
+    # Replayed from the journal, no further calls are made
+    relevant = pipeline.judge()
+
+    atomic_write_text(os.path.join(job_dir, "review.md"), f"# {job['topic']}\n\n{review}\n")
+    atomic_write_text(os.path.join(job_dir, "judgments.json"),
+           json.dumps(pipeline.judgments(), indent=2))
+    with open(os.path.join(job_dir, "bibliography.bib"), "w", encoding="utf-8") as f:
+        write_bibliography(relevant, f)
+    summary = get_metrics().summary()
+    atomic_write_text(os.path.join(job_dir, "metrics.json"), json.dumps(summary, indent=2))
+    return {
+        "n_relevant": len(relevant),
+        "cost": sum(model["cost"] for model in summary["llm"].values())
+    }
+
+def _run_job_safely(job, job_dir, s2_api_key):
+    # Report failures as data, so that one failing job does not stop the batch
+    start = time.perf_counter()
+    try:
+        return {"status": "done", **run_job(job, job_dir, s2_api_key),
+                "elapsed": time.perf_counter() - start}
+    except Exception as e:
+        return _failure(e, elapsed=time.perf_counter() - start)
+
+def _failure(error, elapsed):
+    return {"status": "failed", "error": f"{type(error).__name__}: {error}",
+            "traceback": "".join(traceback.format_exception(error)), "elapsed": elapsed}
+
+def run_jobs(
+        jobs: List[dict], run_dir: str, workers: Optional[int] = None,
+        max_in_flight: int = 8, requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None, s2_api_key: Optional[str] = None,
+        cache_dir: str = DEFAULT_CACHE_DIR, cache: bool = True, models=(),
+        force: bool = False) -> List[dict]:
+    """
+    Run review jobs from a local queue on a pool of worker processes.
+
+    Every job gets a subdirectory of run_dir, see run_job. Progress is appended to
+    run_dir/progress.jsonl as jobs finish, and jobs already done there are skipped,
+    so that an interrupted batch resumes where it stopped. Interrupted jobs resume
+    from their pipeline journal.
+
+    Args:
+        jobs (List[dict]): The jobs, as returned by load_jobs.
+        run_dir (str): The directory of the results and progress of the run.
+        workers (int, optional): The number of worker processes. Defaults to
+            os.cpu_count().
+        max_in_flight (int): The number of concurrent OpenAI requests, over all workers.
+        requests_per_minute (float, optional): OpenAI requests-per-minute limit, over all workers.
+        tokens_per_minute (float, optional): OpenAI tokens-per-minute limit, over all workers.
+        s2_api_key (str, optional): Semantic Scholar API key.
+        cache_dir (str): The directory of the SQLite paper store and response cache
+            shared by the workers. Defaults to ~/.cache/literer.
+        cache (bool): Whether to cache OpenAI responses. Defaults to True.
+        models (list): (function, model) pairs passed on to set_openai_model, checked
+            before any worker starts.
+        force (bool): Whether to run jobs again that are already done.
+
+    Returns:
+        List[dict]: The progress record of each job that ran.
+    """
+    # A model the workers reject would break the pool, fail before it starts
+    for function, model in models:
+        check_openai_model(model, function)
+    os.makedirs(run_dir, exist_ok=True)
+    atomic_write_text(os.path.join(run_dir, "jobs.json"), json.dumps(jobs, indent=2))
+    progress_path = os.path.join(run_dir, "progress.jsonl")
+    done = _read_progress(progress_path)
+    pending = jobs if force else [job for job in jobs if job["name"] not in done]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+    _log(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, "
+         f"{workers} workers, results in {run_dir}")
+
+    settings = {
+        "workers": workers, "max_in_flight": max_in_flight,
+        "requests_per_minute": requests_per_minute, "tokens_per_minute": tokens_per_minute,
+        "s2_api_key": s2_api_key, "cache_dir": cache_dir, "cache": cache,
+        "models": list(models)
+    }
+    records = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(settings,)) as pool:
+        futures = {}
+        for job in pending:
+            job_dir = os.path.join(run_dir, job["name"])
+            os.makedirs(job_dir, exist_ok=True)
+            try:
+                future = pool.submit(_run_job_safely, job, job_dir, s2_api_key)
+            except BrokenProcessPool as e:
+                future = Future()
+                future.set_exception(e)
+            futures[future] = job
+        try:
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died, e.g., in its initializer. The job is recorded as
+                    # failed, so that it runs again on the next run
+                    result = _failure(e, elapsed=0.0)
+                record = {"job": job["name"], "finished": time.time(), **result}
+                with open(progress_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+                records.append(record)
+                message = (f"{record['n_relevant']} relevant papers, ${record['cost']:.2f}"
+                           if record["status"] == "done" else record["error"])
+                _log(f"[{len(records)}/{len(pending)}] {record['status']} {job['name']} "
+                     f"in {record['elapsed']:.0f} s: {message}")
+        except KeyboardInterrupt:
+            # Running jobs resume from their journal on the next run
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    return records
+
+def _read_progress(progress_path):
+    # Return the names of the jobs recorded as done, and end a truncated last line,
+    # so that the records appended next start on a line of their own
+    done = set()
+    if not os.path.exists(progress_path):
+        return done
+    with open(progress_path, encoding="utf-8") as f:
+        text = f.read()
+    for line in text.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # A crash may leave a truncated last line behind
+            continue
+        if record.get("status") == "done":
+            done.add(record["job"])
+    if text and not text.endswith("\n"):
+        with open(progress_path, "a", encoding="utf-8") as f:
+            f.write("\n")
+    return done
+
+def _log(message):
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.stderr, flush=True)
+
+
+def _model_setting(value):
+    # 'gpt-4' sets the default model, 'judge_paper=gpt-4' the model of one function
+    function, sep, model = value.rpartition("=")
+    return (function or None) if sep else None, model
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point of the `literer` command."""
+    parser = argparse.ArgumentParser(
+        prog="literer", description="Automated literature reviews from the command line.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser(
+        "run", help="Run the review jobs of a job file on a pool of worker processes.")
+    run.add_argument("jobs", help="The YAML or JSON job file, see literer.cli.load_jobs.")
+    run.add_argument("--run-dir", help="The directory of the results and progress. "
+                     "Defaults to runs/<job file name>.")
+    run.add_argument("--workers", type=int, help="The number of worker processes. "
+                     "Defaults to the number of cores.")
+    run.add_argument("--max-in-flight", type=int, default=8,
+                     help="Concurrent OpenAI requests, over all workers. Defaults to 8.")
+    run.add_argument("--requests-per-minute", type=float,
+                     help="OpenAI requests-per-minute limit, over all workers.")
+    run.add_argument("--tokens-per-minute", type=float,
+                     help="OpenAI tokens-per-minute limit, over all workers.")
+    run.add_argument("--model", action="append", default=[], type=_model_setting,
+                     metavar="[FUNCTION=]MODEL",
+                     help="The OpenAI model, or the model of one function, "
+                     "e.g., judge_paper=gpt-4. Can be repeated.")
+    run.add_argument("--s2-api-key", default=os.environ.get("S2_API_KEY"),
+                     help="Semantic Scholar API key. Defaults to $S2_API_KEY.")
+    run.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                     help="The directory of the shared paper store and response cache.")
+    run.add_argument("--no-cache", action="store_true",
+                     help="Do not cache OpenAI responses.")
+    run.add_argument("--force", action="store_true",
+                     help="Run jobs again that are already done.")
+
+    journals = commands.add_parser(
+        "journals", help="List the top journals of a field, for use as target_journal.")
+    journals.add_argument("field", help="The field, e.g., Economics.")
+    journals.add_argument("--all", action="store_true", help="Not only the top 5.")
+
+    args = parser.parse_args(argv)
+    if args.command == "journals":
+        from .scholar import get_top_journals
+        print("\n".join(get_top_journals(args.field, top5=not args.all)))
+        return 0
+
+    jobs = load_jobs(args.jobs)
+    run_dir = args.run_dir or os.path.join(
+        "runs", os.path.splitext(os.path.basename(args.jobs))[0])
+    records = run_jobs(
+        jobs, run_dir, workers=args.workers, max_in_flight=args.max_in_flight,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute, s2_api_key=args.s2_api_key,
+        cache_dir=args.cache_dir, cache=not args.no_cache, models=args.model,
+        force=args.force)
+    return 1 if any(r["status"] == "failed" for r in records) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
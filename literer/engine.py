@@ -0,0 +1,345 @@
+import asyncio
+import itertools
+import openai.error
+import openai.util
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from .backends import get_backend
+from .cache import get_response_cache
+from .metrics import get_metrics
+from .utils import TokenBucket, count_tokens, get_openai_model, retry_delay
+
+# Errors worth retrying: rate limiting, server errors, timeouts and dropped connections
+RETRY_ERRORS = (
+    openai.error.RateLimitError, openai.error.APIError,
+    openai.error.ServiceUnavailableError, openai.error.Timeout,
+    openai.error.APIConnectionError, openai.error.TryAgain
+)
+
+
+class Scheduler:
+    """
+    Bounded-concurrency scheduler for OpenAI chat completions.
+
+    Every completion issued by literer, whether from the sync or the async API,
+    goes through the scheduler, which caps the number of requests in flight and
+    enforces client-side requests-per-minute and tokens-per-minute limits. Rate
+    limited (429), server and connection errors are retried with exponential
+    backoff and jitter, honouring the `Retry-After` header when the API sends one,
+    so that one error does not fail a whole batch of concurrent requests.
+
+    Args:
+        max_in_flight (int): The maximum number of concurrent requests. Also the
+            size of the thread pools used by the sync API. Defaults to 8.
+        requests_per_minute (float, optional): Requests-per-minute limit.
+        tokens_per_minute (float, optional): Prompt tokens-per-minute limit.
+        max_retries (int): Number of retries before giving up on a request.
+        backoff (float): Base delay in seconds of the exponential backoff.
+        max_backoff (float): Upper bound in seconds on a single retry delay.
+    """
+    def __init__(
+            self, max_in_flight: int = 8,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None, max_retries: int = 5,
+            backoff: float = 1.0, max_backoff: float = 60.0):
+        if max_in_flight < 1:
+            raise ValueError("'max_in_flight' must be at least 1")
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.requests = (TokenBucket(requests_per_minute / 60, requests_per_minute)
+                         if requests_per_minute else None)
+        self.tokens = (TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+                       if tokens_per_minute else None)
+        self._threads = threading.BoundedSemaphore(max_in_flight)
+        # asyncio semaphores are bound to an event loop, keep one per loop
+        self._loops = weakref.WeakKeyDictionary()
+
+    def _delay(self, messages, model) -> float:
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            n_tokens = sum(count_tokens(m["content"], model) for m in messages)
+            delay = max(delay, self.tokens.reserve(n_tokens))
+        return delay
+
+    @contextmanager
+    def slot(self, messages, model):
+        """Block until a request for the given messages may be sent."""
+        with self._threads:
+            delay = self._delay(messages, model)
+            if delay > 0:
+                time.sleep(delay)
+            yield
+
+    @asynccontextmanager
+    async def aslot(self, messages, model):
+        """Asynchronously wait until a request for the given messages may be sent."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._loops:
+            self._loops[loop] = asyncio.Semaphore(self.max_in_flight)
+        async with self._loops[loop]:
+            delay = self._delay(messages, model)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        """Return how long to wait before retrying a request which failed with error."""
+        headers = getattr(error, "headers", None) or {}
+        retry_after = headers.get("retry-after") or headers.get("Retry-After")
+        return retry_delay(attempt, self.backoff, self.max_backoff, retry_after)
+
+    def call(self, fn: Callable, messages, model, slot: bool = True) -> Tuple[object, int]:
+        """
+        Call fn, in a slot unless slot is False, retrying the errors in RETRY_ERRORS.
+
+        The slot is released while waiting to retry, and every attempt counts
+        against the rate limits.
+
+        Returns:
+            tuple: The result of fn and the number of retries it took.
+        """
+        for attempt in itertools.count():
+            try:
+                if not slot:
+                    return fn(), attempt
+                with self.slot(messages, model):
+                    return fn(), attempt
+            except RETRY_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_delay(e, attempt)
+                time.sleep(delay if slot else max(delay, self._delay(messages, model)))
+
+    async def acall(
+            self, fn: Callable, messages, model, slot: bool = True) -> Tuple[object, int]:
+        """Asynchronous version of call, fn returns an awaitable."""
+        for attempt in itertools.count():
+            try:
+                if not slot:
+                    return await fn(), attempt
+                async with self.aslot(messages, model):
+                    return await fn(), attempt
+            except RETRY_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_delay(e, attempt)
+                await asyncio.sleep(delay if slot else max(delay, self._delay(messages, model)))
+
+    def map(self, fn: Callable, items: Iterable) -> List:
+        """Apply fn to every item on a thread pool, preserving the input order."""
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(items))) as pool:
+            return list(pool.map(fn, items))
+
+    def imap_unordered(self, fn: Callable, items: Iterable) -> Iterator[Tuple[int, object]]:
+        """Apply fn to every item on a thread pool, yielding (index, result) pairs as they complete."""
+        pool = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        try:
+            futures = {pool.submit(fn, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # Do not start pending work if the caller stops consuming early
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+SCHEDULER = Scheduler()
+
+def get_scheduler() -> Scheduler:
+    global SCHEDULER
+    return SCHEDULER
+
+def set_scheduler(scheduler: Scheduler):
+    """
+    Replace the global scheduler used for all OpenAI calls.
+
+    Args:
+        scheduler (Scheduler): The new scheduler.
+
+    Example:
+        >>> set_scheduler(Scheduler(max_in_flight=16, requests_per_minute=3500))
+    """
+    global SCHEDULER
+    SCHEDULER = scheduler
+
+
+def chat_completion(messages, model=None, **kwargs):
+    """
+    Create a chat completion with the backend of the model, see set_backend.
+
+    Requests go through the backend's scheduler if it has one, and through the
+    global scheduler otherwise. If a response cache is set, identical requests are
+    answered from the cache without contacting the backend.
+
+    Args:
+        messages (list): The chat messages to send.
+        model (str, optional): The model to use. Defaults to get_openai_model().
+        **kwargs: Further arguments passed on to the backend, e.g., to
+            openai.ChatCompletion.create.
+
+    Returns:
+        The OpenAI response object.
+    """
+    model = model or get_openai_model()
+    backend = get_backend(model)
+    start = time.perf_counter()
+    cache, key = _cache_lookup(model, messages, kwargs, backend)
+    if key is not None and (cached := cache.get(key)) is not None:
+        get_metrics().record_llm(model, time.perf_counter() - start, cached=True)
+        return openai.util.convert_to_openai_object(cached)
+    response, retries = _scheduler(backend).call(
+        lambda: backend.create(model, messages, **kwargs), messages, model)
+    get_metrics().record_llm(
+        model, time.perf_counter() - start, response.get("usage"), priced=backend.priced,
+        retries=retries)
+    if key is not None:
+        cache.set(key, response.to_dict_recursive())
+    return response
+
+async def achat_completion(messages, model=None, **kwargs):
+    """Asynchronous version of chat_completion."""
+    model = model or get_openai_model()
+    backend = get_backend(model)
+    start = time.perf_counter()
+    cache, key = _cache_lookup(model, messages, kwargs, backend)
+    if key is not None and (cached := cache.get(key)) is not None:
+        get_metrics().record_llm(model, time.perf_counter() - start, cached=True)
+        return openai.util.convert_to_openai_object(cached)
+    response, retries = await _scheduler(backend).acall(
+        lambda: backend.acreate(model, messages, **kwargs), messages, model)
+    get_metrics().record_llm(
+        model, time.perf_counter() - start, response.get("usage"), priced=backend.priced,
+        retries=retries)
+    if key is not None:
+        cache.set(key, response.to_dict_recursive())
+    return response
+
+def stream_chat_completion(messages, model=None, **kwargs) -> Iterator[str]:
+    """
+    Create a streamed chat completion, yielding the content as it is generated.
+
+    The scheduler slot is held until the stream is exhausted. Errors opening the
+    stream are retried as in chat_completion, errors once content was yielded are
+    not. A cached response is yielded in one piece, and a completed stream is added
+    to the cache.
+
+    Args:
+        messages (list): The chat messages to send.
+        model (str, optional): The model to use. Defaults to get_openai_model().
+        **kwargs: Further arguments passed on to the backend, see chat_completion.
+
+    Yields:
+        str: The successive pieces of the response content.
+    """
+    model = model or get_openai_model()
+    backend = get_backend(model)
+    start = time.perf_counter()
+    cache, key = _cache_lookup(model, messages, kwargs, backend)
+    if key is not None and (cached := cache.get(key)) is not None:
+        get_metrics().record_llm(model, time.perf_counter() - start, cached=True)
+        yield openai.util.convert_to_openai_object(cached).choices[0].message.content
+        return
+    content = []
+    scheduler = _scheduler(backend)
+    with scheduler.slot(messages, model):
+        stream, retries = scheduler.call(
+            lambda: backend.create(model, messages, stream=True, **kwargs),
+            messages, model, slot=False)
+        for chunk in stream:
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                content.append(delta)
+                yield delta
+    # Streamed replies carry no usage, count the tokens ourselves
+    get_metrics().record_llm(
+        model, time.perf_counter() - start, _stream_usage(messages, content, model),
+        priced=backend.priced, retries=retries)
+    if key is not None:
+        cache.set(key, _streamed_response(model, "".join(content)))
+
+async def astream_chat_completion(messages, model=None, **kwargs) -> AsyncIterator[str]:
+    """Asynchronous version of stream_chat_completion."""
+    model = model or get_openai_model()
+    backend = get_backend(model)
+    start = time.perf_counter()
+    cache, key = _cache_lookup(model, messages, kwargs, backend)
+    if key is not None and (cached := cache.get(key)) is not None:
+        get_metrics().record_llm(model, time.perf_counter() - start, cached=True)
+        yield openai.util.convert_to_openai_object(cached).choices[0].message.content
+        return
+    content = []
+    scheduler = _scheduler(backend)
+    async with scheduler.aslot(messages, model):
+        stream, retries = await scheduler.acall(
+            lambda: backend.acreate(model, messages, stream=True, **kwargs),
+            messages, model, slot=False)
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.get("content")
+            if delta:
+                content.append(delta)
+                yield delta
+    # Streamed replies carry no usage, count the tokens ourselves
+    get_metrics().record_llm(
+        model, time.perf_counter() - start, _stream_usage(messages, content, model),
+        priced=backend.priced, retries=retries)
+    if key is not None:
+        cache.set(key, _streamed_response(model, "".join(content)))
+
+def _streamed_response(model, content):
+    # Shape a streamed reply like a regular response, so it can be cached
+    return {
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}]
+    }
+
+def _stream_usage(messages, content, model):
+    return {
+        "prompt_tokens": sum(count_tokens(m["content"], model) for m in messages),
+        "completion_tokens": count_tokens("".join(content), model)
+    }
+
+def _cache_lookup(model, messages, kwargs, backend):
+    cache = get_response_cache()
+    if cache is None or kwargs.get("stream"):
+        return cache, None
+    # Keys of OpenAI's own responses are left as they were before backends existed
+    if backend.namespace is not None:
+        kwargs = {**kwargs, "backend": backend.namespace}
+    return cache, cache.make_key(model, messages, **kwargs)
+
+def _scheduler(backend):
+    return backend.scheduler or get_scheduler()
+
+def thread_map(fn: Callable, items: Iterable, model: Optional[str] = None) -> List:
+    """
+    Apply fn to every item concurrently using the global scheduler's thread pool, or
+    that of the backend of model if it has a scheduler of its own.
+    """
+    return _scheduler(get_backend(model)).map(fn, items)
+
+def thread_imap_unordered(
+        fn: Callable, items: Iterable, model: Optional[str] = None
+        ) -> Iterator[Tuple[int, object]]:
+    """Apply fn to every item concurrently, yielding (index, result) pairs as they complete."""
+    return _scheduler(get_backend(model)).imap_unordered(fn, items)
+
+async def as_completed_indexed(coros) -> AsyncIterator[Tuple[int, object]]:
+    """Run coroutines concurrently, yielding (index, result) pairs as they complete."""
+    async def indexed(i, coro):
+        return i, await coro
+
+    for next_done in asyncio.as_completed([indexed(i, c) for i, c in enumerate(coros)]):
+        yield await next_done
@@ -0,0 +1,234 @@
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, TextIO, Tuple
+
+# Estimated USD prices per 1000 (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimate the cost in USD of a call, using the longest matching entry of MODEL_PRICES.
+
+    Dated model versions, e.g., 'gpt-4-0613', are priced as their base model. Unknown
+    models are assumed to be free.
+    """
+    matches = [m for m in MODEL_PRICES if model.startswith(m)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class Metrics:
+    """
+    Thread-safe counters of every OpenAI and Semantic Scholar call.
+
+    Each call is recorded as an event dict, passed on to the registered hooks and
+    aggregated into per-model, per-endpoint and per-stage counters.
+
+    Args:
+        max_events (int, optional): The number of most recent events kept for
+            to_jsonl. Defaults to 100000.
+
+    Example:
+        >>> get_metrics().add_hook(print)
+        >>> get_metrics().summary()["llm"]["gpt-3.5-turbo"]["cost"]
+    """
+    def __init__(self, max_events: Optional[int] = 100000):
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._hooks: List[Callable[[dict], None]] = []
+        # Stages are process-wide, so that calls made from worker threads are tagged too
+        self.current_stage: Optional[str] = None
+        self.reset()
+
+    def reset(self):
+        """Clear every counter and the recorded events."""
+        with self._lock:
+            self.events = deque(maxlen=self.max_events)
+            self._llm = defaultdict(lambda: defaultdict(float))
+            self._http = defaultdict(lambda: defaultdict(float))
+            self._stages = defaultdict(lambda: defaultdict(float))
+            self._prompts = defaultdict(lambda: defaultdict(float))
+            self._cascade = defaultdict(lambda: defaultdict(float))
+            self._parsing = defaultdict(lambda: defaultdict(float))
+
+    def add_hook(self, hook: Callable[[dict], None]):
+        """Call hook with every recorded event."""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[dict], None]):
+        self._hooks.remove(hook)
+
+    def _record(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+            counters = self._stages[event["stage"] or "other"]
+            counters[f"{event['kind']}_calls"] += 1
+            counters["latency"] += event["latency"]
+            counters["cost"] += event.get("cost", 0.0)
+        for hook in self._hooks:
+            hook(event)
+
+    def record_llm(
+            self, model: str, latency: float, usage: Optional[dict] = None,
+            cached: bool = False, priced: bool = True, retries: int = 0):
+        """
+        Record a chat completion, its token usage, its latency and how many retries it took.
+
+        Calls which are not priced, e.g., to a local server, cost nothing.
+        """
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        cost = (estimate_cost(model, prompt_tokens, completion_tokens)
+                if priced and not cached else 0.0)
+        event = {
+            "kind": "llm", "time": time.time(), "model": model,
+            "stage": self.current_stage,
+            "latency": latency, "cached": cached, "retries": retries,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens, "cost": cost
+        }
+        with self._lock:
+            counters = self._llm[model]
+            counters["calls"] += 1
+            counters["cache_hits"] += cached
+            counters["retries"] += retries
+            counters["prompt_tokens"] += prompt_tokens
+            counters["completion_tokens"] += completion_tokens
+            counters["cost"] += cost
+            counters["latency"] += latency
+        self._record(event)
+
+    def record_http(
+            self, endpoint: str, status: Optional[int], latency: float,
+            retries: int = 0):
+        """Record a Semantic Scholar request, its final status, latency and retries."""
+        event = {
+            "kind": "http", "time": time.time(), "endpoint": endpoint,
+            "status": status, "latency": latency, "retries": retries,
+            "stage": self.current_stage
+        }
+        with self._lock:
+            counters = self._http[endpoint]
+            counters["calls"] += 1
+            counters["retries"] += retries
+            counters["latency"] += latency
+            counters[f"status_{status}"] += 1
+        self._record(event)
+
+    def record_prompt(self, builder: str, original_tokens: int, compact_tokens: int):
+        """Record the tokens saved by compacting a prompt, e.g., in single_review."""
+        with self._lock:
+            counters = self._prompts[builder]
+            counters["calls"] += 1
+            counters["original_tokens"] += original_tokens
+            counters["compact_tokens"] += compact_tokens
+            counters["tokens_saved"] += original_tokens - compact_tokens
+
+    def record_cascade(
+            self, cheap_model: str, strong_model: str, n_judged: int,
+            escalated: List[Tuple], audited: List[Tuple], tolerance: int = 1):
+        """
+        Record how often a cascade escalated, and how the cheap and strong scores compare.
+
+        Args:
+            cheap_model (str): The model scoring every publication.
+            strong_model (str): The model escalated to.
+            n_judged (int): The number of publications judged by the cheap model.
+            escalated (list): (cheap score, strong score) pairs of the papers escalated
+                because of their uncertain cheap score.
+            audited (list): (cheap score, strong score) pairs of the confidently judged
+                papers escalated anyway.
+            tolerance (int): Scores at most this far apart count as an agreement.
+        """
+        event = {
+            "kind": "cascade", "time": time.time(), "cheap_model": cheap_model,
+            "strong_model": strong_model, "stage": self.current_stage,
+            "judged": n_judged, "escalated": escalated, "audited": audited
+        }
+        with self._lock:
+            counters = self._cascade[f"{cheap_model}->{strong_model}"]
+            counters["judged"] += n_judged
+            for kind, pairs in (("escalated", escalated), ("audited", audited)):
+                counters[kind] += len(pairs)
+                for cheap, strong in pairs:
+                    if not (isinstance(cheap, int) and isinstance(strong, int)):
+                        continue
+                    counters[f"{kind}_compared"] += 1
+                    counters[f"{kind}_agreements"] += abs(cheap - strong) <= tolerance
+                    counters[f"{kind}_score_diff"] += strong - cheap
+            self.events.append(event)
+        for hook in self._hooks:
+            hook(event)
+
+    def record_parse(self, function: str, outcome: str):
+        """Record whether a reply of function was valid ('ok'), 'repaired' or 'failed'."""
+        with self._lock:
+            self._parsing[function][outcome] += 1
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Return the aggregated counters, per model ('llm'), per endpoint ('http'), per
+        stage ('stages'), per prompt builder ('prompts'), per judging cascade
+        ('cascade') and the outcome of parsing replies per function ('parsing').
+        """
+        with self._lock:
+            return {
+                "llm": {m: dict(c) for m, c in self._llm.items()},
+                "http": {e: dict(c) for e, c in self._http.items()},
+                "stages": {s: dict(c) for s, c in self._stages.items()},
+                "prompts": {b: dict(c) for b, c in self._prompts.items()},
+                "cascade": {r: dict(c) for r, c in self._cascade.items()},
+                "parsing": {f: dict(c) for f, c in self._parsing.items()}
+            }
+
+    def to_jsonl(self, f: TextIO):
+        """Write the recorded events as JSON lines to the file handle f."""
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+    def to_prometheus(self) -> str:
+        """Return the counters in the Prometheus text exposition format."""
+        lines = []
+        summary = self.summary()
+        for kind, label in (("llm", "model"), ("http", "endpoint"), ("stages", "stage"),
+                            ("prompts", "builder"), ("cascade", "route"),
+                            ("parsing", "function")):
+            names = sorted({name for c in summary[kind].values() for name in c})
+            for name in names:
+                metric = f"literer_{kind}_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                for key, counters in summary[kind].items():
+                    if name in counters:
+                        lines.append(f'{metric}{{{label}="{key}"}} {counters[name]}')
+        return "\n".join(lines) + "\n"
+
+    @contextmanager
+    def stage(self, name: str):
+        """Tag every call made within the block with a stage name, e.g., 'judge'."""
+        previous, self.current_stage = self.current_stage, name
+        try:
+            yield
+        finally:
+            self.current_stage = previous
+
+
+METRICS = Metrics()
+
+def get_metrics() -> Metrics:
+    global METRICS
+    return METRICS
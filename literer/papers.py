@@ -0,0 +1,230 @@
+import numpy as np
+import sys
+from collections.abc import Mapping
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+# Columns stored as plain Python lists, one entry per paper
+_TEXT_FIELDS = ("paperId", "title", "abstract", "bibtex", "url", "doi")
+# Marks an unknown year in the int32 year column
+YEAR_MISSING = -1
+
+
+class Paper(Mapping):
+    """
+    Read-only view of one row of a PaperSet.
+
+    A Paper behaves like the dict returned by `extract_paper_info`, so it can be
+    passed to every function expecting a publication, but it does not copy any
+    data out of its PaperSet.
+    """
+    __slots__ = ("_papers", "_row")
+
+    def __init__(self, papers: "PaperSet", row: int):
+        self._papers = papers
+        self._row = row
+
+    def __getitem__(self, key):
+        return self._papers._value(key, self._row)
+
+    def __iter__(self):
+        return iter(self._papers._keys(self._row))
+
+    def __len__(self):
+        return len(self._papers._keys(self._row))
+
+    def __repr__(self):
+        return f"Paper({dict(self)!r})"
+
+
+class PaperSet:
+    """
+    Compact, columnar collection of publications.
+
+    Text fields are stored column by column, years, scores and venues in NumPy
+    arrays (venues as codes into a table of interned strings), and author names are
+    interned, so that large corpora take a fraction of the memory of a list of
+    dicts. Filters are vectorised and return views sharing the same columns, and
+    iterating yields Paper rows which can be passed to `judge_papers`,
+    `summarize_papers` or `create_bibliography` like the usual dicts.
+
+    Example:
+        >>> papers = PaperSet.from_records(get_papers_multi(keywords))
+        >>> papers.set_judgments(judge_papers(papers, topic, target_journal))
+        >>> best = papers.filter(year_min=2010, min_score=7).top_k(20)
+        >>> lit_review = summarize_papers(best, topic)
+    """
+    def __init__(self, columns: dict, rows: np.ndarray):
+        self._columns = columns
+        self._rows = rows
+
+    @classmethod
+    def from_records(cls, records: Iterable[Mapping]) -> "PaperSet":
+        """Build a PaperSet from publications, e.g., as returned by get_papers."""
+        columns = {field: [] for field in _TEXT_FIELDS}
+        authors, years, venue_codes, extras = [], [], [], []
+        venues, venue_codes_by_name = [], {}
+        for record in records:
+            for field in _TEXT_FIELDS:
+                columns[field].append(record.get(field))
+            authors.append(tuple(sys.intern(a) for a in record.get("authors") or ()))
+            year = record.get("year")
+            years.append(YEAR_MISSING if year is None else year)
+            venue = record.get("venue") or ""
+            if venue not in venue_codes_by_name:
+                venue_codes_by_name[venue] = len(venues)
+                venues.append(sys.intern(venue))
+            venue_codes.append(venue_codes_by_name[venue])
+            extra = {k: v for k, v in record.items()
+                     if k not in _TEXT_FIELDS and k not in ("authors", "year", "venue")}
+            extras.append(extra or None)
+
+        n = len(years)
+        columns.update({
+            "authors": authors,
+            "year": np.asarray(years, dtype=np.int32),
+            "venue_code": np.asarray(venue_codes, dtype=np.int32),
+            "venues": venues,
+            "score": np.full(n, np.nan, dtype=np.float32),
+            "reason": [None] * n,
+            "extra": extras
+        })
+        return cls(columns, np.arange(n))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return (Paper(self, row) for row in self._rows)
+
+    def __getitem__(self, index: Union[int, slice, Sequence[int], np.ndarray]):
+        if isinstance(index, (int, np.integer)):
+            return Paper(self, self._rows[index])
+        return PaperSet(self._columns, self._rows[index])
+
+    def __repr__(self):
+        return f"PaperSet({len(self)} papers)"
+
+    def _keys(self, row: int) -> List[str]:
+        keys = [*_TEXT_FIELDS, "authors", "year", "venue"]
+        if not np.isnan(self._columns["score"][row]):
+            keys += ["score", "reason"]
+        return keys + list(self._columns["extra"][row] or ())
+
+    def _value(self, key: str, row: int):
+        columns = self._columns
+        if key in _TEXT_FIELDS or key == "reason":
+            return columns[key][row]
+        if key == "authors":
+            return list(columns["authors"][row])
+        if key == "year":
+            year = int(columns["year"][row])
+            return None if year == YEAR_MISSING else year
+        if key == "venue":
+            return columns["venues"][columns["venue_code"][row]]
+        if key == "score":
+            score = columns["score"][row]
+            if np.isnan(score):
+                raise KeyError(key)
+            return int(score)
+        extra = columns["extra"][row]
+        if extra is None or key not in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    @property
+    def years(self) -> np.ndarray:
+        """The publication years, YEAR_MISSING where unknown."""
+        return self._columns["year"][self._rows]
+
+    @property
+    def scores(self) -> np.ndarray:
+        """The relevance scores, NaN for papers not judged yet."""
+        return self._columns["score"][self._rows]
+
+    @property
+    def venues(self) -> List[str]:
+        codes = self._columns["venue_code"][self._rows]
+        return [self._columns["venues"][c] for c in codes]
+
+    def set_judgments(self, judgments: Sequence[Tuple[int, str]]):
+        """Store the (score, reason) pairs, e.g., from judge_papers, in row order."""
+        if len(judgments) != len(self):
+            raise ValueError("'judgments' must have one entry per paper")
+        for row, (score, reason) in zip(self._rows, judgments):
+            self._columns["score"][row] = score if isinstance(score, int) else np.nan
+            self._columns["reason"][row] = reason
+
+    def filter(
+            self, year_min: Optional[int] = None, year_max: Optional[int] = None,
+            venues: Optional[Iterable[str]] = None,
+            min_score: Optional[float] = None) -> "PaperSet":
+        """
+        Return the papers matching every given condition, as a view on this set.
+
+        Args:
+            year_min (int, optional): The earliest publication year.
+            year_max (int, optional): The latest publication year.
+            venues (list, optional): The accepted venues.
+            min_score (float, optional): The minimum relevance score.
+        """
+        mask = np.ones(len(self._rows), dtype=bool)
+        years = self.years
+        if year_min is not None:
+            mask &= years >= year_min
+        if year_max is not None:
+            mask &= (years <= year_max) & (years != YEAR_MISSING)
+        if venues is not None:
+            wanted = set(venues)
+            codes = [i for i, v in enumerate(self._columns["venues"]) if v in wanted]
+            mask &= np.isin(self._columns["venue_code"][self._rows], codes)
+        if min_score is not None:
+            # NaN scores compare as False, unjudged papers are dropped
+            mask &= self.scores >= min_score
+        return PaperSet(self._columns, self._rows[mask])
+
+    def top_k(self, k: int) -> "PaperSet":
+        """Return the k papers with the highest relevance score, best first."""
+        scores = np.nan_to_num(self.scores, nan=-np.inf)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return PaperSet(self._columns, self._rows[order])
+
+    def to_records(self) -> List[dict]:
+        """Return the papers as a list of plain dicts."""
+        return [dict(paper) for paper in self]
+
+    def to_pandas(self):
+        """
+        Export to a pandas DataFrame. Requires pandas.
+
+        The selected rows are copied out of the columns, years as a nullable integer
+        column and venues as a categorical column.
+        """
+        import pandas as pd
+
+        years = self.years
+        data = {field: [self._columns[field][r] for r in self._rows] for field in _TEXT_FIELDS}
+        data.update({
+            "authors": [list(self._columns["authors"][r]) for r in self._rows],
+            "year": pd.arrays.IntegerArray(years, years == YEAR_MISSING),
+            "venue": pd.Categorical.from_codes(
+                self._columns["venue_code"][self._rows], self._columns["venues"]),
+            "score": self.scores,
+            "reason": [self._columns["reason"][r] for r in self._rows]
+        })
+        return pd.DataFrame(data)
+
+    def to_arrow(self):
+        """Export to a pyarrow Table. Requires pyarrow."""
+        import pyarrow as pa
+
+        years = self.years
+        data = {field: [self._columns[field][r] for r in self._rows] for field in _TEXT_FIELDS}
+        data.update({
+            "authors": [list(self._columns["authors"][r]) for r in self._rows],
+            "year": pa.array(years, mask=years == YEAR_MISSING),
+            "venue": pa.DictionaryArray.from_arrays(
+                self._columns["venue_code"][self._rows], self._columns["venues"]),
+            "score": pa.array(self.scores, from_pandas=True),
+            "reason": [self._columns["reason"][r] for r in self._rows]
+        })
+        return pa.table(data)
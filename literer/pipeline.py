@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Union
+
+from .assistant import (cascade_judge_papers, combine_reviews, get_keywords, iter_reviews,
+                        judge_papers)
+from .metrics import get_metrics
+from .scholar import dedupe_keys, get_papers
+
+
+class Journal:
+    """
+    Append-only JSON lines journal of completed pipeline items.
+
+    Every line records the value computed for one (stage, key) pair. The journal is
+    replayed when opened, so that completed items are never computed twice.
+
+    Args:
+        path (str): The path of the .jsonl journal file.
+    """
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.entries: Dict[str, Dict[str, object]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash may leave a truncated last line behind
+                        continue
+                    self.entries.setdefault(entry["stage"], {})[entry["key"]] = entry["value"]
+
+    def get(self, stage: str) -> Dict[str, object]:
+        """Return the (live) values recorded for a stage, keyed by item."""
+        return self.entries.setdefault(stage, {})
+
+    def record(self, stage: str, key: str, value):
+        """Record the value of an item and flush it to disk right away."""
+        self.entries.setdefault(stage, {})[key] = value
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"stage": stage, "key": key, "value": value}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ReviewPipeline:
+    """
+    Resumable keywords -> search -> judge -> review -> summarize pipeline.
+
+    Each stage is restartable and checkpoints every completed item to a journal, so
+    that a crashed or interrupted run resumes where it stopped, and re-running with
+    more keywords only processes the new papers.
+
+    Args:
+        topic (str): The topic of the literature review.
+        target_journal (str or list): The journal(s) the paper is aimed at.
+        journal_path (str): The path of the .jsonl journal used for checkpoints.
+        n_keywords (int): The number of keywords requested from get_keywords.
+        keywords (list, optional): Keywords to search for, in addition to the
+            suggested ones. Pass n_keywords=0 to only use these.
+        n_pubs (int): The maximum number of publications per keyword.
+        min_relevance (int): The minimum relevance score of a paper to be reviewed.
+        judge_batch_size (int, optional): The batch_size passed on to judge_papers.
+        judge_cascade (dict, optional): If given, papers are judged with
+            cascade_judge_papers and these arguments, e.g., {"band": (5, 8)}.
+        checkpoint_every (int): The number of papers judged between checkpoints.
+        search_kwargs (dict, optional): Further filters passed on to get_papers.
+
+    Example:
+        >>> pipeline = ReviewPipeline(topic, "Econometrica", "runs/almp.jsonl")
+        >>> review = pipeline.run()
+        >>> pipeline.add_keywords(["job search assistance"])
+        >>> review = pipeline.run()  # Only the new papers are judged and reviewed
+    """
+    def __init__(
+            self, topic: str, target_journal: Union[str, List[str]],
+            journal_path: str, n_keywords: int = 3,
+            keywords: Optional[List[str]] = None, n_pubs: int = 30,
+            min_relevance: int = 7, judge_batch_size: Optional[int] = None,
+            judge_cascade: Optional[dict] = None, checkpoint_every: int = 50,
+            search_kwargs: Optional[dict] = None):
+        self.topic = topic
+        self.target_journal = target_journal
+        self.n_keywords = n_keywords
+        self.n_pubs = n_pubs
+        self.min_relevance = min_relevance
+        self.judge_batch_size = judge_batch_size
+        self.judge_cascade = judge_cascade
+        self.checkpoint_every = checkpoint_every
+        self.search_kwargs = search_kwargs or {}
+        self.journal = Journal(journal_path)
+        if keywords:
+            self.add_keywords(keywords)
+
+    def add_keywords(self, keywords: List[str]):
+        """Add keywords to search for, the next run only processes their new papers."""
+        for keyword in keywords:
+            if keyword not in self.journal.get("keywords"):
+                self.journal.record("keywords", keyword, True)
+
+    def suggest_keywords(self) -> List[str]:
+        """Stage 1: ask for n_keywords keywords, once."""
+        if self.n_keywords and "suggested" not in self.journal.get("suggested"):
+            with get_metrics().stage("keywords"):
+                self.add_keywords(get_keywords(self.topic, self.n_keywords))
+            self.journal.record("suggested", "suggested", True)
+        return list(self.journal.get("keywords"))
+
+    def search(self) -> List[dict]:
+        """Stage 2: search every keyword not searched yet, return the unique papers."""
+        keywords = self.suggest_keywords()
+        searched = self.journal.get("search")
+        with get_metrics().stage("search"):
+            for keyword in keywords:
+                if keyword not in searched:
+                    papers = get_papers(keyword, n_pubs=self.n_pubs, **self.search_kwargs)
+                    self.journal.record("search", keyword, papers)
+
+        papers, seen = [], set()
+        for keyword_papers in self.journal.get("search").values():
+            for paper in keyword_papers:
+                keys = dedupe_keys(paper)
+                if not seen.intersection(keys):
+                    papers.append(paper)
+                seen.update(keys)
+        return papers
+
+    def judge(self) -> List[dict]:
+        """Stage 3: judge every paper not judged yet, return the relevant papers."""
+        papers = self.search()
+        judged = self.journal.get("judge")
+        pending = [p for p in papers if p["paperId"] not in judged]
+        with get_metrics().stage("judge"):
+            for i in range(0, len(pending), self.checkpoint_every):
+                chunk = pending[i:i + self.checkpoint_every]
+                if self.judge_cascade is not None:
+                    judgments = cascade_judge_papers(
+                        chunk, self.topic, self.target_journal,
+                        batch_size=self.judge_batch_size, **self.judge_cascade)
+                else:
+                    judgments = judge_papers(chunk, self.topic, self.target_journal,
+                                             batch_size=self.judge_batch_size)
+                for paper, (score, reason) in zip(chunk, judgments):
+                    self.journal.record("judge", paper["paperId"], [score, reason])
+
+        return [p for p in papers
+                if isinstance(judged[p["paperId"]][0], int) and
+                judged[p["paperId"]][0] >= self.min_relevance]
+
+    def review(self) -> Dict[str, str]:
+        """Stage 4: review every relevant paper not reviewed yet, return the reviews."""
+        relevant = self.judge()
+        reviewed = self.journal.get("review")
+        pending = [p for p in relevant if p["paperId"] not in reviewed]
+        with get_metrics().stage("review"):
+            for paper, review in iter_reviews(pending, self.topic):
+                self.journal.record("review", paper["paperId"], review)
+        return {p["paperId"]: reviewed[p["paperId"]] for p in relevant
+                if p["paperId"] in reviewed}
+
+    def summarize(self) -> str:
+        """Stage 5: combine the reviews, unless this exact set was already combined."""
+        reviews = self.review()
+        key = hashlib.sha256(
+            json.dumps(sorted(reviews.items())).encode("utf-8")).hexdigest()
+        summaries = self.journal.get("summarize")
+        if key not in summaries:
+            with get_metrics().stage("summarize"):
+                self.journal.record("summarize", key, combine_reviews(
+                    [reviews[pid] for pid in sorted(reviews)], self.topic))
+        return summaries[key]
+
+    def run(self) -> str:
+        """Run (or resume) every stage and return the literature review."""
+        return self.summarize()
+
+    def judgments(self) -> Dict[str, List]:
+        """Return the recorded [score, reason] pair of every judged paper, by paperId."""
+        return dict(self.journal.get("judge"))
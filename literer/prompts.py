@@ -0,0 +1,89 @@
+from typing import Optional, Sequence
+
+from .metrics import get_metrics
+from .utils import count_tokens, get_encoding, get_openai_model
+
+# Token budget of an abstract sent in a prompt, longer abstracts are truncated
+ABSTRACT_TOKENS = 400
+# Fields of a publication sent to single_review
+REVIEW_FIELDS = ("title", "authors", "year", "venue", "abstract")
+# Authors listed before falling back to 'et al.'
+MAX_AUTHORS = 3
+
+
+def get_abstract_tokens() -> Optional[int]:
+    global ABSTRACT_TOKENS
+    return ABSTRACT_TOKENS
+
+def set_abstract_tokens(n_tokens: Optional[int]):
+    """
+    Set the token budget of each abstract sent to single_review and judge_paper.
+
+    Args:
+        n_tokens (int or None): The budget, abstracts are sent in full if None.
+    """
+    global ABSTRACT_TOKENS
+    ABSTRACT_TOKENS = n_tokens
+
+def truncate_tokens(text: str, n_tokens: Optional[int], model: str) -> str:
+    """
+    Truncate text to at most n_tokens tokens of the given model, marking the cut with '...'.
+
+    Args:
+        text (str): The text to truncate.
+        n_tokens (int or None): The token budget, no truncation if None.
+        model (str): The model whose tokenizer is used.
+
+    Returns:
+        str: The text, truncated if it was longer than n_tokens.
+    """
+    if n_tokens is None:
+        return text
+    encoding = get_encoding(model)
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= n_tokens:
+        return text
+    return encoding.decode(tokens[:n_tokens]).rstrip() + "..."
+
+def format_publication(
+        publication, fields: Sequence[str] = REVIEW_FIELDS,
+        abstract_tokens: Optional[int] = None, model: Optional[str] = None) -> str:
+    """
+    Serialise the given fields of a publication in a terse 'Field: value' format.
+
+    Empty fields are skipped and the publication itself is not modified.
+
+    Args:
+        publication (dict): The publication, as returned by get_papers.
+        fields (Sequence[str]): The fields to include, in order.
+        abstract_tokens (int, optional): The token budget of the abstract.
+            Defaults to get_abstract_tokens().
+        model (str, optional): The model whose tokenizer is used for the budget.
+            Defaults to get_openai_model().
+
+    Returns:
+        str: One line per non-empty field.
+
+    Example:
+        >>> format_publication(paper, fields=("title", "year"))
+        'Title: Active labor market policies\\nYear: 2002'
+    """
+    if abstract_tokens is None:
+        abstract_tokens = get_abstract_tokens()
+    lines = []
+    for field in fields:
+        value = publication.get(field)
+        if value is None or value == "" or value == []:
+            continue
+        if field == "authors":
+            value = ", ".join(value[:MAX_AUTHORS]) + (" et al." if len(value) > MAX_AUTHORS else "")
+        elif field == "abstract":
+            value = truncate_tokens(value, abstract_tokens, model or get_openai_model())
+        lines.append(f"{field.capitalize()}: {value}")
+    return "\n".join(lines)
+
+def report_savings(builder: str, original: str, compact: str, model: Optional[str] = None):
+    """Record in the metrics how many tokens a compact prompt saved over the original one."""
+    model = model or get_openai_model()
+    get_metrics().record_prompt(
+        builder, count_tokens(original, model), count_tokens(compact, model))
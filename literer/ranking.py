@@ -0,0 +1,190 @@
+import hashlib
+import numpy as np
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from .metrics import get_metrics
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# Maximum number of inputs sent in a single embeddings request
+EMBEDDING_BATCH_SIZE = 1000
+
+
+def openai_embed(texts: List[str], model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """
+    Embed texts with the OpenAI embeddings endpoint.
+
+    Args:
+        texts (List[str]): The texts to embed.
+        model (str, optional): The embedding model. Defaults to "text-embedding-ada-002".
+
+    Returns:
+        np.ndarray: A float32 array of shape (len(texts), embedding dimension).
+    """
+    import openai
+
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        start = time.perf_counter()
+        response = openai.Embedding.create(
+            input=texts[i:i + EMBEDDING_BATCH_SIZE], model=model)
+        get_metrics().record_llm(model, time.perf_counter() - start, response.get("usage"))
+        data = sorted(response["data"], key=lambda d: d["index"])
+        vectors += [d["embedding"] for d in data]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+class EmbeddingCache:
+    """
+    Cache of normalised float32 embeddings, keyed by embedding model and paper.
+
+    Args:
+        path (str, optional): A .npz file the cache is loaded from and saved to.
+            The cache only lives in memory if None.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._vectors = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                self._vectors = dict(zip(data["keys"].tolist(), data["vectors"]))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        return self._vectors.get(key)
+
+    def put(self, keys: List[str], vectors: np.ndarray):
+        with self._lock:
+            self._vectors.update(zip(keys, vectors))
+
+    def save(self):
+        """Write the cache to its .npz file."""
+        if self.path is None:
+            raise ValueError("This embedding cache has no path to save to.")
+        with self._lock:
+            keys = list(self._vectors)
+            vectors = (np.stack([self._vectors[k] for k in keys]) if keys
+                       else np.empty((0, 0), dtype=np.float32))
+        np.savez(self.path, keys=np.array(keys), vectors=vectors)
+
+
+EMBEDDING_CACHE = EmbeddingCache()
+
+def get_embedding_cache() -> EmbeddingCache:
+    global EMBEDDING_CACHE
+    return EMBEDDING_CACHE
+
+def set_embedding_cache(cache: EmbeddingCache):
+    """
+    Replace the global embedding cache, e.g., with one persisted to disk.
+
+    Args:
+        cache (EmbeddingCache): The new cache.
+    """
+    global EMBEDDING_CACHE
+    EMBEDDING_CACHE = cache
+
+
+def _paper_text(publication) -> str:
+    return f"{publication['title']}\n{publication['abstract'] or ''}"
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+def embed_papers(
+        publications, embed_fn: Optional[Callable] = None,
+        model: Optional[str] = None) -> np.ndarray:
+    """
+    Embed the title and abstract of each publication, reusing cached embeddings.
+
+    Args:
+        publications (list): The publications to embed, as returned by get_papers.
+        embed_fn (Callable, optional): A function mapping a list of texts to an array
+            of embeddings, e.g., a local sentence-transformers model. Defaults to
+            the OpenAI embeddings endpoint.
+        model (str, optional): The name of the embedding model, which keys its
+            embeddings in the cache. Defaults to EMBEDDING_MODEL for the OpenAI
+            endpoint. Embeddings of an embed_fn without a model are not cached.
+
+    Returns:
+        np.ndarray: A float32 array with one normalised embedding per row.
+
+    Example:
+        >>> encoder = SentenceTransformer("all-MiniLM-L6-v2")
+        >>> embed_papers(papers, encoder.encode, model="all-MiniLM-L6-v2")
+    """
+    embed_fn, model = _embedder(embed_fn, model)
+    texts = [_paper_text(p) for p in publications]
+    if not texts:
+        return np.empty((0, 0), np.float32)
+    if model is None:
+        return _normalise(np.asarray(embed_fn(texts), dtype=np.float32))
+
+    cache = get_embedding_cache()
+    keys = [f"{model}:{hashlib.sha1(t.encode('utf-8')).hexdigest()}" for t in texts]
+    missing = [i for i, k in enumerate(keys) if cache.get(k) is None]
+    if missing:
+        vectors = np.asarray(embed_fn([texts[i] for i in missing]), dtype=np.float32)
+        cache.put([keys[i] for i in missing], _normalise(vectors))
+
+    return np.stack([cache.get(k) for k in keys])
+
+def _embedder(embed_fn, model):
+    # Only the name of a model tells embedders apart, lambdas and bound methods of
+    # different models share their __name__
+    if embed_fn is None:
+        model = model or EMBEDDING_MODEL
+        return lambda texts: openai_embed(texts, model), model
+    return embed_fn, model
+
+def rank_papers(
+        publications, topic: str, top_k: Optional[int] = None,
+        threshold: Optional[float] = None, embed_fn: Optional[Callable] = None,
+        model: Optional[str] = None) -> List[Tuple[dict, float]]:
+    """
+    Rank publications by the cosine similarity of their embedding to the topic.
+
+    Args:
+        publications (list): The publications to rank, as returned by get_papers.
+        topic (str): The research topic.
+        top_k (int, optional): Only keep the top_k most similar publications.
+        threshold (float, optional): Only keep publications with at least this similarity.
+        embed_fn (Callable, optional): The embedding function, see embed_papers.
+        model (str, optional): The name of the embedding model, see embed_papers.
+
+    Returns:
+        List[Tuple[dict, float]]: (publication, similarity) pairs, most similar first.
+    """
+    publications = list(publications)
+    if not publications:
+        return []
+    embed_fn, model = _embedder(embed_fn, model)
+    papers = embed_papers(publications, embed_fn, model)
+    query = _normalise(np.asarray(embed_fn([topic]), dtype=np.float32))[0]
+
+    similarities = papers @ query
+    order = np.argsort(-similarities, kind="stable")
+    if threshold is not None:
+        order = order[similarities[order] >= threshold]
+    if top_k is not None:
+        order = order[:top_k]
+    return [(publications[i], float(similarities[i])) for i in order]
+
+def prefilter_papers(
+        publications, topic: str, top_k: Optional[int] = None,
+        threshold: Optional[float] = None, embed_fn: Optional[Callable] = None,
+        model: Optional[str] = None) -> List[dict]:
+    """
+    Keep only the publications most similar to the topic, most similar first.
+
+    This is meant to run before judge_papers, so that only promising candidates are
+    sent to the (much more expensive) LLM judge. See rank_papers for the arguments.
+
+    Example:
+        >>> candidates = prefilter_papers(papers, topic, top_k=50)
+        >>> judgments = judge_papers(candidates, topic, target_journal)
+    """
+    return [p for p, _ in rank_papers(publications, topic, top_k, threshold, embed_fn, model)]
@@ -1,76 +1,300 @@
-import openai
-import tiktoken
-from typing import List, Tuple, Union
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+from .engine import (achat_completion, as_completed_indexed, chat_completion,
+                     thread_imap_unordered, thread_map)
+from .utils import (atomic_write_text, get_content, get_openai_model, make_journal_string,
+                    break_into_tokens)
+
+
+class FeedbackStore:
+    """
+    Feedback on, and revisions of, manuscript chunks, keyed by a hash of their content.
+
+    Passing the same store to successive give_feedback and incorporate_feedback calls
+    on a manuscript under revision only sends new or changed chunks to the model, the
+    stored feedback and revisions are reused for the rest. Entries also depend on the
+    model and the target journal.
+
+    Args:
+        path (str, optional): A JSON file the store is loaded from and saved to. The
+            store only lives in memory if None.
+
+    Example:
+        >>> store = FeedbackStore("draft_feedback.json")
+        >>> chunks, feedback = give_feedback(draft, "Econometrica", store=store)
+        >>> revised = incorporate_feedback(chunks, feedback, "Econometrica", store=store)
+        >>> store.save()
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def make_key(kind: str, model: str, journal_str: str, *texts: str) -> str:
+        """Return the hash identifying an entry, e.g., the feedback on a chunk."""
+        payload = json.dumps([kind, model, journal_str, *texts])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+
+    def save(self):
+        """Write the store to its JSON file."""
+        if self.path is None:
+            raise ValueError("This feedback store has no path to save to.")
+        with self._lock:
+            entries = dict(self._entries)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atomic_write_text(self.path, json.dumps(entries))
 
-from .utils import get_content, get_openai_model, make_journal_string, break_into_tokens
 
 def give_feedback(
-        excerpt: str, target_journal: Union[str, List[str]], 
-        input_tokens: int = 4000
+        excerpt: str, target_journal: Union[str, List[str]],
+        input_tokens: int = 4000, store: Optional[FeedbackStore] = None
         ) -> Tuple[List[str], List[str]]:
+    """
+    Ask the journal editor for feedback on each chunk of an excerpt.
+
+    Args:
+        excerpt (str): The excerpt, e.g., a draft of the paper.
+        target_journal (str or list): The journal(s) the paper is aimed at.
+        input_tokens (int): The maximum number of tokens of a chunk. Defaults to 4000.
+        store (FeedbackStore, optional): If given, chunks are aligned to stable
+            boundaries, and only chunks without stored feedback are sent.
+
+    Returns:
+        tuple: The chunks, and the feedback on each chunk.
+    """
     journal_str = make_journal_string(target_journal)
-    
+
     # Break the excerpt into tokens of length input_tokens
-    paragraphs = break_into_tokens(excerpt, input_tokens, get_openai_model())
-    responses = []
-
-    for paragraph in paragraphs:
-        messages=[
-            {
-            "role": "system", "content": "You are the journal editor.",
-            },
-            {
-            "role": "user", 
-            "content": (
-                f"A researcher is aiming to publish to {journal_str}. "
-                "Provide feedback on his work. "
-                "Be concise and specific, provide ideas and examples where "
-                f"needed on how to improve his following research:\n{paragraph}")
-            }
-        ]
-        response = openai.ChatCompletion.create(
-            model=get_openai_model(),
-            messages=messages
-        )
-        responses.append(get_content(response))
-    
-    return paragraphs, responses
+    model = get_openai_model("give_feedback")
+    paragraphs, keys, feedback, pending = _plan_feedback(
+        excerpt, journal_str, input_tokens, model, store)
+    # Chunks are reviewed independently, request them concurrently
+    responses = thread_map(
+        lambda i: get_content(chat_completion(
+            _feedback_messages(paragraphs[i], journal_str), model)),
+        pending, model)
+    _fill(store, keys, feedback, pending, responses)
+
+    return paragraphs, feedback
+
+async def agive_feedback(
+        excerpt: str, target_journal: Union[str, List[str]],
+        input_tokens: int = 4000, store: Optional[FeedbackStore] = None
+        ) -> Tuple[List[str], List[str]]:
+    """Asynchronous version of give_feedback."""
+    journal_str = make_journal_string(target_journal)
+    model = get_openai_model("give_feedback")
+    paragraphs, keys, feedback, pending = _plan_feedback(
+        excerpt, journal_str, input_tokens, model, store)
+    responses = await asyncio.gather(
+        *(achat_completion(_feedback_messages(paragraphs[i], journal_str), model)
+          for i in pending))
+    _fill(store, keys, feedback, pending, [get_content(r) for r in responses])
+
+    return paragraphs, feedback
+
+def iter_feedback(
+        excerpt: str, target_journal: Union[str, List[str]],
+        input_tokens: int = 4000, store: Optional[FeedbackStore] = None
+        ) -> Iterator[Tuple[int, str, str]]:
+    """
+    Streaming version of give_feedback, yielding the feedback on each chunk as soon as it is ready.
+
+    Stored feedback is yielded first.
+
+    Yields:
+        tuple: (index, chunk, feedback) triplets, in order of completion.
+    """
+    journal_str = make_journal_string(target_journal)
+    model = get_openai_model("give_feedback")
+    paragraphs, keys, feedback, pending = _plan_feedback(
+        excerpt, journal_str, input_tokens, model, store)
+    for i, stored in enumerate(feedback):
+        if stored is not None:
+            yield i, paragraphs[i], stored
+    for j, response in thread_imap_unordered(
+            lambda i: get_content(chat_completion(
+                _feedback_messages(paragraphs[i], journal_str), model)),
+            pending, model):
+        i = pending[j]
+        _fill(store, keys, feedback, [i], [response])
+        yield i, paragraphs[i], response
+
+async def aiter_feedback(
+        excerpt: str, target_journal: Union[str, List[str]],
+        input_tokens: int = 4000, store: Optional[FeedbackStore] = None
+        ) -> AsyncIterator[Tuple[int, str, str]]:
+    """Asynchronous version of iter_feedback."""
+    journal_str = make_journal_string(target_journal)
+    model = get_openai_model("give_feedback")
+    paragraphs, keys, feedback, pending = _plan_feedback(
+        excerpt, journal_str, input_tokens, model, store)
+    for i, stored in enumerate(feedback):
+        if stored is not None:
+            yield i, paragraphs[i], stored
+    async for j, response in as_completed_indexed(
+            [achat_completion(_feedback_messages(paragraphs[i], journal_str), model)
+             for i in pending]):
+        i = pending[j]
+        _fill(store, keys, feedback, [i], [get_content(response)])
+        yield i, paragraphs[i], feedback[i]
+
+def _plan_feedback(excerpt, journal_str, input_tokens, model, store):
+    # With a store, chunk boundaries are aligned to content-defined anchors, so that
+    # the unchanged parts of an edited excerpt give the same chunks as before
+    paragraphs = break_into_tokens(excerpt, input_tokens, model, stable=store is not None)
+    keys = [FeedbackStore.make_key("feedback", model, journal_str, p) for p in paragraphs]
+    feedback = [store.get(k) if store is not None else None for k in keys]
+    pending = [i for i, f in enumerate(feedback) if f is None]
+    return paragraphs, keys, feedback, pending
+
+def _fill(store, keys, values, indices, results):
+    # Put the new results in place, and in the store
+    for i, result in zip(indices, results):
+        values[i] = result
+        if store is not None:
+            store.put(keys[i], result)
+
+def _feedback_messages(paragraph, journal_str):
+    return [
+        {
+        "role": "system", "content": "You are the journal editor.",
+        },
+        {
+        "role": "user", 
+        "content": (
+            f"A researcher is aiming to publish to {journal_str}. "
+            "Provide feedback on his work. "
+            "Be concise and specific, provide ideas and examples where "
+            f"needed on how to improve his following research:\n{paragraph}")
+        }
+    ]
 
 def incorporate_feedback(
-        excerpt: List[str], feedback: List[str], target_journal: Union[str, List[str]], 
-        ) -> str:
+        excerpt: List[str], feedback: List[str], target_journal: Union[str, List[str]],
+        store: Optional[FeedbackStore] = None) -> str:
     """
     Incorporate feedback into the given excerpt.
 
     Args:
         excerpt (str): The excerpt to incorporate feedback into.
         feedback (str): The feedback to incorporate into the excerpt.
+        store (FeedbackStore, optional): If given, the stored revision of every
+            unchanged (excerpt, feedback) pair is reused instead of requested again.
 
     Returns:
         str: The excerpt with the feedback incorporated into it.
     """
     journal_str = make_journal_string(target_journal)
-    responses = []
-    for e, f in zip(excerpt, feedback):
-        messages=[
-            {
-            "role": "system", "content": "You are an academic researcher.",
-            },
-            {
-            "role": "user", 
-            "content": (
-                "Please help me incorporate the following feedback from the "
-                "journal editor into the given excerpt from the researcher's "
-                f"submission to {journal_str}. \n\nExcerpt:\n"
-                f"`{e}`\n\nFeedback:\n`{f}`\n\n"
-                "Incorporate the feedback and improve the excerpt based on the "
-                "suggestions provided. Only answer witht the improved excerpt.")
-            },
-        ]
-
-        response = openai.ChatCompletion.create(
-            model=get_openai_model(),
-            messages=messages
-        )
-        responses.append(get_content(response))
-    return responses
\ No newline at end of file
+    model = get_openai_model("incorporate_feedback")
+    keys, revisions, pending = _plan_revisions(excerpt, feedback, journal_str, model, store)
+    responses = thread_map(
+        lambda i: get_content(chat_completion(
+            _incorporate_messages(excerpt[i], feedback[i], journal_str), model)),
+        pending, model)
+    _fill(store, keys, revisions, pending, responses)
+    return revisions
+
+async def aincorporate_feedback(
+        excerpt: List[str], feedback: List[str], target_journal: Union[str, List[str]],
+        store: Optional[FeedbackStore] = None) -> str:
+    """Asynchronous version of incorporate_feedback."""
+    journal_str = make_journal_string(target_journal)
+    model = get_openai_model("incorporate_feedback")
+    keys, revisions, pending = _plan_revisions(excerpt, feedback, journal_str, model, store)
+    responses = await asyncio.gather(
+        *(achat_completion(_incorporate_messages(excerpt[i], feedback[i], journal_str), model)
+          for i in pending))
+    _fill(store, keys, revisions, pending, [get_content(r) for r in responses])
+    return revisions
+
+def iter_incorporate_feedback(
+        excerpt: List[str], feedback: List[str], target_journal: Union[str, List[str]],
+        store: Optional[FeedbackStore] = None) -> Iterator[Tuple[int, str]]:
+    """
+    Streaming version of incorporate_feedback, yielding each improved chunk as soon as it is ready.
+
+    Stored revisions are yielded first.
+
+    Yields:
+        tuple: (index, improved excerpt) pairs, in order of completion.
+    """
+    journal_str = make_journal_string(target_journal)
+    model = get_openai_model("incorporate_feedback")
+    keys, revisions, pending = _plan_revisions(excerpt, feedback, journal_str, model, store)
+    for i, stored in enumerate(revisions):
+        if stored is not None:
+            yield i, stored
+    for j, response in thread_imap_unordered(
+            lambda i: get_content(chat_completion(
+                _incorporate_messages(excerpt[i], feedback[i], journal_str), model)),
+            pending, model):
+        i = pending[j]
+        _fill(store, keys, revisions, [i], [response])
+        yield i, response
+
+async def aiter_incorporate_feedback(
+        excerpt: List[str], feedback: List[str], target_journal: Union[str, List[str]],
+        store: Optional[FeedbackStore] = None) -> AsyncIterator[Tuple[int, str]]:
+    """Asynchronous version of iter_incorporate_feedback."""
+    journal_str = make_journal_string(target_journal)
+    model = get_openai_model("incorporate_feedback")
+    keys, revisions, pending = _plan_revisions(excerpt, feedback, journal_str, model, store)
+    for i, stored in enumerate(revisions):
+        if stored is not None:
+            yield i, stored
+    async for j, response in as_completed_indexed(
+            [achat_completion(_incorporate_messages(excerpt[i], feedback[i], journal_str), model)
+             for i in pending]):
+        i = pending[j]
+        _fill(store, keys, revisions, [i], [get_content(response)])
+        yield i, revisions[i]
+
+def _plan_revisions(excerpt, feedback, journal_str, model, store):
+    keys = [FeedbackStore.make_key("revision", model, journal_str, e, f)
+            for e, f in zip(excerpt, feedback)]
+    revisions = [store.get(k) if store is not None else None for k in keys]
+    pending = [i for i, r in enumerate(revisions) if r is None]
+    return keys, revisions, pending
+
+def _incorporate_messages(e, f, journal_str):
+    return [
+        {
+        "role": "system", "content": "You are an academic researcher.",
+        },
+        {
+        "role": "user", 
+        "content": (
+            "Please help me incorporate the following feedback from the "
+            "journal editor into the given excerpt from the researcher's "
+            f"submission to {journal_str}. \n\nExcerpt:\n"
+            f"`{e}`\n\nFeedback:\n`{f}`\n\n"
+            "Incorporate the feedback and improve the excerpt based on the "
+            "suggestions provided. Only answer witht the improved excerpt.")
+        },
+    ]
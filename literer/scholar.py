@@ -1,11 +1,158 @@
+import io
+import re
 import requests
-from typing import List
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional
 import warnings
-from .utils import clean_bibtex
+from .metrics import get_metrics
+from .store import get_paper_store
+from .bibliography import write_bibliography
+from .utils import TokenBucket, retry_delay
 
 # Semantic Scholar API urls
 URL_KEYWORD = "https://api.semanticscholar.org/graph/v1/paper/search?"
 URL_DETAILS = "https://api.semanticscholar.org/graph/v1/paper/"
+URL_BATCH = "https://api.semanticscholar.org/graph/v1/paper/batch"
+URL_BULK = "https://api.semanticscholar.org/graph/v1/paper/search/bulk?"
+# The relevance search only gives access to its first 1000 results
+RELEVANCE_SEARCH_CAP = 1000
+# Maximum number of ids accepted by a single batch request
+BATCH_SIZE = 500
+# Fields requested alongside search results, so that no per-paper detail call
+# is needed to build the records returned by `extract_paper_info`
+PAPER_FIELDS = "paperId,externalIds,title,year,authors,venue,abstract,citationStyles,url"
+# Fields requested when walking the citation graph
+NEIGHBOUR_FIELDS = "paperId,references.paperId,citations.paperId"
+
+# Client-side rate limits as (requests per second, burst size). The free tier
+# shares a pool of roughly 100 requests per 5 minutes, keyed access is 1 RPS.
+RATE_LIMITS = {
+    "free": (100 / 300, 10),
+    "keyed": (1.0, 1)
+}
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ScholarClient:
+    """
+    Shared HTTP client for all Semantic Scholar traffic.
+
+    The client keeps a pooled keep-alive session, throttles outgoing requests
+    with a token bucket sized to the API tier, and retries rate-limited (429)
+    and server (5xx) errors with exponential backoff and jitter, honouring the
+    `Retry-After` header when the API sends one.
+
+    Args:
+        - api_key (str): Semantic Scholar API key, sent with every request.
+        - rate (float): Requests per second allowed by the client-side limiter.
+            Defaults to the free or keyed tier in RATE_LIMITS.
+        - burst (float): Maximum burst size of the limiter.
+        - max_retries (int): Number of retries before giving up on a request.
+        - backoff (float): Base delay in seconds of the exponential backoff.
+        - max_backoff (float): Upper bound in seconds on a single retry delay.
+        - pool_size (int): Number of keep-alive connections kept in the pool.
+        - timeout (float): Timeout in seconds of a single HTTP request.
+    """
+    def __init__(
+            self, api_key=None, rate=None, burst=None, max_retries=5,
+            backoff=1.0, max_backoff=60.0, pool_size=10, timeout=30):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if api_key is not None:
+            self.session.headers["x-api-key"] = api_key
+
+        default_rate, default_burst = RATE_LIMITS["keyed" if api_key else "free"]
+        self.limiter = TokenBucket(rate or default_rate, burst or default_burst)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a throttled request, retrying on rate limits and server errors.
+
+        Raises:
+            - requests.HTTPError: If the request still fails after all retries.
+        """
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.request(
+                    method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    get_metrics().record_http(
+                        _endpoint(url), None, time.perf_counter() - start, attempt)
+                    raise
+                time.sleep(self._retry_delay(None, attempt))
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                break
+            time.sleep(self._retry_delay(response, attempt))
+
+        get_metrics().record_http(
+            _endpoint(url), response.status_code, time.perf_counter() - start, attempt)
+        warn_error(response)
+        response.raise_for_status()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _retry_delay(self, response, attempt):
+        retry_after = None if response is None else response.headers.get("Retry-After")
+        return retry_delay(attempt, self.backoff, self.max_backoff, retry_after)
+
+
+def _endpoint(url):
+    # Group requests by endpoint, e.g., 'paper/search' or 'paper/{paper_id}'
+    path = urllib.parse.urlsplit(url).path
+    path = path.split("/graph/v1/", 1)[-1]
+    return re.sub(r"(?<=paper/)(?!search|batch)[^/]+", "{paper_id}", path)
+
+
+_CLIENTS: Dict[Optional[str], ScholarClient] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def get_client(api_key=None) -> ScholarClient:
+    """
+    Return the shared Semantic Scholar client for the given API key, creating it if needed.
+
+    Args:
+        - api_key (str): Semantic Scholar API key, or None for the free tier.
+
+    Returns:
+        - ScholarClient: The client all requests made with this key go through.
+    """
+    with _CLIENTS_LOCK:
+        if api_key not in _CLIENTS:
+            _CLIENTS[api_key] = ScholarClient(api_key=api_key)
+        return _CLIENTS[api_key]
+
+def set_client(client: ScholarClient):
+    """
+    Register a custom client, e.g., with a different rate limit, for its API key.
+
+    Args:
+        - client (ScholarClient): The client to use for requests made with client.api_key.
+    """
+    with _CLIENTS_LOCK:
+        _CLIENTS[client.api_key] = client
 
 def extract_paper_info(data):
     """
@@ -16,18 +163,21 @@ def extract_paper_info(data):
             title, authors, year, venue, abstract, and citation styles.
 
     Returns:
-        - dict: A dictionary containing the title, authors, year, venue, abstract, and 
-            bibtex entry of the publication.
+        - dict: A dictionary containing the title, authors, year, venue, abstract, 
+            bibtex entry, url, DOI (None if unknown), and Semantic Scholar paperId of the
+            publication.
     """
     
     return {
+        "paperId": data["paperId"],
         "title": data["title"],
         "authors": [a["name"] for a in data["authors"]],
         "year": data["year"],
         "venue": data["venue"],
         "abstract": data["abstract"],
-        "bibtex": data["citationStyles"]["bibtex"],
-        "url": data["url"]
+        "bibtex": (data.get("citationStyles") or {}).get("bibtex", ""),
+        "url": data["url"],
+        "doi": (data.get("externalIds") or {}).get("DOI")
     }
 
 
@@ -58,15 +208,47 @@ def get_papers(
     
     if n_pubs > 100:
         warnings.warn("The free API for Semantic Scholar cannot do more than " +
-                      f"100 requests at once, n_pubs has been set to 100.")
+                      f"100 requests at once, n_pubs has been set to 100. " +
+                      "Use iter_papers to page through more results.")
         n_pubs = 100
     
     query = f"{URL_KEYWORD}query={keyword.replace(' ', '+')}&limit={n_pubs}"
-    # Set API key if we have it
-    if api_key is not None:
-        headers = {"x-api-key": api_key}
+    query += f"&fields={PAPER_FIELDS}"
+    query += _search_filters(year_start, year_end, venue, fields_of_study,
+                             publication_types)
+
+    # Answer from the local store if this exact search has been run before
+    store = get_paper_store()
+    if store is not None:
+        paper_ids = store.get_search(query)
+        if paper_ids is not None:
+            return get_paper_details(paper_ids, api_key=api_key)
+        if store.offline:
+            warnings.warn(f"Search for '{keyword}' is not in the paper store "
+                          "and the store is offline, no papers returned.")
+            return []
+
+    response = get_client(api_key).get(query)
+    publications = response.json()
+
+    # Special case when there are no publications found.
+    if publications["total"] == 0:
+        pub_list = []
     else:
-        headers = None
+        # The search response already carries every field we need
+        pub_list = [extract_paper_info(pub) for pub in publications["data"]]
+
+    if store is not None:
+        store.put_papers(pub_list)
+        store.put_search(query, [p["paperId"] for p in pub_list])
+    return pub_list
+
+
+def _search_filters(
+        year_start=None, year_end=None, venue=None, fields_of_study=None,
+        publication_types=None):
+    # Build the query string part of a search restricting its results
+    filters = ""
 
     # Restrict results to a given year range
     if year_start is None:
@@ -79,15 +261,15 @@ def get_papers(
     else:
         year_range = f"{year_start}-{year_end}"
 
-    if len(year_range):
-        query += f"&year={year_range}"
+    if len(str(year_range)):
+        filters += f"&year={year_range}"
 
     # Filter venues (can be a list or string of a single venue)
     if venue is not None:
         if type(venue) is str:
-            query += f"&venue={venue}"
+            filters += f"&venue={venue}"
         elif type(venue) is list:
-            query += f"&venue={','.join(venue)}"
+            filters += f"&venue={','.join(venue)}"
         else:
             raise TypeError("'venue' must be a list or a str")
         
@@ -96,8 +278,9 @@ def get_papers(
             fields_of_study = [fields_of_study]
         if type(fields_of_study) is list:
             # Make sure fields_of_study are valid
-            map(check_field_of_study_validity, fields_of_study)
-            query += f"&fieldsOfStudy={','.join(fields_of_study)}"
+            for field_of_study in fields_of_study:
+                check_field_of_study_validity(field_of_study)
+            filters += f"&fieldsOfStudy={','.join(fields_of_study)}"
         else:
             raise TypeError("'fields_of_study' must be a list or str")
     
@@ -106,30 +289,240 @@ def get_papers(
             publication_types = [publication_types]
         if type(publication_types) is list:
             # Make sure publication types are valid
-            map(check_publication_type_validity, publication_types)
-            query += f"&publicationType={','.join(publication_types)}"
+            for publication_type in publication_types:
+                check_publication_type_validity(publication_type)
+            filters += f"&publicationType={','.join(publication_types)}"
         else:
             raise TypeError("'publication_types' must be a list or str")
-        
-    response = requests.get(query, headers=headers)
-    warn_error(response)
-    publications = response.json()
-    pub_list = []
+    return filters
 
-    # Special case when there are no publications found.
-    if publications["total"] == 0:
-        return pub_list
-    # Query relevant information for each publication
-    for pub in publications["data"]:
-        query = f"{URL_DETAILS}{pub['paperId']}"
-        query += "?fields=year,authors,venue,abstract,citationStyles,url" 
-        resp = requests.get(query, headers=headers)
-        warn_error(resp)
-        data = resp.json()
-        data["title"] = pub["title"]
-        pub_list.append(extract_paper_info(data))
-    return pub_list
 
+def iter_papers(
+        keyword, max_results=None, page_size=100, bulk=None, year_start=None,
+        year_end=None, venue=None, fields_of_study=None, publication_types=None,
+        api_key=None):
+    """
+    Lazily iterate over the publications found on Semantic Scholar for a keyword.
+
+    Results are fetched page by page, the next page being requested in the background
+    while the current one is consumed, so that callers can start processing papers
+    before the search is over, with memory bounded by a couple of pages.
+
+    The relevance search used by `get_papers` cannot go beyond its first 1000 results.
+    The bulk search endpoint, which returns up to 1000 papers per request (in no
+    particular order) and has no such cap, is used instead if bulk is True.
+
+    Args:
+        - keyword (str): The keyword to search for in publication titles and abstracts.
+        - max_results (int): The maximum number of publications to yield, all if None.
+        - page_size (int): The number of publications per relevance search request,
+            at most 100. Defaults to 100.
+        - bulk (bool): Whether to use the bulk search endpoint. Defaults to using it
+            only if max_results is None or above RELEVANCE_SEARCH_CAP.
+        - year_start, year_end, venue, fields_of_study, publication_types: Search
+            filters, see `get_papers`.
+        - api_key (str): Semantic scholar API key
+
+    Yields:
+        - dict: The publications, as returned by `extract_paper_info`.
+
+    Examples:
+        >>> for paper in iter_papers("active labor market policies", max_results=500):
+        ...     score, reason = judge_paper(paper, topic, target_journal)
+    """
+    if bulk is None:
+        bulk = max_results is None or max_results > RELEVANCE_SEARCH_CAP
+    page_size = min(page_size, 100)
+    query = f"query={keyword.replace(' ', '+')}&fields={PAPER_FIELDS}"
+    query += _search_filters(year_start, year_end, venue, fields_of_study,
+                             publication_types)
+    client = get_client(api_key)
+    store = get_paper_store()
+
+    def fetch(cursor):
+        if bulk:
+            url = f"{URL_BULK}{query}" + (f"&token={cursor}" if cursor else "")
+        else:
+            offset = cursor or 0
+            limit = min(page_size, RELEVANCE_SEARCH_CAP - offset)
+            url = f"{URL_KEYWORD}{query}&offset={offset}&limit={limit}"
+        page = client.get(url).json()
+        records = [extract_paper_info(pub) for pub in page.get("data") or []]
+        if store is not None:
+            store.put_papers(records)
+        next_cursor = page.get("token") if bulk else page.get("next")
+        if not bulk and next_cursor is not None and next_cursor >= RELEVANCE_SEARCH_CAP:
+            next_cursor = None
+        return records, next_cursor
+
+    n_yielded = 0
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = pool.submit(fetch, None)
+        while future is not None:
+            records, cursor = future.result()
+            # Prefetch the next page while the caller consumes this one
+            more = max_results is None or n_yielded + len(records) < max_results
+            future = pool.submit(fetch, cursor) if cursor and more else None
+            for record in records:
+                if max_results is not None and n_yielded >= max_results:
+                    return
+                yield record
+                n_yielded += 1
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_paper_details(paper_ids, api_key=None):
+    """
+    Retrieve publications by their Semantic Scholar paperId.
+
+    Papers found in the local paper store are not fetched again, the others are
+    requested through the batch endpoint, BATCH_SIZE ids at a time.
+
+    Args:
+        - paper_ids (list): The Semantic Scholar paperIds of the publications.
+        - api_key (str): Semantic scholar API key
+
+    Returns:
+        - list: The publications as returned by `extract_paper_info`, in the order of
+            paper_ids. Unknown ids are skipped.
+    """
+    store = get_paper_store()
+    records = store.get_papers(paper_ids) if store is not None else {}
+    missing = [pid for pid in dict.fromkeys(paper_ids) if pid not in records]
+
+    if missing and (store is None or not store.offline):
+        client = get_client(api_key)
+        for i in range(0, len(missing), BATCH_SIZE):
+            response = client.post(URL_BATCH, params={"fields": PAPER_FIELDS},
+                                   json={"ids": missing[i:i + BATCH_SIZE]})
+            # Unknown ids come back as null
+            fetched = [extract_paper_info(d) for d in response.json() if d is not None]
+            if store is not None:
+                store.put_papers(fetched)
+            records.update({p["paperId"]: p for p in fetched})
+
+    return [records[pid] for pid in paper_ids if pid in records]
+
+
+def get_papers_multi(keywords, n_pubs=30, max_workers=8, **kwargs):
+    """
+    Search for publications on Semantic Scholar using several keywords and merge the results.
+
+    The searches run concurrently and the results are deduplicated by paperId, DOI,
+    and normalised title, so that every paper is only processed once downstream.
+
+    Args:
+        - keywords (list): The keywords to search for, e.g., as returned by `get_keywords`.
+        - n_pubs (int): The maximum number of publications to return per keyword.
+        - max_workers (int): The maximum number of concurrent searches. Defaults to 8.
+        - **kwargs: Further filters passed on to `get_papers`, e.g., venue or api_key.
+
+    Returns:
+        - list: The unique publications, in order of first appearance. Each publication
+            has an additional 'matches' key listing the keywords which found it and at
+            which rank, e.g., [{"keyword": "job training", "rank": 3}].
+
+    Examples:
+        >>> papers = get_papers_multi(get_keywords(topic, 3), venue=get_top_journals("Economics"))
+    """
+    keywords = list(keywords)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keywords)))) as pool:
+        results = list(pool.map(
+            lambda keyword: get_papers(keyword, n_pubs=n_pubs, **kwargs), keywords))
+
+    papers = []
+    seen = {}
+    for keyword, pubs in zip(keywords, results):
+        for rank, pub in enumerate(pubs, start=1):
+            keys = dedupe_keys(pub)
+            paper = next((seen[k] for k in keys if k in seen), None)
+            if paper is None:
+                # Copy the record, it may be shared with the paper store
+                paper = dict(pub, matches=[])
+                papers.append(paper)
+            paper["matches"].append({"keyword": keyword, "rank": rank})
+            for k in keys:
+                seen.setdefault(k, paper)
+    return papers
+
+def expand_citations(seed_papers, depth=1, max_papers=100, api_key=None, max_workers=4):
+    """
+    Find publications related to seed papers by walking their citation graph breadth-first.
+
+    At every level, the references and citations of the current frontier are fetched
+    through the batch endpoint (BATCH_SIZE papers per request, requests running
+    concurrently under the client's rate limiter). Papers are never fetched twice,
+    and only the papers most cited within the graph are kept, i.e., those linked to
+    the largest number of visited papers.
+
+    Args:
+        - seed_papers (list): The starting publications, as returned by `get_papers`, or
+            their paperIds.
+        - depth (int): The number of levels to walk. Defaults to 1.
+        - max_papers (int): The maximum number of publications returned. Defaults to 100.
+        - api_key (str): Semantic scholar API key
+        - max_workers (int): The maximum number of concurrent batch requests.
+
+    Returns:
+        - list: The related publications (seeds excluded) as returned by
+            `extract_paper_info`, most linked first.
+
+    Examples:
+        >>> related = expand_citations(get_papers("active labor market policies"), depth=2)
+    """
+    seeds = [p if isinstance(p, str) else p["paperId"] for p in seed_papers]
+    seed_ids = set(seeds)
+    visited = set(seeds)
+    links = Counter()
+    frontier = list(dict.fromkeys(seeds))
+
+    for _ in range(depth):
+        if not frontier:
+            break
+        chunks = [frontier[i:i + BATCH_SIZE] for i in range(0, len(frontier), BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+            for neighbours in pool.map(lambda c: _get_neighbours(c, api_key), chunks):
+                links.update(neighbours)
+        # Only expand the most linked new papers, within the overall budget
+        budget = max_papers - (len(visited) - len(seed_ids))
+        candidates = [pid for pid, _ in links.most_common() if pid not in visited]
+        frontier = candidates[:max(0, budget)]
+        visited.update(frontier)
+
+    # Ties keep the order in which the papers were found
+    related = [pid for pid, _ in links.most_common()
+               if pid in visited and pid not in seed_ids][:max_papers]
+    return get_paper_details(related, api_key=api_key)
+
+def _get_neighbours(paper_ids, api_key):
+    # Return the ids of the references and citations of every paper, one id per link
+    response = get_client(api_key).post(
+        URL_BATCH, params={"fields": NEIGHBOUR_FIELDS}, json={"ids": paper_ids})
+    neighbours = []
+    for paper in response.json():
+        if paper is None:
+            continue
+        for linked in (paper.get("references") or []) + (paper.get("citations") or []):
+            if linked.get("paperId"):
+                neighbours.append(linked["paperId"])
+    return neighbours
+
+def dedupe_keys(publication):
+    """
+    Return the keys identifying a publication: its paperId, DOI, and normalised title.
+    """
+    keys = []
+    if publication.get("paperId"):
+        keys.append(("paperId", publication["paperId"]))
+    if publication.get("doi"):
+        keys.append(("doi", publication["doi"].lower()))
+    if publication.get("title"):
+        title = re.sub(r"\W+", "", publication["title"].casefold())
+        if title:
+            keys.append(("title", title))
+    return keys
 
 
 ALL_PUBLICATION_TYPES = [
@@ -186,19 +579,29 @@ def create_bibliography(publications):
     """
     Generates a bibliography in BibTeX format from a list of publications.
 
+    Duplicates (same DOI or title) are dropped, entries get unique and stable citation
+    keys, and keep their entry type. Use write_bibliography to write large
+    bibliographies straight to a file.
+
     Args:
-        - publications (list): A list of dictionaries, where each dictionary represents a publication
-            and has a "bibtex" key with the BibTeX entry for that publication.
+        - publications (list or PaperSet): A list of dictionaries, where each dictionary represents
+            a publication and has a "bibtex" key with the BibTeX entry for that publication.
 
     Returns:
         - str: A string representing the concatenated BibTeX entries of all publications in the list,
         separated by newline characters.
     """
-    return '\n'.join([clean_bibtex(p["bibtex"]) for p in publications])
+    f = io.StringIO()
+    write_bibliography(publications, f)
+    return f.getvalue()
 
 def warn_error(response):
     if response.status_code != 200:
-        warnings.warn(f"Semantic Scholar error encountered: \n\t{response.json()['error']}")
+        try:
+            message = response.json().get("error", response.text)
+        except ValueError:
+            message = response.text
+        warnings.warn(f"Semantic Scholar error encountered: \n\t{message}")
 
 def get_top_journals(field: str, top5: bool =True) -> List[str]:
     if field not in TOP_JOURNALS:
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .cache import DEFAULT_CACHE_DIR, connect
+
+
+class PaperStore:
+    """
+    Local store of Semantic Scholar results.
+
+    Paper records (as returned by `extract_paper_info`) are kept by paperId with
+    the time they were fetched, and search queries are mapped to the list of
+    paperIds they returned, so that repeated or overlapping searches can be
+    answered without touching the network.
+
+    Args:
+        - path (str): The path of the SQLite database. Defaults to
+            ~/.cache/literer/papers.sqlite.
+        - max_age (float): Age in seconds after which stored entries are considered
+            stale and fetched again. Entries never go stale if None.
+        - offline (bool): Never contact Semantic Scholar, only answer from the store,
+            whatever the age of the entries.
+
+    Example:
+        >>> set_paper_store(PaperStore(max_age=30 * 24 * 3600))
+    """
+    def __init__(
+            self, path: Optional[str] = None, max_age: Optional[float] = None,
+            offline: bool = False):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "papers.sqlite")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_age = max_age
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS papers ("
+                "paper_id TEXT PRIMARY KEY, record TEXT, fetched REAL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                "query TEXT PRIMARY KEY, paper_ids TEXT, fetched REAL)")
+
+    def _is_fresh(self, fetched: float) -> bool:
+        return self.offline or self.max_age is None or time.time() - fetched <= self.max_age
+
+    def get_papers(self, paper_ids: List[str]) -> Dict[str, dict]:
+        """Return the fresh stored records among paper_ids, keyed by paperId."""
+        records = {}
+        with self._lock:
+            # Stay well below SQLite's limit on the number of query parameters
+            for i in range(0, len(paper_ids), 500):
+                chunk = paper_ids[i:i + 500]
+                rows = self._conn.execute(
+                    "SELECT paper_id, record, fetched FROM papers WHERE paper_id IN "
+                    f"({','.join('?' * len(chunk))})", chunk).fetchall()
+                records.update({pid: json.loads(record) for pid, record, fetched in rows
+                                if self._is_fresh(fetched)})
+        return records
+
+    def put_papers(self, records: List[dict]):
+        """Insert or refresh the given records."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO papers VALUES (?, ?, ?)",
+                [(r["paperId"], json.dumps(r), now) for r in records])
+
+    def get_search(self, query: str) -> Optional[List[str]]:
+        """Return the paperIds a search query returned, or None if unknown or stale."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT paper_ids, fetched FROM searches WHERE query = ?", (query,)
+            ).fetchone()
+        if row is None or not self._is_fresh(row[1]):
+            return None
+        return json.loads(row[0])
+
+    def put_search(self, query: str, paper_ids: List[str]):
+        """Remember the paperIds returned by a search query."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?)",
+                (query, json.dumps(paper_ids), time.time()))
+
+
+PAPER_STORE = None
+
+def get_paper_store() -> Optional[PaperStore]:
+    global PAPER_STORE
+    return PAPER_STORE
+
+def set_paper_store(store: Optional[PaperStore]):
+    """
+    Enable the given paper store for all Semantic Scholar lookups, or disable it with None.
+
+    Args:
+        - store (PaperStore or None): The store to use.
+    """
+    global PAPER_STORE
+    PAPER_STORE = store
@@ -0,0 +1,167 @@
+import json
+import re
+from typing import List, NamedTuple, Optional
+
+# Whether replies are requested as function calls, see set_structured_output
+STRUCTURED_OUTPUT = True
+
+JUDGE_FUNCTION = {
+    "name": "record_relevance",
+    "description": "Record how relevant a paper is to the research topic.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "score": {
+                "type": "integer", "minimum": 0, "maximum": 10,
+                "description": "The relevance score, from 0 (irrelevant) to 10."
+            },
+            "reason": {
+                "type": "string",
+                "description": "A brief reasoning of the score, in at most 10 words."
+            }
+        },
+        "required": ["score", "reason"]
+    }
+}
+
+KEYWORDS_FUNCTION = {
+    "name": "record_queries",
+    "description": "Record the queries to search for literature on Semantic Scholar.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "queries": {
+                "type": "array", "items": {"type": "string"}, "minItems": 1,
+                "description": "The search queries."
+            }
+        },
+        "required": ["queries"]
+    }
+}
+
+# How replies are formatted when function calling is disabled, used by repairs
+TEXT_FORMATS = {
+    "record_relevance": ("SCORE|REASON, where SCORE is an integer between 0 and 10 and "
+                         "REASON a brief reasoning of the score"),
+    "record_queries": "the search queries separated by '|'"
+}
+
+
+class Judgment(NamedTuple):
+    """The relevance of a paper, score is None if no valid score could be obtained."""
+    score: Optional[int]
+    reason: str
+
+
+def get_structured_output() -> bool:
+    global STRUCTURED_OUTPUT
+    return STRUCTURED_OUTPUT
+
+def set_structured_output(enabled: bool):
+    """
+    Set whether judge_paper and get_keywords request their replies as function calls.
+
+    Function calls are validated against a JSON schema. Disable it for models, or
+    OpenAI-compatible servers, without function calling, replies are then parsed
+    from free text.
+
+    Args:
+        enabled (bool): Whether to use function calling.
+    """
+    global STRUCTURED_OUTPUT
+    STRUCTURED_OUTPUT = enabled
+
+def function_kwargs(function: dict) -> dict:
+    """Return the chat completion arguments forcing a call to the given function."""
+    return {"functions": [function], "function_call": {"name": function["name"]}}
+
+def _arguments(message) -> Optional[dict]:
+    # The arguments of a function call, None if there is none or it is not valid JSON
+    call = message.get("function_call")
+    if not call:
+        return None
+    try:
+        arguments = json.loads(call.get("arguments") or "")
+    except ValueError:
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+def _score(value) -> Optional[int]:
+    # Accept integers and integral numbers or strings, e.g., 7.0 or "7"
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not score.is_integer() or not 0 <= score <= 10:
+        return None
+    return int(score)
+
+def parse_judgment(message) -> Optional[Judgment]:
+    """
+    Read a Judgment from a reply message, a record_relevance call or 'SCORE|REASON' text.
+
+    Returns:
+        Judgment or None: None if the reply holds no valid score.
+    """
+    arguments = _arguments(message)
+    if arguments is not None:
+        score = _score(arguments.get("score"))
+        if score is None:
+            return None
+        return Judgment(score, str(arguments.get("reason", "")).strip())
+
+    content = message.get("content") or ""
+    # Only split on the first '|', the reason may contain more
+    head, sep, tail = content.partition("|")
+    match = re.search(r"\d+(?:\.\d+)?", head)
+    if match is None or (score := _score(match.group())) is None:
+        return None
+    reason = tail if sep else head[match.end():].lstrip(" .:-/")
+    return Judgment(score, reason.strip())
+
+def parse_keywords(message) -> Optional[List[str]]:
+    """
+    Read the search queries from a reply message, a record_queries call or '|' separated text.
+
+    Returns:
+        List[str] or None: None if the reply holds no query.
+    """
+    arguments = _arguments(message)
+    if arguments is not None:
+        queries = arguments.get("queries")
+        if not isinstance(queries, list):
+            return None
+        queries = [str(q).strip() for q in queries if str(q).strip()]
+    else:
+        content = (message.get("content") or "").strip()
+        pieces = content.split("|") if "|" in content else content.splitlines()
+        # Drop list markers and quotes around the queries
+        queries = [re.sub(r"^\s*(?:[-*]|\d+[.)])\s*", "", p).strip().strip("'\"")
+                   for p in pieces]
+        queries = [q for q in queries if q]
+    return queries or None
+
+def repair_messages(message, function: dict, structured: bool) -> list:
+    """
+    Return the messages asking to turn a malformed reply into a call to function, or
+    into its TEXT_FORMATS format if structured is False.
+
+    Only the reply is sent again, not the original prompt, so a repair is cheap.
+    """
+    reply = message.get("content") or json.dumps(message.get("function_call") or {})
+    if structured:
+        instruction = (f"Record the following reply with the {function['name']} "
+                       "function, following its schema exactly.")
+    else:
+        instruction = (f"Rewrite the following reply in the format "
+                       f"{TEXT_FORMATS[function['name']]}. Only answer in this format.")
+    return [
+        {
+        "role": "system",
+        "content": "You reformat replies, without changing their meaning."
+        },
+        {
+        "role": "user",
+        "content": f"{instruction}\nReply: {reply}"
+        }
+    ]
@@ -1,15 +1,24 @@
-import numpy as np
-import openai
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import random
 import re
-import tiktoken
-from typing import List, Union
+import threading
+import time
+import warnings
+from typing import TYPE_CHECKING, List, Optional, Union
+
+from .cache import DEFAULT_CACHE_DIR
+
+# openai and tiktoken are imported when first needed, they are slow to import
+if TYPE_CHECKING:
+    import tiktoken
 
 def get_content(openai_response):
     return openai_response.choices[0].message.content
 
-def clean_bibtex(text: str) -> str:
-    return re.sub(r'@[^{]*\{[^}]*\}', '@article{', text)
-
 def make_journal_string(target_journal: Union[str, List[str]]) -> str:
     if type(target_journal) is str:
         journal_str = f"the following journal: '{target_journal}'"
@@ -21,18 +30,198 @@ def make_journal_string(target_journal: Union[str, List[str]]) -> str:
     
     return journal_str
 
+class TokenBucket:
+    """
+    Thread-safe token bucket used to throttle API calls on the client side.
+
+    Tokens refill continuously at `rate` per second up to `capacity`. Taking
+    more tokens than are available puts the bucket in debt, and the caller is
+    told how long to wait before proceeding, so concurrent callers queue up
+    fairly instead of all retrying at once.
+
+    Args:
+        rate (float): The number of tokens added per second.
+        capacity (float, optional): The maximum number of tokens the bucket can
+            hold, i.e., the allowed burst size. Defaults to max(rate, 1).
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("'rate' must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n: float = 1) -> float:
+        """Take n tokens and return the number of seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, n: float = 1):
+        """Take n tokens, blocking until they are available."""
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+def retry_delay(
+        attempt: int, backoff: float, max_backoff: float,
+        retry_after: Optional[str] = None) -> float:
+    """
+    Return how long to wait before retrying a failed request, at most max_backoff.
+
+    The delay grows exponentially with full jitter, unless the server tells us how
+    long to wait with a `Retry-After` header, in seconds or as an HTTP date. A header
+    which is neither falls back to the jittered delay.
+
+    Args:
+        attempt (int): The number of attempts that failed before, from 0.
+        backoff (float): The delay of the first retry before jitter, in seconds.
+        max_backoff (float): The longest delay, in seconds.
+        retry_after (str, optional): The value of the Retry-After header.
+    """
+    delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                pass
+    return min(max_backoff, max(0.0, delay))
+
 OPENAI_MODEL = "gpt-3.5-turbo"
+# Per-function overrides of OPENAI_MODEL, e.g., {"judge_paper": "gpt-4"}
+MODEL_OVERRIDES = {}
+# The functions whose model can be overridden
+ROUTED_FUNCTIONS = ("single_review", "summarize_papers", "get_keywords", "judge_paper",
+                    "give_feedback", "incorporate_feedback")
+
+def get_openai_model(function: Optional[str] = None):
+    """
+    Return the model used by the given function, OPENAI_MODEL unless overridden.
 
-def get_openai_model():
+    Args:
+        function (str, optional): The name of a literer function, e.g., "judge_paper".
+    """
     global OPENAI_MODEL
-    return OPENAI_MODEL
+    return MODEL_OVERRIDES.get(function, OPENAI_MODEL)
+
+# Seconds the local copy of the available models is used before it is refreshed
+MODEL_LIST_TTL = 24 * 3600
+MODEL_LIST_PATH = os.path.join(DEFAULT_CACHE_DIR, "models.json")
+_MODEL_LISTS = {}
+_MODEL_LISTS_LOCK = threading.Lock()
+
+def list_openai_models(refresh: bool = False) -> List[str]:
+    """
+    Return the ids of the OpenAI models available to the current API key.
+
+    The list is kept in memory and in MODEL_LIST_PATH, per API key, and only
+    requested from OpenAI again once it is older than MODEL_LIST_TTL seconds. If
+    this request fails, the outdated copy is used instead, with a warning.
+
+    Args:
+        refresh (bool): Whether to request the list even if the copy is recent.
+
+    Returns:
+        List[str]: The model ids.
+    """
+    import openai
+
+    # Only a hash of the API key is written to disk
+    key = hashlib.sha256((openai.api_key or "").encode("utf-8")).hexdigest()[:16]
+    with _MODEL_LISTS_LOCK:
+        if key not in _MODEL_LISTS:
+            _MODEL_LISTS.update(_read_model_lists())
+        entry = _MODEL_LISTS.get(key)
+    if entry is not None and not refresh and time.time() - entry["time"] < MODEL_LIST_TTL:
+        return entry["models"]
+
+    try:
+        models = [m["id"] for m in openai.Model.list()["data"]]
+    except openai.error.OpenAIError as e:
+        if entry is None:
+            raise
+        warnings.warn(f"Could not refresh the list of OpenAI models, using the "
+                      f"copy from {time.ctime(entry['time'])}: {e}")
+        return entry["models"]
 
-def set_openai_model(new_model: str):
+    with _MODEL_LISTS_LOCK:
+        _MODEL_LISTS[key] = {"time": time.time(), "models": models}
+        _write_model_lists(_MODEL_LISTS)
+    return models
+
+def _read_model_lists() -> dict:
+    try:
+        with open(MODEL_LIST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def atomic_write_text(path: str, text: str):
+    """
+    Write text to the file at path, replacing it all at once.
+
+    The text is written to a temporary file next to path first, so that neither a
+    crash nor concurrent readers, e.g., other worker processes, ever see half a file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _write_model_lists(model_lists: dict):
+    try:
+        os.makedirs(os.path.dirname(MODEL_LIST_PATH), exist_ok=True)
+        atomic_write_text(MODEL_LIST_PATH, json.dumps(model_lists))
+    except OSError as e:
+        warnings.warn(f"Could not save the list of OpenAI models: {e}")
+
+def check_openai_model(new_model: Optional[str], function: Optional[str] = None):
+    """
+    Raise a ValueError unless set_openai_model accepts new_model and function.
+
+    Args:
+        new_model (str or None): The model, None only removes the override of function.
+        function (str, optional): The function to set the model of.
+    """
+    if function is not None and function not in ROUTED_FUNCTIONS:
+        raise ValueError(f"'function' must be one of {ROUTED_FUNCTIONS}")
+    if new_model is None and function is not None:
+        return
+    from .backends import get_backend
+
+    # The local copy may predate the model, only then ask OpenAI again. Models
+    # served by other backends, see set_backend, are not OpenAI's to check
+    if (get_backend(new_model).validates_models and
+            new_model not in list_openai_models() and
+            new_model not in list_openai_models(refresh=True)):
+        raise ValueError((f"{new_model} is not a valid openai model or the API "
+                          "key provided does not have access to it."))
+
+def set_openai_model(new_model: Optional[str], function: Optional[str] = None):
     """
     Set the value of the global variable OPENAI_MODEL to the given new_model.
 
+    The model is validated against a local copy of the available models, see
+    list_openai_models, so that no request is made in most cases.
+
+    With a function name, only that function uses new_model, e.g., a stronger model
+    for judge_paper and a cheaper one everywhere else. Overrides apply to the
+    asynchronous, batched and streaming variants of the function too, and are
+    removed again by passing None as new_model.
+
     Args:
-        new_model (str): The new value to set OPENAI_MODEL to.
+        new_model (str or None): The new value to set OPENAI_MODEL to.
+        function (str, optional): The function to set the model of, one of
+            ROUTED_FUNCTIONS. Defaults to all functions without an override.
 
     Returns:
         None.
@@ -41,13 +230,30 @@ def set_openai_model(new_model: str):
         >>> set_openai_model("gpt3")
         >>> summarize_papers(...)
         "Papers summarized using gpt3 model."
+        >>> set_openai_model("gpt-4", function="judge_paper")
     """
-    if new_model not in [m["id"] for m in openai.Model.list()["data"]]:
-        raise ValueError((f"{new_model} is not a valid openai model or the API "
-                          "key provided does not have access to it."))
-    global OPENAI_MODEL 
-    OPENAI_MODEL = new_model
+    global OPENAI_MODEL
+    check_openai_model(new_model, function)
+    if new_model is None and function is not None:
+        MODEL_OVERRIDES.pop(function, None)
+    elif function is None:
+        OPENAI_MODEL = new_model
+    else:
+        MODEL_OVERRIDES[function] = new_model
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> "tiktoken.Encoding":
+    """
+    Return the tiktoken encoding of the given model, loading it only once per model.
+
+    Models unknown to tiktoken fall back to the 'cl100k_base' encoding.
+    """
+    import tiktoken
 
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
 
 def count_tokens(input: str, model: str) -> int:
     """
@@ -60,8 +266,7 @@ def count_tokens(input: str, model: str) -> int:
     Returns:
         int: The number of tokens in the given input.
     """
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(input))
+    return len(get_encoding(model).encode_ordinary(input))
 
 def make_paragraphs(text: str, splitter: str ="\n\n") -> List[str]:
     """
@@ -81,36 +286,108 @@ def make_paragraphs(text: str, splitter: str ="\n\n") -> List[str]:
     """
     return text.split(splitter)
 
-def break_into_tokens(input: str, n_tokens: int, model: str) -> List[str]:
+def break_into_tokens(
+        input: str, n_tokens: int, model: str, overlap: int = 0,
+        splitter: str = "\n\n", stable: bool = False) -> List[str]:
     """
-    Break the given input into tokens using the given model.
+    Break the given input into chunks of at most n_tokens tokens using the given model.
+
+    The input is tokenized once, paragraphs are packed greedily into chunks and the
+    paragraph separators are kept. Paragraphs longer than a chunk are split into
+    sentences, and sentences still too long are split at exact token offsets. The
+    whitespace between sentences is kept as it is, and so are the separators within
+    the overlap.
+
+    With stable=True, chunks also end after 'anchor' paragraphs once they hold half
+    of n_tokens. Whether a paragraph is an anchor only depends on its own content,
+    so that editing a paragraph only changes the chunks up to the next anchor
+    instead of shifting every later chunk boundary.
     
     Args:
-        input (str): The input text to break into tokens.
-        n_tokens (int): The number of tokens to break the input into.
+        input (str): The input text to break into chunks.
+        n_tokens (int): The maximum number of tokens of a chunk.
         model (str): The model to use to break the input into tokens.
+        overlap (int, optional): The number of tokens from the end of a chunk which
+            are repeated at the start of the next one, fewer if the next chunk would
+            exceed n_tokens otherwise. Defaults to 0.
+        splitter (str, optional): The string that marks the end of a paragraph.
+            Defaults to "\n\n".
+        stable (bool, optional): Whether to align chunks to content-defined anchors.
+            Defaults to False.
         
     Returns:
-        List[str]: A list of tokens that make up the given input.
-    """
-    # Break down into paragraphs
-    paragraphs = make_paragraphs(input)
-    text = []
-    # Count number of token per paragraph
-    encoding = tiktoken.encoding_for_model(model)
-    tokens = np.cumsum([len(encoding.encode(p)) for p in paragraphs])
-    # Calculate a rough split of the input into n_tokens
-    rough_split = tokens[-1] // n_tokens + 1
-    past_i = 0
-    splits = 0
-    for (i, e) in enumerate(tokens):
-        if e > n_tokens * (splits + 1):
-            if i == 0:
-                raise ValueError(
-                    "The first paragraph is too long to be tokenized.")
-            text.append(''.join(paragraphs[past_i:i]))
-            past_i = i
-            splits += 1
-        elif i == len(tokens) - 1:
-            text.append(''.join(paragraphs[past_i:]))
-    return text
\ No newline at end of file
+        List[str]: A list of chunks that make up the given input.
+    """
+    if not 0 <= overlap < n_tokens:
+        raise ValueError("'overlap' must be non-negative and smaller than 'n_tokens'")
+    encoding = get_encoding(model)
+    budget = n_tokens - overlap
+
+    # Units are (separator from the previous unit, text, tokens, whether a chunk
+    # may end after the unit)
+    paragraphs = make_paragraphs(input, splitter)
+    units = []
+    for paragraph, tokens in zip(paragraphs, encoding.encode_ordinary_batch(paragraphs)):
+        anchor = stable and _is_anchor(paragraph, len(tokens), budget)
+        if len(tokens) <= budget:
+            units.append((splitter, paragraph, tokens, anchor))
+        else:
+            pieces = _split_oversized(paragraph, budget, encoding)
+            pieces[0] = (splitter, *pieces[0][1:])
+            pieces[-1] = (*pieces[-1][:3], anchor)
+            units += pieces
+    separator_tokens = {sep: encoding.encode_ordinary(sep) for sep in {u[0] for u in units}}
+
+    chunks = []
+    # tokens holds the whole chunk, separators and overlap included, n_used only
+    # what the chunk adds to the previous one
+    texts, tokens, n_used, carry = [], [], 0, []
+    for sep, text, unit_tokens, anchor in units:
+        sep_tokens = separator_tokens[sep]
+        if texts and len(tokens) + len(sep_tokens) + len(unit_tokens) > n_tokens:
+            chunks.append("".join(texts))
+            texts, tokens, n_used, carry = [], [], 0, tokens[-overlap:] if overlap else []
+        if not texts and carry:
+            # Start the chunk with the tail of the previous one, as much of it as
+            # fits next to the unit
+            room = n_tokens - len(sep_tokens) - len(unit_tokens)
+            carry = carry[len(carry) - room:] if room > 0 else []
+            if carry:
+                texts, tokens = [encoding.decode(carry)], list(carry)
+        if texts:
+            texts += [sep, text]
+            # Separators are part of the tokens, so that the overlap decodes them too
+            tokens += sep_tokens
+            n_used += len(sep_tokens) if n_used else 0
+        else:
+            texts = [text]
+        tokens += unit_tokens
+        n_used += len(unit_tokens)
+        carry = []
+        if anchor and n_used >= budget // 2:
+            chunks.append("".join(texts))
+            texts, tokens, n_used, carry = [], [], 0, tokens[-overlap:] if overlap else []
+    if texts or not chunks:
+        chunks.append("".join(texts))
+    return chunks
+
+def _is_anchor(paragraph, n_tokens, budget):
+    # A paragraph is an anchor with a probability proportional to its length, so that
+    # anchors are about half a budget apart whatever the length of the paragraphs
+    digest = hashlib.sha1(paragraph.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64 < 2 * n_tokens / budget
+
+def _split_oversized(paragraph, budget, encoding):
+    # Split a paragraph into sentences, and sentences into token windows. The split
+    # captures the whitespace after each sentence, which becomes the separator of the
+    # next one
+    parts = re.split(r"(?<=[.!?])(\s+)", paragraph)
+    sentences, spaces = parts[::2], [""] + parts[1::2]
+    pieces = []
+    for sentence, space, tokens in zip(
+            sentences, spaces, encoding.encode_ordinary_batch(sentences)):
+        for i in range(0, len(tokens), budget):
+            window = tokens[i:i + budget]
+            text = sentence if len(tokens) <= budget else encoding.decode(window)
+            pieces.append((space if i == 0 else "", text, window, False))
+    return pieces
@@ -20,5 +20,13 @@ setup(
     install_requires=[
         "openai>=0.27.2",
         "requests>=2.28.2",
-    ]
+        "numpy",
+        "tiktoken",
+    ],
+    extras_require={
+        "yaml": ["pyyaml"],
+    },
+    entry_points={
+        "console_scripts": ["literer=literer.cli:main"],
+    }
 )
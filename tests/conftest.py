@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Run against the working tree, and reach the offline mocks of the benchmarks
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+
+@pytest.fixture
+def offline_tokenizer():
+    """Count tokens without downloading tiktoken's encodings."""
+    from mocks import offline_tokenizer
+
+    with offline_tokenizer() as encoding:
+        yield encoding
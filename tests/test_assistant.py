@@ -0,0 +1,291 @@
+import asyncio
+import re
+
+import pytest
+
+import literer.prompts
+import literer.utils
+from literer.assistant import (acombine_reviews, ajudge_paper, cascade_judge_papers,
+                               combine_reviews, get_keywords, judge_paper, judge_papers,
+                               single_review)
+from literer.backends import StubBackend, set_backend
+from literer.metrics import get_metrics
+from literer.structured import Judgment, parse_judgment, parse_keywords
+from literer.utils import get_openai_model, set_openai_model
+
+
+@pytest.fixture
+def prompts(offline_tokenizer):
+    prompts = []
+
+    def reply(model, messages, **kwargs):
+        prompts.append(messages[-1]["content"])
+        return "merged"
+
+    set_backend(StubBackend(reply), model="stub")
+    set_openai_model("stub", function="summarize_papers")
+    yield prompts
+    set_openai_model(None, function="summarize_papers")
+    set_backend(None, model="stub")
+
+
+# Four tokens each, so that a budget of eight tokens holds two of them
+REVIEWS = [f"review {i} of four" for i in range(5)]
+
+
+def test_leftover_review_is_carried_up_unchanged(prompts):
+    assert combine_reviews(REVIEWS, "topic", max_prompt_tokens=8) == "merged"
+    merges = [p for p in prompts if p.startswith("Merge")]
+    assert len(merges) == 2
+    assert prompts[-1].endswith("\nmerged\nmerged\nreview 4 of four")
+
+
+def test_async_leftover_review_is_carried_up_unchanged(prompts):
+    asyncio.run(acombine_reviews(REVIEWS, "topic", max_prompt_tokens=8))
+    assert len(prompts) == 3
+    assert prompts[-1].endswith("\nreview 4 of four")
+
+
+def test_prompts_are_measured_with_the_model_they_are_sent_to(offline_tokenizer, monkeypatch):
+    models = []
+
+    def get_encoding(model):
+        models.append(model)
+        return offline_tokenizer
+
+    monkeypatch.setattr(literer.utils, "get_encoding", get_encoding)
+    monkeypatch.setattr(literer.prompts, "get_encoding", get_encoding)
+    set_backend(StubBackend("7|Relevant."), model="stub")
+    set_openai_model("stub", function="single_review")
+    paper = {"title": "T", "authors": ["A. Author"], "year": 2020, "venue": "V",
+             "abstract": "word " * 500, "bibtex": ""}
+    try:
+        assert judge_paper(paper, "topic", "Nature", model="stub").score == 7
+        single_review(paper, "topic")
+    finally:
+        set_openai_model(None, function="single_review")
+        set_backend(None, model="stub")
+    assert models and set(models) == {"stub"}
+
+
+def call(arguments):
+    return {"role": "assistant", "content": None,
+            "function_call": {"name": "record", "arguments": arguments}}
+
+
+@pytest.mark.parametrize("content, judgment", [
+    ("7|Relevant to the topic.", Judgment(7, "Relevant to the topic.")),
+    ("7 | Uses a | in its reason", Judgment(7, "Uses a | in its reason")),
+    ("Score: 8 - close to the topic", Judgment(8, "close to the topic")),
+    ("10", Judgment(10, "")),
+    ("7.0|Integral", Judgment(7, "Integral")),
+    ("seven|Relevant.", None),
+    ("7.5|Half a point.", None),
+    ("11|Too relevant.", None),
+    ("|No score.", None),
+    ("", None)
+])
+def test_parse_judgment_from_text(content, judgment):
+    assert parse_judgment({"role": "assistant", "content": content}) == judgment
+
+
+@pytest.mark.parametrize("arguments, judgment", [
+    ('{"score": 7, "reason": " Fits. "}', Judgment(7, "Fits.")),
+    ('{"score": "3"}', Judgment(3, "")),
+    ('{"score": 12, "reason": "Out of range"}', None),
+    ('{"score": "high", "reason": "Not a number"}', None),
+    ('{"score": 7, "reason": ', None),
+    ('[7, "A list"]', None)
+])
+def test_parse_judgment_from_function_call(arguments, judgment):
+    assert parse_judgment(call(arguments)) == judgment
+
+
+@pytest.mark.parametrize("message, queries", [
+    ({"content": "labor supply| minimum wage |"}, ["labor supply", "minimum wage"]),
+    ({"content": "1. labor supply\n- 'minimum wage'"}, ["labor supply", "minimum wage"]),
+    ({"content": ""}, None),
+    (call('{"queries": ["labor supply", " "]}'), ["labor supply"]),
+    (call('{"queries": "labor supply"}'), None),
+    (call('{"queries": []}'), None)
+])
+def test_parse_keywords(message, queries):
+    assert parse_keywords(message) == queries
+
+
+class ScriptedReply:
+    """Reply with the given messages in turn, recording the requests."""
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def __call__(self, model, messages, **kwargs):
+        self.requests.append((messages, kwargs))
+        return self.replies[min(len(self.requests), len(self.replies)) - 1]
+
+
+@pytest.fixture
+def scripted(offline_tokenizer):
+    def use(*replies, supports_functions=True):
+        reply = ScriptedReply(*replies)
+        set_backend(StubBackend(reply, supports_functions=supports_functions), model="stub")
+        return reply
+
+    get_metrics().reset()
+    yield use
+    set_backend(None, model="stub")
+
+
+PAPER = {"title": "T", "venue": "V", "abstract": "An abstract."}
+
+
+def test_malformed_text_reply_is_repaired_once(scripted):
+    reply = scripted(
+        {"role": "assistant", "content": "Quite relevant"},
+        {"role": "assistant", "content": "6|Quite relevant"}, supports_functions=False)
+    assert judge_paper(PAPER, "topic", "Nature", model="stub") == Judgment(6, "Quite relevant")
+    repair, kwargs = reply.requests[1]
+    assert "SCORE|REASON" in repair[-1]["content"] and "Quite relevant" in repair[-1]["content"]
+    assert "functions" not in kwargs
+    assert get_metrics().summary()["parsing"]["judge_paper"]["repaired"] == 1
+
+
+def test_malformed_function_call_is_repaired_as_a_function_call(scripted):
+    reply = scripted(call('{"score": "high"}'), call('{"score": 9, "reason": "Core"}'))
+    judgment = asyncio.run(ajudge_paper(PAPER, "topic", "Nature", model="stub"))
+    assert judgment == Judgment(9, "Core")
+    assert all(kwargs["function_call"] == {"name": "record_relevance"}
+               for _, kwargs in reply.requests)
+    assert "record_relevance function" in reply.requests[1][0][-1]["content"]
+
+
+def test_unreadable_reply_falls_back_to_no_score(scripted):
+    reply = scripted({"role": "assistant", "content": "I cannot say."})
+    assert judge_paper(PAPER, "topic", "Nature", model="stub") == Judgment(
+        None, "Unreadable reply.")
+    assert len(reply.requests) == 2
+    assert get_metrics().summary()["parsing"]["judge_paper"]["failed"] == 1
+
+
+def test_keywords_are_repaired_or_rejected(scripted):
+    scripted(call('{"queries": "one"}'), call('{"queries": ["one", "two", "three"]}'))
+    set_openai_model("stub", function="get_keywords")
+    try:
+        assert get_keywords("topic", 2) == ["one", "two"]
+        scripted(call("{}"))
+        with pytest.raises(ValueError):
+            get_keywords("topic", 2)
+    finally:
+        set_openai_model(None, function="get_keywords")
+
+
+PAPERS = [{"title": f"T{k}", "venue": f"V{k}", "abstract": f"Abstract {k}."} for k in range(5)]
+PAPERS[2] = {**PAPERS[2], "abstract": ""}
+
+
+class BatchReply:
+    """Score paper k with k, skipping the papers in skip and answering in reverse order."""
+    def __init__(self, skip=()):
+        self.skip = set(skip)
+        self.prompts = []
+
+    def __call__(self, model, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        items = re.findall(r"\[(\d+)\] Journal: 'V(\d+)'", prompt)
+        if not items:
+            # A paper judged on its own
+            return "1|Judged alone."
+        lines = [f"[{item_id}] | {k} | Paper {k}." for item_id, k in reversed(items)
+                 if int(k) not in self.skip]
+        self.skip = set()
+        return "\n".join(lines + ["[9] | 5 | No such item.", "Hope this helps!"])
+
+
+@pytest.fixture
+def batch_reply(offline_tokenizer):
+    def use(reply):
+        set_backend(StubBackend(reply, supports_functions=False), model="stub")
+        return reply
+
+    yield use
+    set_backend(None, model="stub")
+
+
+def test_batch_scores_are_mapped_back_by_id_and_only_failures_asked_again(batch_reply):
+    reply = batch_reply(BatchReply(skip={3}))
+    judgments = judge_papers(PAPERS, "topic", "Nature", batch_size=4, model="stub")
+    assert judgments == [Judgment(0, "Paper 0."), Judgment(1, "Paper 1."),
+                         Judgment(0, "No abstract."), Judgment(3, "Paper 3."),
+                         Judgment(4, "Paper 4.")]
+    assert len(reply.prompts) == 2
+    assert re.findall(r"\[\d+\] Journal: '(V\d+)'", reply.prompts[1]) == ["V3"]
+
+
+def test_papers_failing_twice_in_a_batch_are_judged_alone(batch_reply):
+    class NeverPaperOne(BatchReply):
+        def __call__(self, model, messages, **kwargs):
+            self.skip = {1}
+            return super().__call__(model, messages, **kwargs)
+
+    reply = batch_reply(NeverPaperOne())
+    judgments = judge_papers(PAPERS, "topic", "Nature", batch_size=4, model="stub")
+    assert judgments[1] == Judgment(1, "Judged alone.")
+    assert [j.score for j in judgments] == [0, 1, 0, 3, 4]
+    assert len(reply.prompts) == 3
+
+
+def scored_reply(scores, reason):
+    # Score paper k with scores[k], an unreadable reply if that is None
+    def reply(model, messages, **kwargs):
+        match = re.search(r"Abstract (\d+)", messages[-1]["content"])
+        score = scores[int(match.group(1))] if match else None
+        return "I cannot say." if score is None else f"{score}|{reason}"
+    return reply
+
+
+@pytest.fixture
+def two_models(offline_tokenizer):
+    get_metrics().reset()
+    yield
+    set_openai_model(None, function="judge_paper")
+    for model in ("cheap", "strong"):
+        set_backend(None, model=model)
+
+
+def test_functions_use_their_routed_model(two_models):
+    set_backend(StubBackend(scored_reply([2] * 5, "Cheap."), supports_functions=False),
+                model="cheap")
+    set_backend(StubBackend(scored_reply([8] * 5, "Strong."), supports_functions=False),
+                model="strong")
+    set_openai_model("strong", function="judge_paper")
+    assert get_openai_model("judge_paper") == "strong"
+    assert get_openai_model("single_review") == get_openai_model()
+    assert judge_paper(PAPERS[0], "topic", "Nature") == Judgment(8, "Strong.")
+    assert judge_paper(PAPERS[0], "topic", "Nature", model="cheap") == Judgment(2, "Cheap.")
+
+    set_openai_model(None, function="judge_paper")
+    assert get_openai_model("judge_paper") == get_openai_model()
+    with pytest.raises(ValueError):
+        set_openai_model("strong", function="judge")
+
+
+@pytest.mark.parametrize("audit_rate", [0.0, 1.0])
+def test_cascade_escalates_uncertain_and_audited_papers(two_models, audit_rate):
+    # Paper 2 has no abstract, paper 3 gets an unreadable cheap reply
+    set_backend(StubBackend(scored_reply([1, 5, 0, None, 9], "Cheap."),
+                            supports_functions=False), model="cheap")
+    set_backend(StubBackend(scored_reply([3, 8, 0, 6, 9], "Strong."),
+                            supports_functions=False), model="strong")
+    judgments = cascade_judge_papers(PAPERS, "topic", "Nature", cheap_model="cheap",
+                                     strong_model="strong", band=(4, 7),
+                                     audit_rate=audit_rate)
+
+    audited = audit_rate == 1.0
+    assert judgments == [Judgment(3, "Strong.") if audited else Judgment(1, "Cheap."),
+                         Judgment(8, "Strong."), Judgment(0, "No abstract."),
+                         Judgment(6, "Strong."), Judgment(9, "Strong." if audited else "Cheap.")]
+    stats = get_metrics().summary()["cascade"]["cheap->strong"]
+    assert stats["judged"] == 5
+    assert stats["escalated"] == 2
+    assert stats["audited"] == (2 if audited else 0)
@@ -0,0 +1,46 @@
+import io
+import itertools
+
+from literer.bibliography import parse_bibtex, write_bibliography
+
+
+def make_paper(title, doi, author="David Card", year=2017):
+    return {"bibtex": None, "doi": doi, "title": title, "authors": [author], "year": year}
+
+
+PAPERS = [
+    make_paper("What works? A meta analysis", "10.1/a"),
+    make_paper("What works in R&D", "10.1/b"),
+    make_paper("Works of art", "10.1/c", author="Jane Smith"),
+]
+
+
+def test_keys_do_not_depend_on_input_order():
+    expected = dict(zip((p["doi"] for p in PAPERS), write_bibliography(PAPERS, io.StringIO())))
+    assert len(set(expected.values())) == len(PAPERS)
+    for order in itertools.permutations(PAPERS):
+        keys = write_bibliography(list(order), io.StringIO())
+        assert dict(zip((p["doi"] for p in order), keys)) == expected
+
+
+def test_keys_share_the_author_year_word_base():
+    keys = write_bibliography(PAPERS[:2], io.StringIO())
+    assert all(key.startswith("card2017what") for key in keys)
+
+
+def test_duplicates_are_written_once():
+    duplicate = make_paper("WHAT WORKS? a meta-analysis", None)
+    f = io.StringIO()
+    keys = write_bibliography([PAPERS[0], duplicate], f)
+    assert keys[0] == keys[1]
+    assert f.getvalue().count("@") == 1
+
+
+def test_semantic_scholar_types_and_keys_are_kept_apart():
+    bibtex = ("@['Conference']{Muller2019,\n title = {Deep {Nets}},\n"
+              " author = {M{\\\"u}ller, A.},\n year = 2019,\n booktitle = {NeurIPS}}")
+    parsed = parse_bibtex(bibtex)
+    assert parsed["fields"]["title"] == "Deep {Nets}"
+    f = io.StringIO()
+    write_bibliography([{"bibtex": bibtex, "title": "Deep Nets", "authors": ["A. Müller"]}], f)
+    assert f.getvalue().startswith("@inproceedings{muller2019deep")
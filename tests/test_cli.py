@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+from literer import cli
+
+
+def write_jobs(tmp_path, spec):
+    path = tmp_path / "jobs.json"
+    path.write_text(json.dumps(spec))
+    return str(path)
+
+
+def test_load_jobs_applies_defaults_and_names(tmp_path):
+    jobs = cli.load_jobs(write_jobs(tmp_path, {
+        "defaults": {"n_pubs": 30, "target_journal": "Nature"},
+        "jobs": [{"topic": "Minimum wages & employment"},
+                 {"topic": "Job search", "name": "search", "n_pubs": 5}]
+    }))
+    assert [job["name"] for job in jobs] == ["minimum-wages-employment", "search"]
+    assert [job["n_pubs"] for job in jobs] == [30, 5]
+    assert all(job["target_journal"] == "Nature" for job in jobs)
+
+
+@pytest.mark.parametrize("spec, message", [
+    ([], "no list of jobs"),
+    ([{"topic": "A"}], "no 'target_journal'"),
+    ([{"topic": "A", "target_journal": "B", "colour": "red"}], "unknown keys: colour"),
+    ([{"topic": "A", "target_journal": "B"}, {"topic": "A", "target_journal": "C"}],
+     "Two jobs are named 'a'")
+])
+def test_load_jobs_rejects_invalid_files(tmp_path, spec, message):
+    with pytest.raises(ValueError, match=message):
+        cli.load_jobs(write_jobs(tmp_path, spec))
+
+
+@pytest.fixture
+def fake_jobs(monkeypatch):
+    # Worker processes are forked, so they run the fake job too
+    def run_job(job, job_dir, s2_api_key=None):
+        open(os.path.join(job_dir, "ran"), "w").close()
+        return {"n_relevant": 1, "cost": 0.0}
+
+    monkeypatch.setattr(cli, "run_job", run_job)
+
+
+JOBS = [{"name": name, "topic": name, "target_journal": "Nature"} for name in "abc"]
+
+
+def read_progress(run_dir):
+    with open(os.path.join(run_dir, "progress.jsonl")) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_run_jobs_skips_completed_jobs(tmp_path, fake_jobs):
+    run_dir = tmp_path / "run"
+    run_dir.mkdir()
+    with open(run_dir / "progress.jsonl", "w") as f:
+        f.write(json.dumps({"job": "a", "status": "done"}) + "\n")
+        f.write(json.dumps({"job": "b", "status": "failed"}) + "\n")
+        f.write('{"job": "c", "sta')
+
+    records = cli.run_jobs(JOBS, str(run_dir), workers=2, cache_dir=str(tmp_path))
+    assert sorted(r["job"] for r in records) == ["b", "c"]
+    assert all(r["status"] == "done" for r in records)
+    assert not (run_dir / "a" / "ran").exists()
+    assert cli.run_jobs(JOBS, str(run_dir), workers=2, cache_dir=str(tmp_path)) == []
+
+    records = cli.run_jobs(JOBS, str(run_dir), workers=2, cache_dir=str(tmp_path), force=True)
+    assert sorted(r["job"] for r in records) == ["a", "b", "c"]
+
+
+def test_a_broken_pool_records_the_remaining_jobs_as_failed(tmp_path, fake_jobs, monkeypatch):
+    def broken_init(settings):
+        raise RuntimeError("No worker today")
+
+    monkeypatch.setattr(cli, "_init_worker", broken_init)
+    run_dir = str(tmp_path / "run")
+    records = cli.run_jobs(JOBS, run_dir, workers=2, cache_dir=str(tmp_path))
+    assert sorted(r["job"] for r in records) == ["a", "b", "c"]
+    assert all(r["status"] == "failed" and "BrokenProcessPool" in r["error"]
+               for r in records)
+    assert read_progress(run_dir) == records
+
+
+def test_run_jobs_checks_models_before_starting_workers(tmp_path, fake_jobs, monkeypatch):
+    import literer.utils
+
+    monkeypatch.setattr(literer.utils, "list_openai_models", lambda refresh=False: ["gpt-4"])
+    with pytest.raises(ValueError, match="gpt-5-typo"):
+        cli.run_jobs(JOBS, str(tmp_path / "run"), models=[("judge_paper", "gpt-5-typo")])
+    with pytest.raises(ValueError, match="'function' must be one of"):
+        cli.run_jobs(JOBS, str(tmp_path / "run"), models=[("judge", "gpt-4")])
+    assert not (tmp_path / "run").exists()
@@ -0,0 +1,88 @@
+import asyncio
+
+import openai.error
+import pytest
+
+from literer.backends import Backend, StubBackend, set_backend
+from literer.engine import (Scheduler, achat_completion, astream_chat_completion,
+                            chat_completion, set_scheduler, stream_chat_completion,
+                            thread_map)
+from literer.metrics import get_metrics
+
+MESSAGES = [{"role": "user", "content": "Hello there"}]
+
+
+class SyncOnlyBackend(Backend):
+    """A backend implementing create only, as most custom backends do."""
+    def create(self, model, messages, **kwargs):
+        return StubBackend("Hello there").create(model, messages, **kwargs)
+
+
+class FlakyReply:
+    """Fail the first n_failures calls with a rate limit, then reply."""
+    def __init__(self, n_failures, retry_after="0"):
+        self.n_failures = n_failures
+        self.retry_after = retry_after
+        self.calls = 0
+
+    def __call__(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.calls <= self.n_failures:
+            raise openai.error.RateLimitError(
+                "Rate limited", headers={"retry-after": self.retry_after})
+        return "ok"
+
+
+@pytest.fixture(autouse=True)
+def fast_scheduler(offline_tokenizer):
+    set_scheduler(Scheduler(max_in_flight=4, max_retries=3, backoff=0.001))
+    get_metrics().reset()
+    yield
+    set_scheduler(Scheduler())
+    set_backend(None, model="flaky")
+    set_backend(None, model="sync")
+
+
+def test_rate_limits_are_retried():
+    reply = FlakyReply(2)
+    set_backend(StubBackend(reply), model="flaky")
+    assert chat_completion(MESSAGES, "flaky").choices[0].message.content == "ok"
+    assert reply.calls == 3
+    assert get_metrics().summary()["llm"]["flaky"]["retries"] == 2
+
+
+def test_retries_give_up_after_max_retries():
+    set_backend(StubBackend(FlakyReply(10)), model="flaky")
+    with pytest.raises(openai.error.RateLimitError):
+        chat_completion(MESSAGES, "flaky")
+
+
+def test_one_rate_limit_does_not_fail_a_concurrent_batch():
+    set_backend(StubBackend(FlakyReply(1)), model="flaky")
+    replies = thread_map(lambda i: chat_completion(MESSAGES, "flaky"), range(8), "flaky")
+    assert [r.choices[0].message.content for r in replies] == ["ok"] * 8
+
+
+def test_async_and_streamed_requests_are_retried():
+    set_backend(StubBackend(FlakyReply(1)), model="flaky")
+    response = asyncio.run(achat_completion(MESSAGES, "flaky"))
+    assert response.choices[0].message.content == "ok"
+    set_backend(StubBackend(FlakyReply(1)), model="flaky")
+    assert "".join(stream_chat_completion(MESSAGES, "flaky")) == "ok"
+
+
+def test_retry_after_is_honoured():
+    error = openai.error.RateLimitError("Rate limited", headers={"retry-after": "7"})
+    assert Scheduler(max_backoff=60).retry_delay(error, 0) == 7
+    assert Scheduler(max_backoff=5).retry_delay(error, 0) == 5
+
+
+def test_backends_with_create_only_stream_in_both_apis():
+    set_backend(SyncOnlyBackend(), model="sync")
+    assert "".join(stream_chat_completion(MESSAGES, "sync")) == "Hello there"
+
+    async def collect():
+        return [piece async for piece in astream_chat_completion(MESSAGES, "sync")]
+    assert "".join(asyncio.run(collect())) == "Hello there"
+    response = asyncio.run(achat_completion(MESSAGES, "sync"))
+    assert response.choices[0].message.content == "Hello there"
@@ -0,0 +1,12 @@
+from literer.papers import PaperSet
+
+
+def test_filter_accepts_a_generator_of_venues():
+    papers = PaperSet.from_records([
+        {"title": "A", "venue": "Nature"},
+        {"title": "B", "venue": "Science"},
+        {"title": "C", "venue": "Cell"},
+        {"title": "D", "venue": "Science"}
+    ])
+    kept = papers.filter(venues=(v for v in ["Science", "Cell"]))
+    assert [p["title"] for p in kept] == ["B", "C", "D"]
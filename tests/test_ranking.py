@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from literer.ranking import EmbeddingCache, embed_papers, rank_papers, set_embedding_cache
+
+
+PAPERS = [{"title": f"Paper {i}", "abstract": f"Abstract {i}"} for i in range(5)]
+
+
+def embedder(dim, seed):
+    rng = np.random.default_rng(seed)
+    table = {}
+    return lambda texts: np.stack([table.setdefault(t, rng.normal(size=dim)) for t in texts])
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    set_embedding_cache(EmbeddingCache())
+
+
+def test_models_do_not_share_cached_embeddings():
+    small, large = embedder(8, 0), embedder(16, 1)
+    assert embed_papers(PAPERS, small, model="small").shape == (5, 8)
+    assert embed_papers(PAPERS, large, model="large").shape == (5, 16)
+    ranked = rank_papers(PAPERS, "topic", embed_fn=large, model="large")
+    assert len(ranked) == 5
+
+
+def test_embeddings_without_a_model_are_not_cached():
+    calls = []
+    small = embedder(8, 0)
+    def counting(texts):
+        calls.append(len(texts))
+        return small(texts)
+    embed_papers(PAPERS, counting)
+    embed_papers(PAPERS, counting)
+    assert calls == [5, 5]
+    embed_papers(PAPERS, counting, model="small")
+    embed_papers(PAPERS, counting, model="small")
+    assert calls == [5, 5, 5]
+
+
+def test_no_papers_embed_to_an_empty_array():
+    def never(texts):
+        raise AssertionError("Nothing to embed")
+    assert embed_papers([], never).shape == (0, 0)
+    assert embed_papers([], never, model="small").shape == (0, 0)
+    assert rank_papers([], "topic", embed_fn=embedder(8, 0)) == []
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from literer import scholar
+from mocks import MockScholarServer, make_corpus
+
+
+@pytest.fixture
+def fast_client():
+    original = scholar.get_client()
+    # No client-side throttling against the local server
+    scholar.set_client(scholar.ScholarClient(rate=1e6, burst=1e6, backoff=0.01))
+    yield
+    scholar.set_client(original)
+
+
+@pytest.fixture
+def server(fast_client):
+    with MockScholarServer(make_corpus(300)) as server:
+        yield server
+
+
+def test_get_papers_makes_one_search_request_per_query(server):
+    queries = ["q0", "q1", "q2"]
+    results = [scholar.get_papers(q, n_pubs=50) for q in queries]
+
+    assert [len(papers) for papers in results] == [50, 50, 50]
+    assert server.paths == {("GET", "/graph/v1/paper/search"): len(queries)}
+
+
+def test_get_papers_reads_every_field_from_the_search_response(server):
+    paper = scholar.get_papers("q0", n_pubs=1)[0]
+
+    assert paper["paperId"] == server.corpus[0]["paperId"]
+    assert paper["abstract"] and paper["bibtex"] and paper["doi"]
+    # No per-paper detail or batch lookups
+    assert sum(server.paths.values()) == 1
+
+
+@pytest.mark.parametrize("retry_after", ["0", "soon", "Wed, 21 Oct 2015 07:28:00 GMT"])
+def test_rate_limits_are_retried_whatever_the_retry_after_header(fast_client, retry_after):
+    with MockScholarServer(make_corpus(100), error_rate=0.5, seed=1,
+                           retry_after=retry_after) as server:
+        assert len(scholar.get_papers("q0", n_pubs=10)) == 10
+        assert server.requests > 1
+
+
+SEARCH = ("GET", "/graph/v1/paper/search")
+
+
+def test_iter_papers_pages_through_relevance_search(server):
+    ids = [p["paperId"] for p in scholar.iter_papers("q0", page_size=100, bulk=False)]
+    assert ids == [p["paperId"] for p in server.corpus]
+    assert server.paths == {SEARCH: 3}
+
+
+def test_iter_papers_stops_at_max_results(server):
+    papers = list(scholar.iter_papers("q0", max_results=5, page_size=2))
+    assert [p["paperId"] for p in papers] == [p["paperId"] for p in server.corpus[:5]]
+    # The third page holds the fifth paper, no page is fetched beyond it
+    assert server.paths == {SEARCH: 3}
+
+
+def test_iter_papers_prefetches_the_next_page(server):
+    papers = scholar.iter_papers("q0", page_size=10, bulk=False)
+    next(papers)
+    deadline = time.monotonic() + 5
+    while server.paths[SEARCH] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert server.paths[SEARCH] == 2
+    papers.close()
+
+
+def test_iter_papers_follows_bulk_search_tokens(fast_client):
+    with MockScholarServer(make_corpus(2500)) as server:
+        ids = [p["paperId"] for p in scholar.iter_papers("q0")]
+        assert ids == [p["paperId"] for p in server.corpus]
+        assert server.paths == {("GET", "/graph/v1/paper/search/bulk"): 3}
+
+
+BATCH = ("POST", "/graph/v1/paper/batch")
+
+
+def test_expand_citations_walks_the_graph_breadth_first(server):
+    ids = [p["paperId"] for p in server.corpus]
+    assert [p["paperId"] for p in scholar.expand_citations([ids[0]], depth=1)] == ids[1:3]
+
+    related = scholar.expand_citations([server.corpus[0]], depth=2)
+    assert sorted(p["paperId"] for p in related) == ids[1:7]
+    # One neighbour request per level, and one for the details of the related papers
+    assert server.paths[BATCH] == 2 + 3
+
+
+def test_expand_citations_deduplicates_and_keeps_the_most_linked(fast_client):
+    corpus = make_corpus(10)
+    s, a, b, c, x, y = [p["paperId"] for p in corpus[:6]]
+    graph = {s: [a, b, c], a: [x], b: [x], c: [x, y]}
+    with MockScholarServer(corpus, references=graph) as server:
+        related = scholar.expand_citations([s, s, a], depth=3, max_papers=3)
+        ids = [p["paperId"] for p in related]
+        # x is linked to three visited papers, the seeds are never returned
+        assert ids[0] == x
+        assert len(ids) == len(set(ids)) == 3
+        assert s not in ids and a not in ids
+        assert set(ids) <= {b, c, x}
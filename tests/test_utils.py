@@ -0,0 +1,51 @@
+import pytest
+
+import literer.utils
+from literer.utils import break_into_tokens, retry_delay
+
+
+class CharacterEncoding:
+    """Offline encoding with one token per character, decoding like tiktoken's."""
+    def encode_ordinary(self, text):
+        return list(text)
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(t) for t in texts]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@pytest.fixture
+def characters(monkeypatch):
+    monkeypatch.setattr(literer.utils, "get_encoding", lambda model: CharacterEncoding())
+
+
+def test_overlap_keeps_separators(characters):
+    chunks = break_into_tokens("A.\n\nB.\n\nCcccccc.", n_tokens=14, model="gpt-4", overlap=4)
+    assert chunks == ["A.\n\nB.", "\n\nB.\n\nCcccccc."]
+
+
+def test_oversized_paragraph_keeps_whitespace(characters):
+    chunks = break_into_tokens("One.\nTwo!  Three?\tFour.", n_tokens=12, model="gpt-4")
+    assert chunks == ["One.\nTwo!", "Three?\tFour."]
+
+
+@pytest.mark.parametrize("stable", [False, True])
+def test_chunks_with_overlap_fit_n_tokens(characters, stable):
+    text = "A.\n\nB.\n\nCccccccccc.\n\n" + "\n\n".join(
+        "Word " * (i % 7) + "end. Next one!" for i in range(30))
+    for n_tokens, overlap in [(14, 4), (20, 8), (30, 1), (12, 11)]:
+        chunks = break_into_tokens(
+            text, n_tokens, model="gpt-4", overlap=overlap, stable=stable)
+        assert all(len(chunk) <= n_tokens for chunk in chunks)
+        assert chunks[-1].endswith("Next one!")
+
+
+def test_retry_delay_honours_retry_after_and_ignores_malformed_ones():
+    assert retry_delay(0, backoff=1, max_backoff=60, retry_after="7") == 7
+    assert retry_delay(0, backoff=1, max_backoff=5, retry_after="7") == 5
+    assert retry_delay(0, backoff=1, max_backoff=60,
+                       retry_after="Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    for malformed in ["soon", "Mon, 99 Foo", None]:
+        assert 0 <= retry_delay(3, backoff=1, max_backoff=60, retry_after=malformed) <= 8